@@ -0,0 +1,203 @@
+# BatchSolitaireEnvClass.py
+# Laurence Smith
+
+# Plays N games of solitaire at once with everything held in stacked numpy arrays, so one call to
+# step moves cards in every game without looping over games in python.
+# Same layout as CompactPositionClass (card id per slot, pile lengths and face down counts with piles
+# in observation order), same rules as PositionClass and the same rewards as
+# OpenAiGymSolitaireClass.calculate_reward, games that finish are dealt again automatically.
+
+import numpy as np
+
+from CardTables import ACTION_DECODE, STOCK_TO_WASTE, WASTE_TO_FOUNDATION, TABLEAU_TO_FOUNDATION
+from CompactPositionClass import NUM_ROWS, ROW_LEN, STOCK, WASTE, TABLEAU, CARD_VALUE, CARD_SUIT, CARD_RED
+
+_VALUE = np.array(CARD_VALUE, dtype=np.int16)
+_SUIT = np.array(CARD_SUIT, dtype=np.int16)
+_RED = np.array(CARD_RED, dtype=bool)
+_COLUMNS = np.arange(ROW_LEN)
+
+# where each card of a dealt deck goes, same as CompactPositionClass.setUpFromDeck
+_DEAL_ROW = np.array([TABLEAU + i for i in range(7) for j in range(i + 1)] + [STOCK] * 24)
+_DEAL_COL = np.array([j for i in range(7) for j in range(i + 1)] + list(range(24)))
+_DEAL_LENGTHS = np.array([0, 0, 0, 0, 24, 0] + [i + 1 for i in range(7)], dtype=np.int16)
+_DEAL_FACE_DOWN = np.array([0, 0, 0, 0, 0, 0] + [i for i in range(7)], dtype=np.int16)
+
+class BatchSolitaireEnvClass():
+    """ N games of solitaire stepped together, actions are indexes into move_enumeration.csv as in OpenAiGymSolitaireClass """
+    def __init__(self, num_envs, seed=None, max_episode_steps=1000) -> None:
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps # games are truncated after this many moves, None for no limit
+        self.rng = np.random.default_rng(seed)
+
+        # every kind of move takes the top num cards off src and puts them on dst, dst is -1 for foundations as it's worked out from the card
+        decoded = np.array([(move.kind, move.source, move.destination, move.count) for move in ACTION_DECODE], dtype=np.int16)
+        self.action_kind, self.action_src, self.action_dst, self.action_num = decoded.T
+        self.num_actions = len(decoded)
+
+        self.cards = np.zeros((num_envs, NUM_ROWS, ROW_LEN), dtype=np.int8)
+        self.lengths = np.zeros((num_envs, NUM_ROWS), dtype=np.int16)
+        self.faceDown = np.zeros((num_envs, NUM_ROWS), dtype=np.int16)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.deal(np.arange(num_envs))
+    #end __init__
+
+    def deal(self, games, decks=None):
+        """ start new games in the given slots, decks is an array of card ids in deal order for each game, random if None """
+        games = np.asarray(games)
+        if decks is None:
+            decks = np.argsort(self.rng.random((len(games), 52)), axis=1)
+        self.cards[games[:, None], _DEAL_ROW, _DEAL_COL] = decks
+        self.lengths[games] = _DEAL_LENGTHS
+        self.faceDown[games] = _DEAL_FACE_DOWN
+        self.steps[games] = 0
+    #end deal
+
+    def reset(self, seed=None, decks=None):
+        """ deals new games in every slot and returns the (N,13,24) observations """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.deal(np.arange(self.num_envs), decks)
+        return self.observations()
+    #end reset
+
+    def observations(self):
+        """ (N,13,24) int32 observations, same encoding as OpenAiGymSolitaireClass """
+        obs = np.where(_COLUMNS < self.lengths[:, :, None], self.cards, -2).astype(np.int32)
+        obs[_COLUMNS < self.faceDown[:, :, None]] = -1
+        return obs
+    #end observations
+
+    def calculate_rewards(self):
+        """ OpenAiGymSolitaireClass.calculate_reward for every game at once """
+        foundation_cards = self.lengths[:, :STOCK].sum(axis=1)
+        visible = self.lengths[:, TABLEAU:].sum(axis=1) - self.faceDown[:, TABLEAU:].sum(axis=1)
+        return np.where(foundation_cards == 52, 1000, visible + 5 * foundation_cards)
+    #end calculate_rewards
+
+    def _moves(self, games, actions):
+        """ works out the move for each (game, action) pair, arrays broadcast against each other
+            returns legal, src, dst, num, reverse """
+        kind = self.action_kind[actions]
+        src = self.action_src[actions]
+        dst = self.action_dst[actions]
+        num = self.action_num[actions]
+        lengths = self.lengths
+
+        # stock to waste turns up to 3 cards over, or turns the whole waste back over if the stock is empty
+        isStock = kind == STOCK_TO_WASTE
+        stockLen = lengths[games, STOCK]
+        wasteLen = lengths[games, WASTE]
+        recycle = isStock & (stockLen == 0)
+        src = np.where(recycle, WASTE, src)
+        dst = np.where(recycle, STOCK, dst)
+        num = np.where(isStock, np.where(recycle, wasteLen, np.minimum(3, stockLen)), num)
+
+        srcLen = lengths[games, src]
+        card = self.cards[games, src, np.clip(srcLen - num, 0, ROW_LEN - 1)] # bottom card being moved
+        card = np.maximum(card, 0)
+        value = _VALUE[card]
+
+        toFoundation = (kind == WASTE_TO_FOUNDATION) | (kind == TABLEAU_TO_FOUNDATION)
+        dst = np.where(toFoundation, _SUIT[card], dst)
+        dstLen = lengths[games, dst]
+        top = np.maximum(self.cards[games, dst, np.maximum(dstLen - 1, 0)], 0)
+
+        enough = (num >= 1) & (num <= srcLen) & (srcLen - num >= self.faceDown[games, src])
+        foundationOk = dstLen == value - 1
+        tableauOk = np.where(dstLen == 0, value == 13, (_RED[card] != _RED[top]) & (_VALUE[top] == value + 1))
+        legal = enough & np.where(isStock, True, np.where(toFoundation, foundationOk, tableauOk) & (src != dst))
+        return legal, src, dst, num, isStock
+    #end _moves
+
+    def action_masks(self):
+        """ (N,548) boolean array, True where the action is legal in that game """
+        games = np.arange(self.num_envs)[:, None]
+        actions = np.arange(self.num_actions)[None, :]
+        return self._moves(games, actions)[0]
+    #end action_masks
+
+    def step(self, actions):
+        """ does actions[i] in game i, returns observations, rewards, terminated, truncated, info
+            finished games are dealt again and info["final_observation"] holds their last observation """
+        actions = np.asarray(actions)
+        games = np.arange(self.num_envs)
+        legal, src, dst, num, reverse = self._moves(games, actions)
+
+        g = games[legal]
+        src = src[legal]
+        dst = dst[legal]
+        num = num[legal]
+        reverse = reverse[legal]
+        srcLen = self.lengths[g, src]
+        dstLen = self.lengths[g, dst]
+        for k in range(int(num.max()) if len(num) > 0 else 0):
+            m = k < num
+            fromCol = np.where(reverse[m], srcLen[m] - 1 - k, srcLen[m] - num[m] + k)
+            self.cards[g[m], dst[m], dstLen[m] + k] = self.cards[g[m], src[m], fromCol]
+        self.lengths[g, src] -= num
+        self.lengths[g, dst] += num
+
+        # turn over new top card of tableau piles cards were taken from
+        newLen = self.lengths[g, src]
+        flip = (newLen > 0) & (self.faceDown[g, src] == newLen)
+        self.faceDown[g[flip], src[flip]] -= 1
+
+        self.steps += 1
+        rewards = np.where(legal, self.calculate_rewards(), -1000)
+        terminated = ~legal
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        if self.max_episode_steps is not None:
+            truncated = legal & (self.steps >= self.max_episode_steps)
+
+        observations = self.observations()
+        done = terminated | truncated
+        info = {"_final_observation": done, "final_observation": observations[done]}
+        if done.any():
+            finished = games[done]
+            self.deal(finished)
+            observations[finished] = self.observations()[finished]
+        return observations, rewards, terminated, truncated, info
+    #end step
+#end BatchSolitaireEnvClass
+
+def testBatchSolitaireEnvClass(numEnvs=64, numSteps=300):
+    """ play the same random legal moves in a batch and in CompactPositionClass positions and check they agree """
+    from CardTables import MOVE_ENUMERATION
+    from CompactPositionClass import CompactPositionClass
+    rng = np.random.default_rng(0)
+    batch = BatchSolitaireEnvClass(numEnvs, max_episode_steps=None)
+    decks = np.argsort(rng.random((numEnvs, 52)), axis=1)
+    batch.reset(decks=decks)
+    positions = []
+    for deck in decks:
+        pos = CompactPositionClass()
+        pos.setUpFromDeck([int(c) for c in deck])
+        positions.append(pos)
+    moves = MOVE_ENUMERATION
+    for step in range(numSteps):
+        masks = batch.action_masks()
+        actions = np.array([rng.choice(np.flatnonzero(mask)) if mask.any() else 0 for mask in masks])
+        # now and again do an illegal move to check it ends the game
+        illegal = rng.random(numEnvs) < 0.01
+        actions[illegal] = rng.integers(0, batch.num_actions, illegal.sum())
+        legal = masks[np.arange(numEnvs), actions]
+        obs, rewards, terminated, truncated, info = batch.step(actions)
+        assert (terminated == ~legal).all()
+        for i, pos in enumerate(positions):
+            assert pos.moveByNumber(int(moves[actions[i]])) == legal[i]
+            if legal[i]:
+                assert (pos.toObservation() == obs[i]).all(), "positions differ"
+                foundation = pos.countFoundationCards()
+                assert rewards[i] == (1000 if foundation == 52 else pos.countVisibleTableauCards() + 5 * foundation)
+            else:
+                positions[i] = pos = CompactPositionClass()
+                pos.setUpFromDeck([int(c) for c in batch.cards[i][_DEAL_ROW, _DEAL_COL]])
+                assert (pos.toObservation() == obs[i]).all(), "new deal differs"
+    print("testBatchSolitaireEnvClass passed")
+#end testBatchSolitaireEnvClass
+
+if __name__ == "__main__":
+    #testBatchSolitaireEnvClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,87 @@
+# CardTables.py
+# Laurence Smith
+
+# The contents of deckdetails.csv and move_enumeration.csv as plain python/numpy tables, so importing the
+# game or making an environment doesn't need pandas or to read any files. The csv files are still there to
+# look at, testCardTables checks these tables match them.
+# Also every moveByNumber code decoded once into a MoveRecord so nothing has to pick digits out of the code.
+
+from collections import namedtuple
+
+import numpy as np
+
+VALUE_TEXT = ("A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K")
+SUIT_TEXT = ("clubs", "diamonds", "hearts", "spades") # suit number is the position in this, also the foundation pile
+SUIT_UNICODE = (9827, 9830, 9829, 9824) # ♣ ♦ ♥ ♠
+SUIT_COLOUR = ("black", "red", "red", "black")
+
+# columns of deckdetails.csv indexed by card id (suit number * 13 + value - 1), DeckClass reads these
+DECK_DETAILS = {
+    "ID": tuple(range(52)),
+    "ValueText": VALUE_TEXT * 4,
+    "ValueNum": tuple(range(1, 14)) * 4,
+    "SuitText": tuple(suit for suit in SUIT_TEXT for value in range(13)),
+    "SuitNum": tuple(suit for suit in range(4) for value in range(13)),
+    "SuitUnicode": tuple(code for code in SUIT_UNICODE for value in range(13)),
+    "Colour": tuple(colour for colour in SUIT_COLOUR for value in range(13)),
+}
+
+# move_enumeration.csv, the moveByNumber code for each action 0 to 547
+MOVE_ENUMERATION = np.array(
+    [1, 2]
+    + [10 + t for t in range(7)]                    # tableau to foundation
+    + [20 + t for t in range(7)]                    # waste to tableau
+    + [100 + 10 * f + t for f in range(4) for t in range(7)] # foundation to tableau
+    + [10000 + 1000 * i + 100 * j + k for i in range(7) for j in range(7) if j != i for k in range(1, 13)], # k cards tableau i to j
+    dtype=np.int64)
+MOVE_TO_ACTION = {int(move): action for action, move in enumerate(MOVE_ENUMERATION)}
+
+# kinds of move
+STOCK_TO_WASTE = 0
+WASTE_TO_FOUNDATION = 1
+TABLEAU_TO_FOUNDATION = 2
+WASTE_TO_TABLEAU = 3
+FOUNDATION_TO_TABLEAU = 4
+TABLEAU_TO_TABLEAU = 5
+MOVE_KINDS = ("stock_to_waste", "waste_to_foundation", "tableau_to_foundation", "waste_to_tableau", "foundation_to_tableau", "tableau_to_tableau")
+
+# piles numbered as in the observation, same as CompactPositionClass: 0-3 foundations, 4 stock, 5 waste, 6-12 tableau
+STOCK_ROW = 4
+WASTE_ROW = 5
+TABLEAU_ROW = 6
+
+# a move code taken apart, source and destination are piles numbered as above, destination is -1 for moves to the
+# foundations as that depends on the card, count is the most cards moved (stock to waste turns up to 3, or recycles)
+MoveRecord = namedtuple("MoveRecord", ["code", "kind", "source", "destination", "count"])
+
+def _moveRecords():
+    records = [MoveRecord(1, STOCK_TO_WASTE, STOCK_ROW, WASTE_ROW, 3), MoveRecord(2, WASTE_TO_FOUNDATION, WASTE_ROW, -1, 1)]
+    records += [MoveRecord(10 + t, TABLEAU_TO_FOUNDATION, TABLEAU_ROW + t, -1, 1) for t in range(7)]
+    records += [MoveRecord(20 + t, WASTE_TO_TABLEAU, WASTE_ROW, TABLEAU_ROW + t, 1) for t in range(7)]
+    records += [MoveRecord(100 + 10 * f + t, FOUNDATION_TO_TABLEAU, f, TABLEAU_ROW + t, 1) for f in range(4) for t in range(7)]
+    # up to 13 cards (a whole run K to A), the enumeration only goes to 12
+    records += [MoveRecord(10000 + 1000 * i + 100 * j + k, TABLEAU_TO_TABLEAU, TABLEAU_ROW + i, TABLEAU_ROW + j, k)
+                for i in range(7) for j in range(7) if j != i for k in range(1, 14)]
+    return records
+
+MOVE_DECODE = {record.code: record for record in _moveRecords()} # every code moveByNumber can do something with
+ACTION_DECODE = tuple(MOVE_DECODE[int(move)] for move in MOVE_ENUMERATION) # MoveRecord for each action
+
+def testCardTables():
+    """ the tables are the same as the csv files """
+    import pandas as pd
+    deckDetails = pd.read_csv("deckdetails.csv")
+    for column, values in DECK_DETAILS.items():
+        assert list(deckDetails[column]) == list(values), column
+    moveEnumeration = pd.read_csv("move_enumeration.csv")
+    assert list(moveEnumeration["enumeration"]) == list(range(len(MOVE_ENUMERATION)))
+    assert list(moveEnumeration["move"]) == list(MOVE_ENUMERATION)
+    for action, record in enumerate(ACTION_DECODE):
+        assert record.code == MOVE_ENUMERATION[action] and MOVE_TO_ACTION[record.code] == action
+    print("CardTables ok")
+#end testCardTables
+
+if __name__ == "__main__":
+    #testCardTables()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,483 @@
+# CompactPositionClass.py
+# Laurence Smith
+
+# Array backed alternative to PositionClass for when speed matters (training, search).
+# Same moves and same moveByNumber codes as PositionClass but instead of CardClass objects
+# every card is just its id 0 to 51 from deckdetails.csv, so making a move only shuffles a few
+# bytes around and nothing is ever deep copied.
+
+# The game is stored as:
+#   cards    - 13 piles of 24 slots, card id in each slot, pile r starts at r*ROW_LEN
+#   lengths  - number of cards in each pile
+#   faceDown - number of face down cards at the bottom of each pile (only the tableau has any)
+# piles are in the same order as the observation in OpenAiGymSolitaireClass:
+#   0-3 foundations (clubs, diamonds, hearts, spades), 4 stock, 5 waste, 6-12 tableau 0 to 6
+
+import random
+import numpy as np
+
+from CardTables import DECK_DETAILS, MOVE_DECODE, STOCK_TO_WASTE, WASTE_TO_FOUNDATION, TABLEAU_TO_FOUNDATION, WASTE_TO_TABLEAU, FOUNDATION_TO_TABLEAU
+from PositionClass import ZOBRIST_KEYS, ZOBRIST_VALUES, computeZobrist, MoveResult, MOVED, ILLEGAL, UNKNOWN
+
+NUM_ROWS = 13
+ROW_LEN = 24    # longest any pile can get (the stock at the start)
+STOCK = 4
+WASTE = 5
+TABLEAU = 6     # row of tableau pile 0
+
+# card attributes indexed by card id
+CARD_VALUE = tuple(int(v) for v in DECK_DETAILS["ValueNum"])     # 1 is A, 13 is K
+CARD_SUIT = tuple(int(s) for s in DECK_DETAILS["SuitNum"])       # also the foundation pile for the card
+CARD_RED = tuple(c == "red" for c in DECK_DETAILS["Colour"])
+CARD_GAME_STR = tuple("{0}{1}".format(t, chr(u)) for t, u in zip(DECK_DETAILS["ValueText"], DECK_DETAILS["SuitUnicode"]))
+SUIT_TEXT = ("clubs", "diamonds", "hearts", "spades")
+
+class CompactPositionClass():
+    """ hold all the cards needed for a game as small integer arrays """
+    def __init__(self):
+        self.cards = bytearray(NUM_ROWS * ROW_LEN)
+        self.lengths = bytearray(NUM_ROWS)
+        self.faceDown = bytearray(NUM_ROWS)
+        self.zobrist = 0 # hash of the position, same as PositionClass.zobrist, kept up to date by the move methods
+        self.version = 0 # goes up by one every time cards move
+        self.visibleTableauCards = 0 # running counts for the reward, kept up to date by the move methods
+        self.foundationCards = 0
+        self.undoLog = [] # (move, src, dst, n, reverse, turned over) for each move made with push, so pop can take it back
+        self._lastTransfer = None # what the last move did, for push
+        self._lastTurnedOver = False
+        self._observation = None # toObservation result, only brought up to date when asked for
+        self._observationVersion = -1
+        self._dirtyRows = set(range(NUM_ROWS)) # piles changed since _observation was last brought up to date
+    #end __init__
+
+    def copy(self):
+        """ cheap copy of the position, just copies the three arrays """
+        other = CompactPositionClass.__new__(CompactPositionClass)
+        other.cards = self.cards[:]
+        other.lengths = self.lengths[:]
+        other.faceDown = self.faceDown[:]
+        other.zobrist = self.zobrist
+        other.version = self.version
+        other.visibleTableauCards = self.visibleTableauCards
+        other.foundationCards = self.foundationCards
+        other.undoLog = self.undoLog[:]
+        other._lastTransfer = None
+        other._lastTurnedOver = False
+        other._observation = None
+        other._observationVersion = -1
+        other._dirtyRows = set(range(NUM_ROWS))
+        return other
+    #end copy
+
+    def pileCards(self, row):
+        """ list of card ids in pile row, bottom card first """
+        start = row * ROW_LEN
+        return list(self.cards[start:start + self.lengths[row]])
+
+    def _cardText(self, row, j, game):
+        card = self.cards[row * ROW_LEN + j]
+        visible = j >= self.faceDown[row]
+        if game:
+            return CARD_GAME_STR[card] if visible else "##"
+        return "{0} visible: {1}".format(CARD_GAME_STR[card], visible)
+
+    def _pileText(self, row, game):
+        if row < STOCK and self.lengths[row] == 0:
+            return "empty foundation pile for suit " + SUIT_TEXT[row]
+        return ", ".join([self._cardText(row, j, game) for j in range(self.lengths[row])])
+
+    def _positionText(self, game):
+        tableauStr = "Tableau:\n"
+        for i in range(7):
+            tableauStr = tableauStr + "Pile " + str(i) + ": " + self._pileText(TABLEAU + i, game) + "\n"
+
+        return ("Position:\n"
+            + "Foundation Clubs: " + self._pileText(0, game) + "\n"
+            + "Foundation Diamonds: " + self._pileText(1, game) + "\n"
+            + "Foundation Hearts: " + self._pileText(2, game) + "\n"
+            + "Foundation Spades: " + self._pileText(3, game) + "\n"
+            + "Stock: " + self._pileText(STOCK, game) + "\n"
+            + "Waste: " + self._pileText(WASTE, game) + "\n"
+            + tableauStr)
+
+    def __str__(self) -> str:
+        return self._positionText(game=False)
+
+    def gameStr(self) -> str:
+        return self._positionText(game=True)
+
+    def setUp(self, seed=None):
+        """put everything into position to start a random game, deals the same cards as PositionClass.setUp for the same random state or seed"""
+        deck = list(range(52))
+        if seed is None:
+            random.shuffle(deck)
+        else:
+            random.Random(seed).shuffle(deck)
+        self.setUpFromDeck(deck)
+    #end setUp
+
+    @classmethod
+    def fromPosition(cls, position):
+        """ a CompactPositionClass holding the same cards as a PositionClass, including its face down cards """
+        compact = cls()
+        for row, pile in enumerate(position.piles):
+            start = row * ROW_LEN
+            compact.cards[start:start + len(pile.cards)] = bytes(int(card.id) for card in pile.cards)
+            compact.lengths[row] = len(pile.cards)
+            if row >= TABLEAU:
+                compact.faceDown[row] = sum(1 for card in pile.cards if not card.visible)
+        compact.zobrist = computeZobrist(compact.toObservation())
+        compact.visibleTableauCards = position.countVisibleTableauCards()
+        compact.foundationCards = position.countFoundationCards()
+        return compact
+    #end fromPosition
+
+    def setUpFromDeck(self, deck):
+        """ deal a given order of the 52 card ids, first 28 go to the tableau, the rest to the stock """
+        self.lengths[:] = bytes(NUM_ROWS)
+        self.faceDown[:] = bytes(NUM_ROWS)
+        k = 0
+        for i in range(7):
+            start = (TABLEAU + i) * ROW_LEN
+            self.cards[start:start + i + 1] = bytes(deck[k:k + i + 1])
+            self.lengths[TABLEAU + i] = i + 1
+            self.faceDown[TABLEAU + i] = i   # only the top card is face up
+            k += i + 1
+        start = STOCK * ROW_LEN
+        self.cards[start:start + 24] = bytes(deck[k:])
+        self.lengths[STOCK] = 24
+        self.visibleTableauCards = 7
+        self.foundationCards = 0
+        self.undoLog = []
+        self._dirtyRows.update(range(NUM_ROWS))
+        self.version += 1
+        self.zobrist = computeZobrist(self.toObservation())
+    #end setUpFromDeck
+
+    def _transfer(self, src, dst, n, reverse):
+        """ move the top n cards of pile src onto pile dst, reverse=True turns them over one at a time like dealing """
+        cards = self.cards
+        srcEnd = src * ROW_LEN + self.lengths[src]
+        dstStart = dst * ROW_LEN + self.lengths[dst]
+        if reverse:
+            cards[dstStart:dstStart + n] = cards[srcEnd - n:srcEnd][::-1]
+        else:
+            cards[dstStart:dstStart + n] = cards[srcEnd - n:srcEnd]
+        self.lengths[src] -= n
+        self.lengths[dst] += n
+        self._lastTransfer = (src, dst, n, reverse)
+        self._dirtyRows.add(src)
+        self._dirtyRows.add(dst)
+        self.version += 1
+
+        # cards moved are always face up
+        if src < STOCK:
+            self.foundationCards -= n
+        elif src >= TABLEAU:
+            self.visibleTableauCards -= n
+        if dst < STOCK:
+            self.foundationCards += n
+        elif dst >= TABLEAU:
+            self.visibleTableauCards += n
+
+        # moved cards are all face up, XOR out their old places and XOR in their new ones
+        h = self.zobrist
+        for k in range(n):
+            card = cards[dstStart + k] + 1
+            srcSlot = srcEnd - 1 - k if reverse else srcEnd - n + k
+            h ^= ZOBRIST_KEYS[srcSlot * ZOBRIST_VALUES + card] ^ ZOBRIST_KEYS[(dstStart + k) * ZOBRIST_VALUES + card]
+        self.zobrist = h
+    #end _transfer
+
+    def _turnOverTop(self, row):
+        """ make the new top card of a tableau pile visible """
+        if self.lengths[row] > 0 and self.faceDown[row] == self.lengths[row]:
+            self.faceDown[row] -= 1
+            self.visibleTableauCards += 1
+            self._lastTurnedOver = True
+            self._dirtyRows.add(row)
+            slot = row * ROW_LEN + self.faceDown[row]
+            self.zobrist ^= ZOBRIST_KEYS[slot * ZOBRIST_VALUES] ^ ZOBRIST_KEYS[slot * ZOBRIST_VALUES + self.cards[slot] + 1]
+    #end _turnOverTop
+
+    def _turnBackOver(self, row):
+        """ undo _turnOverTop, the lowest face up card of the pile goes face down again """
+        slot = row * ROW_LEN + self.faceDown[row]
+        self.faceDown[row] += 1
+        self.visibleTableauCards -= 1
+        self._dirtyRows.add(row)
+        self.zobrist ^= ZOBRIST_KEYS[slot * ZOBRIST_VALUES] ^ ZOBRIST_KEYS[slot * ZOBRIST_VALUES + self.cards[slot] + 1]
+    #end _turnBackOver
+
+    def push(self, num):
+        """ make move num (a moveByNumber code) so that it can be taken back with pop, returns False if the move isn't legal """
+        self._lastTurnedOver = False
+        if not self.moveByNumber(num):
+            return False
+        self.undoLog.append((num,) + self._lastTransfer + (self._lastTurnedOver,))
+        return True
+    #end push
+
+    def pop(self):
+        """ take back the last move made with push and return its code, the position is exactly as it was before the move """
+        num, src, dst, n, reverse, turnedOver = self.undoLog.pop()
+        if turnedOver:
+            self._turnBackOver(src)
+        self._transfer(dst, src, n, reverse)
+        return num
+    #end pop
+
+    def _canAddToTableau(self, card, row):
+        """ same rules as TableauPileClass.addCard """
+        length = self.lengths[row]
+        if length == 0:
+            return CARD_VALUE[card] == 13
+        top = self.cards[row * ROW_LEN + length - 1]
+        return CARD_RED[card] != CARD_RED[top] and CARD_VALUE[top] == CARD_VALUE[card] + 1
+    #end _canAddToTableau
+
+    def _canAddToFoundation(self, card):
+        """ same rules as FoundationPileClass.addCard, a foundation only ever holds A up to its length in its suit """
+        return self.lengths[CARD_SUIT[card]] == CARD_VALUE[card] - 1
+
+    def moveStockToWaste(self):
+        """ moves cards from stock to waste or all back to stock if stock is empty """
+        stockLen = self.lengths[STOCK]
+        if stockLen == 0:
+            wasteLen = self.lengths[WASTE]
+            if wasteLen == 0:
+                # no stock or waste so can't do move
+                return False
+            # move waste back to stock, the bottom card in waste becomes top card in stock
+            self._transfer(WASTE, STOCK, wasteLen, True)
+            return True
+        # cards in stock so move 3 cards from stock to waste (or fewer if fewer available)
+        self._transfer(STOCK, WASTE, min(3, stockLen), True)
+        return True
+    #end moveStockToWaste
+
+    def moveWasteToFoundation(self):
+        """ moves a card from Waste to correct Foundation """
+        length = self.lengths[WASTE]
+        if length == 0:
+            return False
+        card = self.cards[WASTE * ROW_LEN + length - 1]
+        if not self._canAddToFoundation(card):
+            return False
+        self._transfer(WASTE, CARD_SUIT[card], 1, False)
+        return True
+    #end moveWasteToFoundation
+
+    def moveTableauToFoundation(self, tableauNum):
+        """ moves a card from Tableau to correct Foundation """
+        if tableauNum < 0 or tableauNum > 6:
+            return False
+        row = TABLEAU + tableauNum
+        length = self.lengths[row]
+        if length == 0:
+            return False
+        card = self.cards[row * ROW_LEN + length - 1]
+        if not self._canAddToFoundation(card):
+            return False
+        self._transfer(row, CARD_SUIT[card], 1, False)
+        self._turnOverTop(row)
+        return True
+    #end moveTableauToFoundation
+
+    def moveFoundationToTableau(self, foundationNum, tableauNum):
+        """ moves a card from Foundation to Tableau """
+        if tableauNum < 0 or tableauNum > 6 or foundationNum < 0 or foundationNum > 3:
+            return False
+        length = self.lengths[foundationNum]
+        if length == 0:
+            return False
+        card = self.cards[foundationNum * ROW_LEN + length - 1]
+        if not self._canAddToTableau(card, TABLEAU + tableauNum):
+            return False
+        self._transfer(foundationNum, TABLEAU + tableauNum, 1, False)
+        return True
+    #end moveFoundationToTableau
+
+    def moveWasteToTableau(self, tableauNum):
+        """ moves card from Waste to Tableau """
+        if tableauNum < 0 or tableauNum > 6:
+            return False
+        length = self.lengths[WASTE]
+        if length == 0:
+            return False
+        card = self.cards[WASTE * ROW_LEN + length - 1]
+        if not self._canAddToTableau(card, TABLEAU + tableauNum):
+            return False
+        self._transfer(WASTE, TABLEAU + tableauNum, 1, False)
+        return True
+    #end moveWasteToTableau
+
+    def moveTableauToTableau(self, startTableauNum, endTableauNum, numCards):
+        """ moves cards from Tableau to another Tableau
+            numCards of 0 is never allowed (PositionClass would look at the bottom card of the pile) """
+        if startTableauNum < 0 or startTableauNum > 6 or endTableauNum < 0 or endTableauNum > 6:
+            return False
+        src = TABLEAU + startTableauNum
+        dst = TABLEAU + endTableauNum
+        length = self.lengths[src]
+        if numCards < 1 or numCards > length:
+            return False
+        if length - numCards < self.faceDown[src]:  # bottom card being moved is face down
+            return False
+        card = self.cards[src * ROW_LEN + length - numCards]
+        if not self._canAddToTableau(card, dst):
+            return False
+        self._transfer(src, dst, numCards, False)
+        self._turnOverTop(src)
+        return True
+    #end moveTableauToTableau
+
+    def moveByNumber(self, num):
+        """ takes a number in, which controls what move to do, same codes as PositionClass.moveByNumber (see CardTables.MOVE_DECODE) """
+        move = MOVE_DECODE.get(num)
+        if move is None: # not a move code
+            return False
+        kind = move.kind
+        if kind == STOCK_TO_WASTE:
+            return self.moveStockToWaste()
+        elif kind == WASTE_TO_FOUNDATION:
+            return self.moveWasteToFoundation()
+        elif kind == TABLEAU_TO_FOUNDATION:
+            return self.moveTableauToFoundation(move.source - TABLEAU)
+        elif kind == WASTE_TO_TABLEAU:
+            return self.moveWasteToTableau(move.destination - TABLEAU)
+        elif kind == FOUNDATION_TO_TABLEAU:
+            return self.moveFoundationToTableau(move.source, move.destination - TABLEAU)
+        return self.moveTableauToTableau(move.source - TABLEAU, move.destination - TABLEAU, move.count)
+    #end moveByNumber
+
+    def applyMoves(self, moves, stop=True):
+        """ same as PositionClass.applyMoves, a MoveResult for each move tried, stop=True stops at the first that isn't MOVED """
+        results = []
+        for num in moves:
+            move = MOVE_DECODE.get(num)
+            if move is None:
+                results.append(MoveResult(num, None, UNKNOWN))
+            elif self.moveByNumber(num):
+                results.append(MoveResult(num, move, MOVED))
+                continue
+            else:
+                results.append(MoveResult(num, move, ILLEGAL))
+            if stop:
+                break
+        return results
+    #end applyMoves
+
+    def legalMoves(self):
+        """ list of the moveByNumber codes that are legal in this position, same as PositionClass.legalMoves """
+        cards = self.cards
+        lengths = self.lengths
+        faceDown = self.faceDown
+        moves = []
+
+        if lengths[STOCK] > 0 or lengths[WASTE] > 0:
+            moves.append(1)
+
+        wasteCard = cards[WASTE * ROW_LEN + lengths[WASTE] - 1] if lengths[WASTE] > 0 else -1
+        if wasteCard >= 0 and self._canAddToFoundation(wasteCard):
+            moves.append(2)
+
+        for t in range(7):
+            length = lengths[TABLEAU + t]
+            if length > 0 and self._canAddToFoundation(cards[(TABLEAU + t) * ROW_LEN + length - 1]):
+                moves.append(10 + t)
+
+        if wasteCard >= 0:
+            for t in range(7):
+                if self._canAddToTableau(wasteCard, TABLEAU + t):
+                    moves.append(20 + t)
+
+        for f in range(4):
+            if lengths[f] > 0:
+                card = cards[f * ROW_LEN + lengths[f] - 1]
+                for t in range(7):
+                    if self._canAddToTableau(card, TABLEAU + t):
+                        moves.append(100 + 10*f + t)
+
+        # tableau to tableau, the face up part of a pile always runs down in value so only one
+        # number of cards from pile i can fit on pile j: enough to reach one below its top card (or a king if empty)
+        for i in range(7):
+            src = TABLEAU + i
+            length = lengths[src]
+            visible = length - faceDown[src]
+            if visible == 0:
+                continue
+            topValue = CARD_VALUE[cards[src * ROW_LEN + length - 1]]
+            for j in range(7):
+                if j == i:
+                    continue
+                dst = TABLEAU + j
+                if lengths[dst] == 0:
+                    numCards = 14 - topValue
+                else:
+                    numCards = CARD_VALUE[cards[dst * ROW_LEN + lengths[dst] - 1]] - topValue
+                if numCards >= 1 and numCards <= visible and self._canAddToTableau(cards[src * ROW_LEN + length - numCards], dst):
+                    moves.append(10000 + 1000*i + 100*j + numCards)
+        return moves
+    #end legalMoves
+
+    def toObservation(self, copy=False):
+        """ returns the position as a 13x24 matrix, same as PositionClass.toObservation
+            the matrix is kept between calls and only piles that have changed since the last call are written again,
+            returns a read only view of it that will change as moves are made unless copy=True """
+        if self._observationVersion != self.version:
+            if self._observation is None:
+                self._observation = np.full((NUM_ROWS, ROW_LEN), -2, dtype=np.int32)
+            cards = np.frombuffer(self.cards, dtype=np.uint8).reshape(NUM_ROWS, ROW_LEN)
+            for row in self._dirtyRows:
+                length = self.lengths[row]
+                obsRow = self._observation[row]
+                obsRow[:length] = cards[row, :length]
+                obsRow[length:] = -2
+                obsRow[:self.faceDown[row]] = -1
+            self._dirtyRows.clear()
+            self._observationVersion = self.version
+
+        if copy:
+            return self._observation.copy()
+        view = self._observation.view()
+        view.flags.writeable = False
+        return view
+    #end toObservation
+
+    def countVisibleTableauCards(self):
+        """ number of face up cards in the tableau """
+        return self.visibleTableauCards
+
+    def countFoundationCards(self):
+        """ number of cards on the foundation piles, 52 means the game is won """
+        return self.foundationCards
+
+    def isWon(self):
+        return self.foundationCards == 52
+#end CompactPositionClass
+
+def testCompactPositionClass(numGames=200, movesPerGame=200):
+    """ play random moves on a PositionClass and a CompactPositionClass dealt the same cards and check they always agree """
+    import PositionClass
+    codes = [1, 2] + list(range(10, 17)) + list(range(20, 27)) + list(range(100, 137)) \
+        + [10000 + 1000*i + 100*j + k for i in range(7) for j in range(7) for k in range(1, 13)]
+    for game in range(numGames):
+        state = random.getstate()
+        pos = PositionClass.PositionClass()
+        pos.setUp()
+        random.setstate(state)
+        compact = CompactPositionClass()
+        compact.setUp()
+        for move in range(movesPerGame):
+            assert (pos.toObservation() == compact.toObservation()).all(), "positions differ"
+            assert pos.gameStr() == compact.gameStr()
+            num = random.choice(codes)
+            assert pos.moveByNumber(num) == compact.moveByNumber(num), "move " + str(num) + " differs"
+    print("testCompactPositionClass passed")
+#end testCompactPositionClass
+
+if __name__ == "__main__":
+    #testCompactPositionClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,283 @@
+# DQNAgentClass.py
+# Laurence Smith
+
+# Deep Q-network agent, a keras model that maps the ObservationEncoderClass "flat" encoding of a position to
+# a value for each of the 548 actions, so unlike the q_table it can guess values for positions it has never
+# seen and it never grows: the model, the target network and the replay buffer are all made at the start.
+#   - action selection only ever looks at legal actions, illegal ones are set to -inf before the argmax and
+#     exploring picks a random legal action
+#   - it plays num_envs games at once in a BatchSolitaireEnvClass, every step encodes all of them into one
+#     (num_envs, 748) array and does one forward pass for all of them
+#   - the target network is a copy of the model updated every target_update learning steps, targets are
+#     double DQN (the model picks the best legal next action, the target network values it)
+#   - the replay buffer is fixed size numpy arrays, encodings stored as float16 and the legal actions of
+#     the next position as packed bits, about 3.1KB a transition
+#   - rewards are the change in OpenAiGymSolitaireClass's score (so a game's rewards add up to its final
+#     score) times reward_scale, a won game or one with no legal moves ends the episode
+# It only ever runs on the CPU, GPUs are hidden from keras before it is imported (this has to happen
+# before anything else imports keras). Any keras 3 backend works, set KERAS_BACKEND as usual.
+
+import os
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1" # tensorflow and torch
+os.environ["JAX_PLATFORMS"] = "cpu"
+
+import random
+import time
+
+import numpy as np
+import keras
+
+from BatchSolitaireEnvClass import BatchSolitaireEnvClass
+from ObservationEncoderClass import ObservationEncoderClass, FLAT
+from CardTables import MOVE_ENUMERATION
+
+NUM_ACTIONS = len(MOVE_ENUMERATION)
+
+def maskedArgmax(q, masks):
+    """ best legal action in each row of q, 0 for a row with nothing legal """
+    return np.where(masks, q, -np.inf).argmax(axis=1)
+
+class DQNAgentClass():
+    """ DQN trained on a batch of games at once """
+    def __init__(self, num_envs=64, hidden=(256, 256), learning_rate=1e-3, discount_factor=0.99, epsilon_start=1.0,
+                 epsilon_end=0.05, epsilon_decay_steps=20000, buffer_size=100000, batch_size=128, updates_per_step=1,
+                 target_update=1000, warmup=2000, max_episode_steps=1000, reward_scale=0.01, seed=None) -> None:
+        self.num_envs = num_envs
+        self.learning_rate = learning_rate
+        self.discount_factor = discount_factor
+        self.epsilon_start = epsilon_start
+        self.epsilon_end = epsilon_end
+        self.epsilon_decay_steps = epsilon_decay_steps # batched steps to go from epsilon_start to epsilon_end
+        self.batch_size = batch_size
+        self.updates_per_step = updates_per_step # learning steps for each batched step once the buffer has warmup transitions
+        self.target_update = target_update # learning steps between copies into the target network
+        self.warmup = warmup
+        self.max_episode_steps = max_episode_steps
+        self.reward_scale = reward_scale
+        self.rng = np.random.default_rng(seed)
+        if seed is not None:
+            keras.utils.set_random_seed(seed)
+
+        self.encoder = ObservationEncoderClass(FLAT)
+        self.features = self.encoder.features
+        self.model = self._buildModel(hidden)
+        self.target = self._buildModel(hidden)
+        self.target.set_weights(self.model.get_weights())
+
+        # replay buffer, a ring of buffer_size transitions
+        self.buffer_size = buffer_size
+        maskBytes = (NUM_ACTIONS + 7) // 8
+        self.observations = np.zeros((buffer_size, self.features), dtype=np.float16)
+        self.nextObservations = np.zeros((buffer_size, self.features), dtype=np.float16)
+        self.nextMasks = np.zeros((buffer_size, maskBytes), dtype=np.uint8) # legal actions in the next position, np.packbits
+        self.actions = np.zeros(buffer_size, dtype=np.int16)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.terminated = np.zeros(buffer_size, dtype=bool)
+        self.size = 0
+        self.next = 0
+
+        # minibatch arrays, the batch and its next positions go through the model in one forward pass
+        self._inputs = np.zeros((2 * batch_size, self.features), dtype=np.float32)
+        self._rows = np.arange(batch_size)
+
+        self.steps = 0 # batched steps played
+        self.updates = 0 # learning steps done
+        self.episodes = 0
+        self.losses = []
+    #end __init__
+
+    def _buildModel(self, hidden):
+        model = keras.Sequential([keras.Input((self.features,))] + [keras.layers.Dense(units, activation="relu") for units in hidden]
+                                 + [keras.layers.Dense(NUM_ACTIONS)])
+        model.compile(optimizer=keras.optimizers.Adam(self.learning_rate), loss=keras.losses.Huber())
+        return model
+
+    def epsilon(self):
+        """ exploration rate now, linear from epsilon_start to epsilon_end over epsilon_decay_steps batched steps """
+        fraction = min(1.0, self.steps / self.epsilon_decay_steps)
+        return self.epsilon_start + fraction * (self.epsilon_end - self.epsilon_start)
+
+    def q_values(self, observations):
+        """ (N, 548) values from one forward pass over (N, 748) encoded observations """
+        return np.asarray(self.model.predict_on_batch(observations))
+
+    def select_actions(self, observations, masks, epsilon=0.0):
+        """ epsilon-greedy legal action for each row, masks is (N, 548) as from BatchSolitaireEnvClass.action_masks """
+        actions = maskedArgmax(self.q_values(observations), masks)
+        explore = self.rng.random(len(actions)) < epsilon
+        if explore.any(): # a random number for each legal action, the biggest one is a uniform pick of the legal actions
+            actions[explore] = (self.rng.random((int(explore.sum()), NUM_ACTIONS)) * masks[explore]).argmax(axis=1)
+        return actions
+    #end select_actions
+
+    def act(self, env):
+        """ greedy legal action for the position in an OpenAiGymSolitaireClass """
+        observation = env.encode_observation(self.encoder.allocate(1), self.encoder)
+        return int(self.select_actions(observation, env.action_masks()[None])[0])
+
+    def _store(self, observations, actions, rewards, nextObservations, nextMasks, terminated):
+        """ add a batch of transitions to the ring, overwriting the oldest """
+        index = (self.next + np.arange(len(actions))) % self.buffer_size
+        self.observations[index] = observations
+        self.nextObservations[index] = nextObservations
+        self.nextMasks[index] = np.packbits(nextMasks, axis=1)
+        self.actions[index] = actions
+        self.rewards[index] = rewards
+        self.terminated[index] = terminated
+        self.next = (self.next + len(actions)) % self.buffer_size
+        self.size = min(self.size + len(actions), self.buffer_size)
+    #end _store
+
+    def learn(self):
+        """ one gradient step on a uniform minibatch from the replay buffer, returns the loss """
+        n = self.batch_size
+        index = self.rng.integers(0, self.size, n)
+        self._inputs[:n] = self.observations[index]
+        self._inputs[n:] = self.nextObservations[index]
+        q = self.q_values(self._inputs)
+        nextMasks = np.unpackbits(self.nextMasks[index], axis=1, count=NUM_ACTIONS).astype(bool)
+        best = maskedArgmax(q[n:], nextMasks)
+        nextValues = np.asarray(self.target.predict_on_batch(self._inputs[n:]))[self._rows, best]
+        nextValues[~nextMasks.any(axis=1)] = 0 # stuck, nothing to follow
+
+        # only the value of the action taken moves, every other output is trained towards what it already is
+        targets = q[:n]
+        actions = self.actions[index]
+        targets[self._rows, actions] = self.rewards[index] + self.discount_factor * np.where(self.terminated[index], 0, nextValues)
+        loss = float(self.model.train_on_batch(self._inputs[:n], targets))
+        self.updates += 1
+        if self.updates % self.target_update == 0:
+            self.target.set_weights(self.model.get_weights())
+        return loss
+    #end learn
+
+    def train(self, num_steps, seed=None, report_every=1000):
+        """ plays num_steps batched steps (num_envs moves each) learning as it goes, returns the final score of every game finished """
+        envs = BatchSolitaireEnvClass(self.num_envs, seed=seed, max_episode_steps=None) # truncation is done here so it can bootstrap
+        games = np.arange(self.num_envs)
+        observations = self.encoder.encode(envs, self.encoder.allocate(self.num_envs))
+        nextObservations = self.encoder.allocate(self.num_envs)
+        masks = envs.action_masks()
+        scores = envs.calculate_rewards()
+        finalScores = []
+        start = time.perf_counter()
+
+        for step in range(num_steps):
+            actions = self.select_actions(observations, masks, self.epsilon())
+            stuck = ~masks.any(axis=1) # its action is illegal, the game ends (and is dealt again by envs)
+            envs.step(actions)
+            self.steps += 1
+            newScores = envs.calculate_rewards()
+            won = newScores == 1000
+            truncated = envs.steps >= self.max_episode_steps if self.max_episode_steps is not None else np.zeros(self.num_envs, dtype=bool)
+            self.encoder.encode(envs, nextObservations)
+            nextMasks = envs.action_masks()
+            rewards = np.where(stuck, 0, newScores - scores) * self.reward_scale
+            self._store(observations, actions, rewards, nextObservations, nextMasks, stuck | won)
+
+            done = stuck | won | truncated
+            if done.any():
+                finalScores.extend(np.where(stuck, scores, newScores)[done].tolist())
+                self.episodes += int(done.sum())
+                finished = games[done & ~stuck]
+                if len(finished):
+                    envs.deal(finished)
+                self.encoder.encode(envs, nextObservations)
+                nextMasks = envs.action_masks()
+                newScores = envs.calculate_rewards()
+            observations, nextObservations = nextObservations, observations
+            masks = nextMasks
+            scores = newScores
+
+            if self.size >= self.warmup:
+                for update in range(self.updates_per_step):
+                    self.losses.append(self.learn())
+            if report_every and (step + 1) % report_every == 0:
+                recent = finalScores[-100:]
+                print(f"Step {step + 1}, episodes {self.episodes}, epsilon {self.epsilon():.2f}, "
+                      f"mean score (last 100) {np.mean(recent) if recent else 0:.1f}, {(step + 1) * self.num_envs / (time.perf_counter() - start):.0f} moves/s")
+        return finalScores
+    #end train
+
+    def evaluate(self, num_games=1000, first_seed=0, max_moves=None):
+        """ greedy play of the deals first_seed, first_seed + 1, ... (dealt as CompactPositionClass.setUp(seed)), num_envs at a time
+            returns the final scores in seed order, a game ends when it is won, stuck or has had max_moves (max_episode_steps if None) """
+        max_moves = max_moves or self.max_episode_steps or 1000
+        envs = BatchSolitaireEnvClass(self.num_envs, max_episode_steps=None)
+        observations = self.encoder.allocate(self.num_envs)
+        scores = []
+        for first in range(first_seed, first_seed + num_games, self.num_envs):
+            seeds = range(first, min(first + self.num_envs, first_seed + num_games))
+            decks = []
+            for seed in seeds:
+                deck = list(range(52))
+                random.Random(seed).shuffle(deck)
+                decks.append(deck)
+            envs.deal(np.arange(len(decks)), np.array(decks))
+            final = envs.calculate_rewards()
+            playing = np.arange(self.num_envs) < len(decks)
+            for move in range(max_moves):
+                masks = envs.action_masks()
+                playing &= masks.any(axis=1) & (final != 1000)
+                if not playing.any():
+                    break
+                actions = self.select_actions(self.encoder.encode(envs, observations), masks)
+                actions[~playing] = np.where(masks[~playing].any(axis=1), masks[~playing].argmax(axis=1), 0) # finished games just mark time
+                envs.step(actions)
+                final = np.where(playing, envs.calculate_rewards(), final)
+            scores.extend(final[:len(decks)].tolist())
+        return scores
+    #end evaluate
+
+    def save(self, filename):
+        """ saves the model (a .keras file), the target network and replay buffer aren't kept """
+        self.model.save(filename)
+
+    def load(self, filename):
+        self.model = keras.models.load_model(filename)
+        self.target.set_weights(self.model.get_weights())
+#end DQNAgentClass
+
+def testDQNAgentClass(numSteps=300):
+    """ masks are respected, memory doesn't grow, a short training run learns something and save/load round trips """
+    import tempfile
+    from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+    agent = DQNAgentClass(num_envs=32, hidden=(64,), buffer_size=4096, batch_size=64, warmup=256, target_update=50,
+                          epsilon_decay_steps=numSteps, seed=0)
+    envs = BatchSolitaireEnvClass(32, seed=1)
+    masks = envs.action_masks()
+    observations = agent.encoder.encode(envs)
+    for epsilon in (0.0, 0.5, 1.0):
+        actions = agent.select_actions(observations, masks, epsilon)
+        assert masks[np.arange(32), actions].all()
+
+    before = agent.evaluate(num_games=64)
+    bufferBytes = agent.observations.nbytes + agent.nextObservations.nbytes + agent.nextMasks.nbytes
+    start = time.perf_counter()
+    scores = agent.train(numSteps, seed=2, report_every=100)
+    seconds = time.perf_counter() - start
+    assert agent.size == 4096 and agent.observations.nbytes + agent.nextObservations.nbytes + agent.nextMasks.nbytes == bufferBytes
+    after = agent.evaluate(num_games=64)
+    print(f"{numSteps * 32 / seconds:.0f} moves/s training, {len(scores)} games, mean score before {np.mean(before):.1f} after {np.mean(after):.1f}")
+
+    env = OpenAiGymSolitaireClass()
+    env.reset(5)
+    for move in range(20):
+        action = agent.act(env)
+        assert action in env.legal_actions()
+        env.step(action)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "dqn.keras")
+        agent.save(filename)
+        loaded = DQNAgentClass(num_envs=32, hidden=(64,), buffer_size=16)
+        loaded.load(filename)
+        assert np.allclose(loaded.q_values(observations), agent.q_values(observations), atol=1e-5)
+        assert loaded.evaluate(num_games=64) == after
+    print("DQNAgentClass ok")
+#end testDQNAgentClass
+
+if __name__ == "__main__":
+    #testDQNAgentClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,359 @@
+# DealLibraryClass.py
+# Laurence Smith
+
+# A library of deals kept on disk so training, curriculum learning and benchmarks can pick deals with
+# known properties straight away instead of dealing and checking them as they go.
+# Every deal comes from a seed, dealt exactly as CompactPositionClass.setUp(seed) and PositionClass.setUp(seed)
+# do, so a deal can always be made again from its seed. A library is a directory holding
+#   header.json   number of deals and when the solver was run
+#   deals.bin     52 bytes a deal, the card ids in the order setUpFromDeck deals them
+#   meta.bin      a META_DTYPE record for each deal
+#     seed            the seed it was dealt from
+#     moves           legal moves in the starting position not counting turning the stock
+#     buried_aces     aces face down in the tableau
+#     ace_depth       cards on top of those aces, added up
+#     status          solver result, NOT_SOLVED until solve has been run on the deal
+#     solution_moves  length of the win the solver found
+#     nodes           positions the solver looked at, the harder the deal the more it needs
+#   index_<field>.bin deal numbers sorted by each field in INDEXED, rebuilt after add and solve
+# Everything is memory mapped, so opening a library of millions of deals reads nothing until it is used and
+# worker processes share the one copy in the page cache. query picks deals by ranges of the fields and/or
+# solver status, optionally in order of a field using its index, e.g. 1000 solvable hard deals:
+#   library.query(1000, status=SOLVABLE, order="nodes", descending=True)
+# and decks gives them as an array ready for BatchSolitaireEnvClass.deal.
+
+import json
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+from CompactPositionClass import CompactPositionClass, TABLEAU
+from SolverClass import SolverClass, SOLVABLE, UNSOLVABLE, UNKNOWN
+import PositionClass
+
+NOT_SOLVED = "not solved"
+STATUS_CODES = {NOT_SOLVED: -1, UNSOLVABLE: 0, SOLVABLE: 1, UNKNOWN: 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+META_DTYPE = np.dtype([("seed", "<u8"), ("moves", "u1"), ("buried_aces", "u1"), ("ace_depth", "u1"), ("status", "i1"),
+                       ("solution_moves", "<u2"), ("nodes", "<u4")])
+INDEXED = ("moves", "buried_aces", "ace_depth", "solution_moves", "nodes")
+DECK_SIZE = 52
+
+def seedDeck(seed):
+    """ card ids of the deal for seed, in setUpFromDeck order """
+    deck = list(range(DECK_SIZE))
+    random.Random(seed).shuffle(deck)
+    return deck
+
+def dealStats(deck):
+    """ (moves, buried_aces, ace_depth) for a deck, see the top of the file """
+    pos = CompactPositionClass()
+    pos.setUpFromDeck(deck)
+    moves = sum(move != 1 for move in pos.legalMoves())
+    buriedAces = 0
+    aceDepth = 0
+    k = 0
+    for i in range(7): # tableau pile i is the next i + 1 cards of the deck, only the last face up
+        for j in range(i + 1):
+            if deck[k] % 13 == 0 and j < i:
+                buriedAces += 1
+                aceDepth += i - j
+            k += 1
+    return moves, buriedAces, aceDepth
+#end dealStats
+
+class DealLibraryClass():
+    """ deals and what is known about them in a memory mapped directory, mode "r" read only, "r+" read and write, "w" new empty library """
+    def __init__(self, path, mode="r") -> None:
+        self.path = path
+        self.mode = mode
+        self._deals = None # memory maps are made when first needed
+        self._meta = None
+        self._indexes = {} # field -> memory mapped index
+        if mode == "w":
+            os.makedirs(path, exist_ok=True)
+            self.count = 0
+            self.solver = None # settings solve was last run with
+            open(self._file("deals.bin"), "wb").close()
+            open(self._file("meta.bin"), "wb").close()
+            self._writeHeader()
+            self.buildIndexes()
+        elif mode in ("r", "r+"):
+            with open(self._file("header.json")) as f:
+                header = json.load(f)
+            self.count = header["count"]
+            self.solver = header["solver"]
+        else:
+            raise ValueError(f"mode must be 'r', 'r+' or 'w' not {mode!r}")
+    #end __init__
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _writeHeader(self):
+        with open(self._file("header.json"), "w") as f:
+            json.dump({"count": self.count, "solver": self.solver}, f)
+
+    def _map(self, name, dtype, shape):
+        if self.count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r" if self.mode == "r" else "r+", shape=shape)
+
+    @property
+    def deals(self):
+        """ (count, 52) uint8 card ids of every deal """
+        if self._deals is None:
+            self._deals = self._map("deals.bin", np.uint8, (self.count, DECK_SIZE))
+        return self._deals
+
+    @property
+    def meta(self):
+        """ (count,) META_DTYPE records """
+        if self._meta is None:
+            self._meta = self._map("meta.bin", META_DTYPE, (self.count,))
+        return self._meta
+
+    def __len__(self):
+        return self.count
+
+    def add(self, seeds):
+        """ deal each seed and append it with its stats (not solved), returns the deal numbers given to them """
+        if self.mode == "r":
+            raise ValueError("deal library opened read only")
+        seeds = list(seeds)
+        decks = np.zeros((len(seeds), DECK_SIZE), dtype=np.uint8)
+        meta = np.zeros(len(seeds), dtype=META_DTYPE)
+        meta["status"] = STATUS_CODES[NOT_SOLVED]
+        for i, seed in enumerate(seeds):
+            deck = seedDeck(seed)
+            decks[i] = deck
+            meta["seed"][i] = seed
+            meta["moves"][i], meta["buried_aces"][i], meta["ace_depth"][i] = dealStats(deck)
+        self.close()
+        with open(self._file("deals.bin"), "ab") as f:
+            f.write(decks.tobytes())
+        with open(self._file("meta.bin"), "ab") as f:
+            f.write(meta.tobytes())
+        first = self.count
+        self.count += len(seeds)
+        self._writeHeader()
+        self.buildIndexes()
+        return np.arange(first, self.count)
+    #end add
+
+    def solve(self, deals=None, max_nodes=200000, max_seconds=None, workers=None, chunk_size=100, only_unsolved=True, progress=True):
+        """ run SolverClass on deals (deal numbers, all of them if None), in worker processes when workers isn't 1,
+            results are written as each chunk comes back so an interrupted run keeps what it has done """
+        if self.mode == "r":
+            raise ValueError("deal library opened read only")
+        deals = np.arange(self.count) if deals is None else np.asarray(deals)
+        if only_unsolved:
+            deals = deals[self.meta["status"][deals] == STATUS_CODES[NOT_SOLVED]]
+        tasks = [(self.deals[deals[i:i + chunk_size]].copy(), deals[i:i + chunk_size]) for i in range(0, len(deals), chunk_size)]
+        settings = (max_nodes, max_seconds)
+        workers = workers or os.cpu_count()
+        pool = None
+        try:
+            if workers == 1:
+                results = map(_solveChunk, [(settings, task) for task in tasks])
+            else:
+                pool = multiprocessing.Pool(workers)
+                results = pool.imap_unordered(_solveChunk, [(settings, task) for task in tasks])
+            meta = self.meta
+            done = 0
+            for numbers, statuses, lengths, nodes in results:
+                meta["status"][numbers] = statuses
+                meta["solution_moves"][numbers] = lengths
+                meta["nodes"][numbers] = nodes
+                done += len(numbers)
+                if progress:
+                    print(f"solved {done} of {len(deals)}")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self.solver = {"max_nodes": max_nodes, "max_seconds": max_seconds}
+            self.flush()
+            self.buildIndexes()
+    #end solve
+
+    def buildIndexes(self):
+        """ write index_<field>.bin, the deal numbers sorted by each field in INDEXED (ties in deal number order) """
+        meta = self.meta
+        for field in INDEXED:
+            order = np.argsort(meta[field], kind="stable").astype(np.int64)
+            temp = self._file(f"index_{field}.bin.tmp")
+            order.tofile(temp)
+            os.replace(temp, self._file(f"index_{field}.bin"))
+        self._indexes = {}
+    #end buildIndexes
+
+    def _index(self, field):
+        if field not in self._indexes:
+            self._indexes[field] = np.memmap(self._file(f"index_{field}.bin"), dtype=np.int64, mode="r", shape=(self.count,)) if self.count else np.zeros(0, dtype=np.int64)
+        return self._indexes[field]
+
+    def _matches(self, numbers, status, ranges):
+        """ which of the deal numbers have the status and every field within its (low, high) range, both ends included """
+        records = self.meta[numbers]
+        ok = np.ones(len(numbers), dtype=bool)
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else status
+            ok &= np.isin(records["status"], [STATUS_CODES[s] for s in statuses])
+        for field, (low, high) in ranges.items():
+            if low is not None:
+                ok &= records[field] >= low
+            if high is not None:
+                ok &= records[field] <= high
+        return ok
+    #end _matches
+
+    def query(self, limit=None, status=None, order=None, descending=False, chunk_size=65536, **ranges):
+        """ deal numbers of up to limit deals with the solver status (one or a list, None for any) and each field given as
+            field=(low, high) within that range (None for no bound), e.g. query(100, status=SOLVABLE, buried_aces=(3, None))
+            order=field takes them in order of that field from its index (hardest first with order="nodes", descending=True)
+            so it stops as soon as it has limit of them, otherwise they are in deal number order """
+        for field in ranges:
+            if field not in META_DTYPE.names:
+                raise ValueError(f"unknown field {field!r}")
+        if order is not None and order not in INDEXED:
+            raise ValueError(f"order must be one of {INDEXED} not {order!r}")
+        found = []
+        total = 0
+        for start in range(0, self.count, chunk_size):
+            if order is None:
+                numbers = np.arange(start, min(start + chunk_size, self.count))
+            elif descending: # from the end of the index back
+                numbers = np.asarray(self._index(order)[max(0, self.count - start - chunk_size):self.count - start][::-1])
+            else:
+                numbers = np.asarray(self._index(order)[start:start + chunk_size])
+            numbers = numbers[self._matches(numbers, status, ranges)]
+            found.append(numbers)
+            total += len(numbers)
+            if limit is not None and total >= limit:
+                break
+        found = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+        return found[:limit]
+    #end query
+
+    def decks(self, deals):
+        """ (len(deals), 52) card ids for BatchSolitaireEnvClass.deal """
+        return np.asarray(self.deals[np.asarray(deals)])
+
+    def seeds(self, deals):
+        return [int(seed) for seed in self.meta["seed"][np.asarray(deals)]]
+
+    def position(self, deal, compact=True):
+        """ a CompactPositionClass (or PositionClass) set up with deal """
+        if compact:
+            pos = CompactPositionClass()
+            pos.setUpFromDeck(self.deals[deal].tolist())
+        else:
+            pos = PositionClass.PositionClass()
+            pos.setUp(int(self.meta["seed"][deal]))
+        return pos
+    #end position
+
+    def info(self, deal):
+        """ the metadata of a deal as a dict """
+        record = self.meta[deal]
+        info = {name: int(record[name]) for name in META_DTYPE.names}
+        info["status"] = STATUS_NAMES[info["status"]]
+        return info
+
+    def flush(self):
+        """ make sure everything is on disk """
+        if self.mode == "r":
+            return
+        if isinstance(self._meta, np.memmap):
+            self._meta.flush()
+        self._writeHeader()
+
+    def close(self):
+        self.flush()
+        self._deals = None
+        self._meta = None
+        self._indexes = {}
+
+    def __getstate__(self):
+        """ memory maps aren't pickled, each process maps the files itself when it first needs them """
+        state = self.__dict__.copy()
+        state["_deals"] = None
+        state["_meta"] = None
+        state["_indexes"] = {}
+        return state
+#end DealLibraryClass
+
+def _solveChunk(args):
+    (maxNodes, maxSeconds), (decks, numbers) = args
+    solver = SolverClass(maxNodes, maxSeconds)
+    statuses = []
+    lengths = []
+    nodes = []
+    pos = CompactPositionClass()
+    for deck in decks:
+        pos.setUpFromDeck(deck.tolist())
+        result = solver.solve(pos)
+        statuses.append(STATUS_CODES[result.status])
+        lengths.append(len(result.moves))
+        nodes.append(min(result.nodes, 2**32 - 1))
+    return numbers, statuses, lengths, nodes
+#end _solveChunk
+
+def createLibrary(path, num_deals, first_seed=0, solve=True, **solveSettings):
+    """ a new library of the deals first_seed, first_seed + 1, ..., solved unless solve=False """
+    library = DealLibraryClass(path, "w")
+    library.add(range(first_seed, first_seed + num_deals))
+    if solve:
+        library.solve(**solveSettings)
+    return library
+#end createLibrary
+
+def testDealLibraryClass(numDeals=60):
+    """ build a small library, check the deals and stats against dealing from the seed, and the queries against a plain filter """
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "deals")
+        library = createLibrary(path, numDeals, first_seed=1000, max_nodes=20000, workers=2, chunk_size=10, progress=False)
+        library.add(range(5000, 5020)) # more deals, not solved yet
+        library.close()
+
+        library = DealLibraryClass(path)
+        assert len(library) == numDeals + 20 and os.path.getsize(os.path.join(path, "deals.bin")) == (numDeals + 20) * 52
+        for deal in (0, numDeals - 1, numDeals + 5):
+            seed = library.seeds([deal])[0]
+            pos = CompactPositionClass()
+            pos.setUp(seed)
+            assert (library.position(deal).toObservation() == pos.toObservation()).all()
+            assert (library.position(deal, compact=False).toObservation() == pos.toObservation()).all()
+            info = library.info(deal)
+            assert info["moves"] == sum(move != 1 for move in pos.legalMoves())
+            observation = pos.toObservation()
+            aces = [(row, col) for row in range(TABLEAU, TABLEAU + 7) for col in range(row - TABLEAU) if library.deals[deal][sum(range(row - TABLEAU + 1)) + col] % 13 == 0]
+            assert info["buried_aces"] == len(aces) and all(observation[row][col] == -1 for row, col in aces)
+        assert library.info(numDeals + 5)["status"] == NOT_SOLVED
+
+        meta = np.array(library.meta)
+        solvable = np.flatnonzero(meta["status"] == STATUS_CODES[SOLVABLE])
+        assert np.array_equal(library.query(status=SOLVABLE), solvable)
+        hard = library.query(5, status=SOLVABLE, order="nodes", descending=True, chunk_size=7)
+        assert len(hard) == min(5, len(solvable))
+        assert list(meta["nodes"][hard]) == sorted(meta["nodes"][solvable], reverse=True)[:len(hard)]
+        easy = library.query(status=[SOLVABLE, UNKNOWN], order="moves", buried_aces=(2, None), chunk_size=7)
+        expected = np.flatnonzero(np.isin(meta["status"], [1, 2]) & (meta["buried_aces"] >= 2))
+        assert sorted(easy) == list(expected) and list(meta["moves"][easy]) == sorted(meta["moves"][expected])
+        for deal in solvable[:5]: # the solver's stats go with the right deal
+            pos = library.position(deal)
+            result = SolverClass(20000).solve(pos)
+            assert result.status == SOLVABLE and len(result.moves) == meta["solution_moves"][deal]
+        counts = {name: int(np.sum(meta["status"] == code)) for name, code in STATUS_CODES.items()}
+        print("DealLibraryClass ok,", counts)
+#end testDealLibraryClass
+
+if __name__ == "__main__":
+    #testDealLibraryClass()
+    pass
+# End if __name__ == "__main__":
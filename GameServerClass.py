@@ -0,0 +1,259 @@
+# GameServerClass.py
+# Laurence Smith
+
+# Serves games of solitaire to lots of players (or bots) at once from one process with asyncio, each
+# connection gets its own PositionClass game. Start it with python game.py --serve (TCP, or --unix PATH).
+# It is a line protocol, send one command per line:
+#   h               help
+#   q               quit
+#   p               show the position
+#   l               the legal moves, space separated
+#   n [seed]        new game, the same seed always deals the same game
+#   b               turn showing the position after each move off and on (bots don't need it)
+#   <number>        a move, the same codes as game.py (1, 2, 10-16, 20-26, 1ij, 1ijkl)
+# every reply is some lines ended by a line with just "." on it. The first line of a reply to a move is
+# ok, won, illegal (a move but not allowed here) or unknown (not a move code).
+# To keep each session small and bounded
+#   - lines longer than max_line close the connection, so a client can't make the server buffer much
+#   - replies wait for the client to read them once write_limit bytes are queued
+#   - a session that sends nothing for idle_timeout seconds (or doesn't read its replies) is closed
+#   - at most max_sessions at once, more are told busy and closed
+# loadTest connects lots of clients that play random legal moves and reports requests/sec and latencies.
+
+import asyncio
+import itertools
+import random
+import time
+
+import numpy as np
+
+import PositionClass
+from game import HELP_TEXT
+
+SERVER_HELP = HELP_TEXT + """p = show the position
+            l = list the legal moves
+            n [seed] = new game
+            b = show the position after moves off/on
+            """
+
+class GameSessionClass():
+    """ one player's game """
+    __slots__ = ("id", "position", "moves", "board")
+
+    def __init__(self, id, seed=None) -> None:
+        self.id = id
+        self.moves = 0 # moves made in all games this session
+        self.board = True # reply to moves with the position
+        self.newGame(seed)
+    #end __init__
+
+    def newGame(self, seed=None):
+        self.position = PositionClass.PositionClass()
+        self.position.setUp(seed)
+#end GameSessionClass
+
+class GameServerClass():
+    """ asyncio server holding a GameSessionClass for each connection """
+    def __init__(self, idle_timeout=300.0, max_sessions=10000, max_line=64, write_limit=16384) -> None:
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_line = max_line # longest command line accepted
+        self.write_limit = write_limit # bytes queued for a client before waiting for it to read
+        self.sessions = {} # id -> GameSessionClass for the connections open now
+        self._ids = itertools.count(1)
+        self.started = 0 # sessions ever started
+        self.refused = 0 # turned away because max_sessions were open
+        self.timeouts = 0
+        self.requests = 0
+    #end __init__
+
+    def handleCommand(self, session, line):
+        """ (reply, close) for one command line, reply is the text to send without the ending "." line """
+        self.requests += 1
+        command = line.split()
+        if not command:
+            return "unknown\n", False
+        pos = session.position
+        k = command[0]
+        if k.isdigit():
+            result = pos.applyMoves([int(k)])[0]
+            session.moves += result.status == PositionClass.MOVED
+            if result.status == PositionClass.MOVED and pos.isWon():
+                status = "won"
+            elif result.status == PositionClass.MOVED:
+                status = "ok"
+            else:
+                status = result.status
+            if session.board and result.status == PositionClass.MOVED:
+                return status + "\n" + pos.gameStr(), False
+            return status + "\n", False
+        elif k == "l":
+            return " ".join(str(move) for move in pos.legalMoves()) + "\n", False
+        elif k == "p":
+            return pos.gameStr(), False
+        elif k == "n":
+            seed = int(command[1]) if len(command) > 1 and command[1].isdigit() else None
+            session.newGame(seed)
+            return session.position.gameStr(), False
+        elif k == "b":
+            session.board = not session.board
+            return ("board on" if session.board else "board off") + "\n", False
+        elif k == "h":
+            return SERVER_HELP, False
+        elif k == "q":
+            return "Thank you for playing\n", True
+        return "unknown\n", False
+    #end handleCommand
+
+    async def _send(self, writer, text):
+        writer.write((text + ".\n").encode())
+        await asyncio.wait_for(writer.drain(), self.idle_timeout)
+
+    async def _handle(self, reader, writer):
+        """ runs one connection """
+        writer.transport.set_write_buffer_limits(high=self.write_limit)
+        if len(self.sessions) >= self.max_sessions:
+            self.refused += 1
+            writer.write(b"busy\n.\n")
+            writer.close()
+            return
+        session = GameSessionClass(next(self._ids))
+        self.sessions[session.id] = session
+        self.started += 1
+        try:
+            await self._send(writer, f"session {session.id}\n" + session.position.gameStr())
+            close = False
+            while not close:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    await self._send(writer, "timeout\n")
+                    break
+                except ValueError: # longer than max_line
+                    await self._send(writer, "line too long\n")
+                    break
+                if not line: # client went away
+                    break
+                reply, close = self.handleCommand(session, line.decode(errors="replace"))
+                await self._send(writer, reply)
+        except (asyncio.TimeoutError, ConnectionError): # not reading its replies, or went away mid reply
+            pass
+        finally:
+            del self.sessions[session.id]
+            writer.close()
+    #end _handle
+
+    async def start(self, host="127.0.0.1", port=8765, unix=None):
+        """ start listening on TCP host:port, or the unix socket path unix if given, returns the asyncio server """
+        if unix is not None:
+            return await asyncio.start_unix_server(self._handle, unix, limit=self.max_line, backlog=4096)
+        return await asyncio.start_server(self._handle, host, port, limit=self.max_line, backlog=4096)
+
+    async def serveForever(self, host="127.0.0.1", port=8765, unix=None):
+        server = await self.start(host, port, unix)
+        print("serving on", unix if unix is not None else f"{host}:{port}")
+        async with server:
+            await server.serve_forever()
+#end GameServerClass
+
+async def _readReply(reader):
+    """ lines of one reply up to the "." line """
+    lines = []
+    while True:
+        line = (await reader.readline()).decode()
+        if line in (".\n", ""):
+            return lines
+        lines.append(line.rstrip("\n"))
+
+async def _loadTestClient(host, port, unix, moves, rng, latencies, startLimit):
+    async with startLimit: # don't open every connection at the same instant
+        if unix is not None:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+    try:
+        if (await _readReply(reader))[0] == "busy":
+            return False
+        for command in ["b"] + ["l", None] * moves:
+            if command is None: # a random legal move, or turn the stock if there aren't any
+                command = rng.choice(legal) if legal else "1"
+            start = time.perf_counter()
+            writer.write((command + "\n").encode())
+            reply = await _readReply(reader)
+            latencies.append(time.perf_counter() - start)
+            if command == "l":
+                legal = reply[0].split()
+        writer.write(b"q\n")
+        await _readReply(reader)
+        return True
+    finally:
+        writer.close()
+#end _loadTestClient
+
+async def loadTest(host="127.0.0.1", port=8765, unix=None, clients=1000, moves=100, seed=0):
+    """ clients connections at once to a server each making moves random legal moves, returns a dict of the results """
+    rng = random.Random(seed)
+    latencies = []
+    startLimit = asyncio.Semaphore(100)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_loadTestClient(host, port, unix, moves, random.Random(rng.getrandbits(32)), latencies, startLimit)
+                                     for i in range(clients)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": clients,
+        "played": sum(result is True for result in results),
+        "busy": sum(result is False for result in results),
+        "errors": sum(isinstance(result, BaseException) for result in results),
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_sec": len(latencies) / elapsed,
+        "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "latency_ms_p99": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+#end loadTest
+
+def testGameServerClass(clients=500, moves=20):
+    """ a load test against a server in the same process, then the limits """
+    async def run():
+        server = GameServerClass(idle_timeout=0.5, max_sessions=clients)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        results = await loadTest(port=port, clients=clients, moves=moves)
+        print(results)
+        assert results["played"] == clients and results["errors"] == 0
+        assert server.started == clients and not server.sessions
+
+        # same seed same deal
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await _readReply(reader)
+        writer.write(b"n 42\n")
+        deal = await _readReply(reader)
+        pos = PositionClass.PositionClass()
+        pos.setUp(42)
+        assert deal == pos.gameStr().rstrip("\n").split("\n")
+        writer.write(b"99999\n1\n")
+        assert await _readReply(reader) == ["unknown"]
+        assert (await _readReply(reader))[0] == "ok"
+
+        # too long a line, then sitting idle
+        writer.write(b"1" * 100 + b"\n")
+        assert await _readReply(reader) == ["line too long"]
+        writer.close()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await _readReply(reader)
+        assert await _readReply(reader) == ["timeout"]
+        writer.close()
+        await asyncio.sleep(0.1)
+        assert server.timeouts == 1 and not server.sessions
+        listener.close()
+        await listener.wait_closed()
+    asyncio.run(run())
+    print("GameServerClass ok")
+#end testGameServerClass
+
+if __name__ == "__main__":
+    #testGameServerClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,315 @@
+# MCTSClass.py
+# Laurence Smith
+
+# Monte Carlo tree search player, a much stronger baseline than the tabular Q-learner.
+# Each simulation
+#   - walks down the tree from the position picking moves with UCT (only legal moves are ever in the tree)
+#   - adds the first position it reaches that isn't in the tree
+#   - plays a quick rollout from there, random or heuristic moves, and scores the position it ends on with
+#     the same reward shapes as OpenAiGymSolitaireClass.calculate_reward (scaled so a win is 1)
+#   - adds the score to every move on the way down
+# The tree is a table of nodes keyed by the zobrist hash, so a position reached by different orders of moves
+# is one node, and it is kept between moves so the next search starts with what the last one found.
+# Everything runs on a CompactPositionClass, the walk down uses push/pop and a rollout plays on a copy (three
+# bytearrays) so no PositionClass is ever deep copied.
+# Each move gets a budget of simulations and/or seconds. workers > 1 runs that many independent searches in
+# processes (root parallelism) and adds up their visits at the root.
+# Like SolverClass it searches the actual deal, face down cards included, so it is a perfect information
+# baseline and not a fair player.
+
+import math
+import multiprocessing
+import random
+import time
+
+from CompactPositionClass import CompactPositionClass, ROW_LEN, STOCK, WASTE, TABLEAU, CARD_VALUE, CARD_SUIT, CARD_RED
+from OpenAiGymSolitaireClass import default_reward
+
+RANDOM = "random"
+HEURISTIC = "heuristic"
+
+class MCTSNodeClass():
+    """ a position in the tree, its legal moves and visits and total score for each of them """
+    __slots__ = ("visits", "moves", "moveVisits", "moveValues")
+
+    def __init__(self, moves) -> None:
+        self.visits = 0
+        self.moves = moves
+        self.moveVisits = [0] * len(moves)
+        self.moveValues = [0.0] * len(moves) # sum of the scores of simulations through each move
+#end MCTSNodeClass
+
+class MCTSClass():
+    """ picks moves by Monte Carlo tree search """
+    def __init__(self, simulations=1000, seconds=None, exploration=1.0, rollout=HEURISTIC, rollout_depth=30,
+                 reward_shape=default_reward, max_nodes=1000000, workers=1, seed=None) -> None:
+        if rollout not in (RANDOM, HEURISTIC):
+            raise ValueError(f"rollout must be {RANDOM!r} or {HEURISTIC!r} not {rollout!r}")
+        self.simulations = simulations # per move, None for no limit (then seconds must be given)
+        self.seconds = seconds # per move, None for no limit
+        self.exploration = exploration # UCT constant, scores are 0 to 1
+        self.rollout = rollout
+        self.rollout_depth = rollout_depth # moves in a rollout
+        self.reward_shape = reward_shape
+        self.scale = reward_shape(0, 52, True) # reward for a win, scores are divided by it
+        self.max_nodes = max_nodes # the table is cleared when it gets bigger than this
+        self.workers = workers
+        self.random = random.Random(seed)
+        self.nodes = {} # zobrist -> MCTSNodeClass
+        self.lastSimulations = 0 # done for the last move, all workers together
+        self._pool = None
+    #end __init__
+
+    def _score(self, pos):
+        return self.reward_shape(pos.visibleTableauCards, pos.foundationCards, pos.isWon()) / self.scale
+
+    def _select(self, node):
+        """ index of the move to follow, UCT with untried moves first """
+        moveVisits = node.moveVisits
+        moveValues = node.moveValues
+        logVisits = math.log(node.visits + 1)
+        best = 0
+        bestScore = -1.0
+        for i in range(len(moveVisits)):
+            n = moveVisits[i]
+            if n == 0:
+                return i
+            score = moveValues[i] / n + self.exploration * math.sqrt(logVisits / n)
+            if score > bestScore:
+                best = i
+                bestScore = score
+        return best
+    #end _select
+
+    def _rolloutMove(self, pos):
+        """ heuristic rollout move without working out every legal move: a card to the foundation, then a tableau move
+            that turns over a card, then the waste onto the tableau, then the stock, never a card back off the foundation """
+        cards = pos.cards
+        lengths = pos.lengths
+        faceDown = pos.faceDown
+        wasteLength = lengths[WASTE]
+        wasteCard = cards[WASTE * ROW_LEN + wasteLength - 1] if wasteLength else -1
+        if wasteCard >= 0 and lengths[CARD_SUIT[wasteCard]] == CARD_VALUE[wasteCard] - 1:
+            return 2
+        wanted = {} # (value, red) of a card that can go on a tableau pile -> the pile
+        empty = -1
+        for t in range(7):
+            length = lengths[TABLEAU + t]
+            if length:
+                top = cards[(TABLEAU + t) * ROW_LEN + length - 1]
+                if lengths[CARD_SUIT[top]] == CARD_VALUE[top] - 1:
+                    return 10 + t
+                wanted[(CARD_VALUE[top] - 1, not CARD_RED[top])] = t
+            elif empty < 0:
+                empty = t
+        for i in range(7):
+            src = TABLEAU + i
+            visible = lengths[src] - faceDown[src]
+            if faceDown[src] and visible: # move every face up card to turn over the one under them
+                card = cards[src * ROW_LEN + faceDown[src]]
+                j = empty if CARD_VALUE[card] == 13 else wanted.get((CARD_VALUE[card], CARD_RED[card]), -1)
+                if j >= 0:
+                    return 10000 + 1000 * i + 100 * j + visible
+        if wasteCard >= 0:
+            t = empty if CARD_VALUE[wasteCard] == 13 else wanted.get((CARD_VALUE[wasteCard], CARD_RED[wasteCard]), -1)
+            if t >= 0:
+                return 20 + t
+        if lengths[STOCK] or wasteLength:
+            return 1
+        moves = [move for move in pos.legalMoves() if move < 100 or move >= 10000]
+        return self.random.choice(moves) if moves else None
+    #end _rolloutMove
+
+    def _playout(self, pos):
+        """ score after a rollout from pos, played on a copy """
+        if pos.isWon():
+            return 1.0
+        pos = pos.copy()
+        heuristic = self.rollout == HEURISTIC
+        stockMoves = 0 # stock moves in a row
+        for step in range(self.rollout_depth):
+            if heuristic:
+                move = self._rolloutMove(pos)
+                # the heuristic moves are the same every time round the stock, so a whole pass of just stock moves means it's stuck
+                stockMoves = stockMoves + 1 if move == 1 else 0
+                if stockMoves > (pos.lengths[STOCK] + pos.lengths[WASTE]) // 3 + 1:
+                    break
+            else:
+                moves = pos.legalMoves()
+                move = self.random.choice(moves) if moves else None
+            if move is None:
+                break
+            pos.moveByNumber(move)
+            if pos.isWon():
+                break
+        return self._score(pos)
+    #end _playout
+
+    def _simulate(self, pos):
+        """ one simulation from pos, pos is left as it was """
+        nodes = self.nodes
+        path = []
+        seen = {pos.zobrist}
+        while True:
+            node = nodes.get(pos.zobrist)
+            if node is None:
+                nodes[pos.zobrist] = MCTSNodeClass(pos.legalMoves())
+                break
+            if not node.moves:
+                break
+            i = self._select(node)
+            pos.push(node.moves[i])
+            path.append((node, i))
+            if pos.zobrist in seen: # come round in a loop (the stock), score it from here
+                break
+            seen.add(pos.zobrist)
+        value = self._playout(pos)
+        for node, i in path:
+            node.visits += 1
+            node.moveVisits[i] += 1
+            node.moveValues[i] += value
+            pos.pop()
+    #end _simulate
+
+    def search(self, position):
+        """ runs the search from position (PositionClass or CompactPositionClass, left unchanged) within the budgets,
+            returns {move: (visits, mean score)} for the legal moves at the root """
+        if self.simulations is None and self.seconds is None:
+            raise ValueError("need a simulation or time budget")
+        if self.workers > 1:
+            return self._searchParallel(position)
+        pos = position.copy() if isinstance(position, CompactPositionClass) else CompactPositionClass.fromPosition(position)
+        pos.undoLog = []
+        if len(self.nodes) > self.max_nodes:
+            self.nodes = {}
+        start = time.perf_counter()
+        done = 0
+        while self.simulations is None or done < self.simulations:
+            self._simulate(pos)
+            done += 1
+            if self.seconds is not None and done % 16 == 0 and time.perf_counter() - start > self.seconds:
+                break
+        self.lastSimulations = done
+        root = self.nodes[pos.zobrist]
+        return {move: (n, w / n if n else 0.0) for move, n, w in zip(root.moves, root.moveVisits, root.moveValues)}
+    #end search
+
+    def _searchParallel(self, position):
+        """ root parallelism, each worker searches from position with its own tree and random numbers """
+        if self._pool is None:
+            settings = (self.simulations, self.seconds, self.exploration, self.rollout, self.rollout_depth, self.reward_shape, self.max_nodes)
+            self._pool = multiprocessing.Pool(self.workers, _workerStart, (settings,))
+        pos = position if isinstance(position, CompactPositionClass) else CompactPositionClass.fromPosition(position)
+        seeds = [self.random.getrandbits(32) for i in range(self.workers)]
+        stats = {}
+        self.lastSimulations = 0
+        for result, simulations in self._pool.map(_workerSearch, [(pos, seed) for seed in seeds]):
+            self.lastSimulations += simulations
+            for move, (n, mean) in result.items():
+                visits, total = stats.get(move, (0, 0.0))
+                stats[move] = (visits + n, total + n * mean)
+        return {move: (n, total / n if n else 0.0) for move, (n, total) in stats.items()}
+    #end _searchParallel
+
+    def chooseMove(self, position, history=None, stock=True):
+        """ moveByNumber code of the most visited move, None if there are no legal moves left to make.
+            A card off the foundation or between tableau piles that goes back to a position whose zobrist is in history is
+            skipped (so play doesn't go back and forth), the other moves always get somewhere so they're never skipped,
+            and going round the stock again is fine unless stock is False """
+        pos = position.copy() if isinstance(position, CompactPositionClass) else CompactPositionClass.fromPosition(position)
+        stats = self.search(pos)
+        for move in sorted(stats, key=lambda move: stats[move], reverse=True):
+            if move == 1:
+                if stock:
+                    return move
+                continue
+            if not history or move < 100:
+                return move
+            pos.push(move)
+            back = pos.zobrist in history
+            pos.pop()
+            if not back:
+                return move
+        return None
+    #end chooseMove
+
+    def play(self, position, max_moves=1000):
+        """ play a whole game on position (PositionClass or CompactPositionClass) until it is won, stuck or has had max_moves,
+            returns (moves made, final reward) """
+        moves = []
+        history = {position.zobrist}
+        passed = {position.zobrist} # positions since the last move that wasn't the stock, back at one of them means a whole pass
+        stock = True
+        while len(moves) < max_moves and not position.isWon():
+            move = self.chooseMove(position, history, stock)
+            if move is None:
+                break
+            position.moveByNumber(move)
+            history.add(position.zobrist)
+            moves.append(move)
+            if move != 1:
+                passed = set()
+                stock = True
+            elif position.zobrist in passed: # only going round the stock, make something else next
+                stock = False
+            passed.add(position.zobrist)
+        return moves, self.reward_shape(position.countVisibleTableauCards(), position.countFoundationCards(), position.isWon())
+    #end play
+
+    def close(self):
+        """ stop the worker processes """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+#end MCTSClass
+
+_workerAgent = None # the MCTSClass in a worker process, kept between moves so its tree is reused
+
+def _workerStart(settings):
+    global _workerAgent
+    simulations, seconds, exploration, rollout, rolloutDepth, rewardShape, maxNodes = settings
+    _workerAgent = MCTSClass(simulations, seconds, exploration, rollout, rolloutDepth, rewardShape, maxNodes)
+
+def _workerSearch(args):
+    pos, seed = args
+    _workerAgent.random.seed(seed)
+    return _workerAgent.search(pos), _workerAgent.lastSimulations
+
+def testMCTSClass(numDeals=3, simulations=200):
+    """ play some deals with MCTS and with random moves, check MCTS scores more, and check searching leaves the position alone """
+    import PositionClass
+    agent = MCTSClass(simulations=simulations, seed=0)
+    total = 0
+    randomTotal = 0
+    for deal in range(numDeals):
+        position = PositionClass.PositionClass()
+        position.setUp(deal)
+        before = position.toObservation(copy=True)
+        agent.search(position)
+        assert (position.toObservation() == before).all()
+        start = time.perf_counter()
+        moves, reward = agent.play(position, max_moves=200)
+        seconds = time.perf_counter() - start
+
+        randomPos = PositionClass.PositionClass()
+        randomPos.setUp(deal)
+        rng = random.Random(deal)
+        for move in range(200):
+            legal = randomPos.legalMoves()
+            if not legal:
+                break
+            randomPos.moveByNumber(rng.choice(legal))
+        randomReward = default_reward(randomPos.countVisibleTableauCards(), randomPos.countFoundationCards(), randomPos.isWon())
+        print("deal", deal, "mcts", reward, "random", randomReward, len(moves), "moves",
+              round(len(moves) * simulations / seconds), "simulations/s", len(agent.nodes), "nodes")
+        total += reward
+        randomTotal += randomReward
+    assert total > randomTotal, (total, randomTotal)
+    print("MCTSClass ok")
+#end testMCTSClass
+
+if __name__ == "__main__":
+    #testMCTSClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,156 @@
+# MetricsClass.py
+# Laurence Smith
+
+# Counts and times what goes on in OpenAiGymSolitaireClass instead of printing every move.
+# Pass one in with OpenAiGymSolitaireClass(metrics=MetricsClass()) and it keeps
+#   - legal and illegal moves for each type of move
+#   - a histogram of how long each type of move took, buckets are powers of 2 nanoseconds
+#   - episodes played and their final rewards
+#   - optionally a cProfile of every profile_every'th step and tracemalloc memory use
+# Everything is plain counting in record_move, nothing is formatted until summary or report is called.
+# With no metrics (the default) the environment doesn't time anything at all.
+
+import cProfile
+import io
+import pstats
+import tracemalloc
+
+from CardTables import MOVE_KINDS, MOVE_DECODE
+
+MOVE_TYPES = MOVE_KINDS
+HISTOGRAM_BUCKETS = 32 # bucket i is moves that took from 2**i up to 2**(i+1) nanoseconds, last one is everything longer
+
+def move_type(num):
+    """ index in MOVE_TYPES of a moveByNumber code """
+    return MOVE_DECODE[num].kind
+
+class MetricsClass():
+    """ counters, timing histograms and optional profiling for the moves made by the environment """
+    def __init__(self, profile_every=0, trace_memory=False) -> None:
+        self.profile_every = profile_every # profile one step in this many with cProfile, 0 for never
+        self.trace_memory = trace_memory # keep track of memory with tracemalloc (slows everything down a lot)
+        self.profiler = cProfile.Profile() if profile_every else None
+        self.reset()
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+    #end __init__
+
+    def reset(self):
+        """ zero all the counts """
+        types = len(MOVE_TYPES)
+        self.legal = [0] * types
+        self.illegal = [0] * types
+        self.move_ns = [0] * types # total time spent on each type of move
+        self.histogram = [[0] * HISTOGRAM_BUCKETS for i in range(types)]
+        self.steps = 0
+        self.episodes = 0
+        self.episode_rewards = 0
+        self.profiled_steps = 0
+        self._profiling = False
+    #end reset
+
+    def start_step(self):
+        """ called at the start of each step, turns the profiler on for the steps being sampled """
+        self.steps += 1
+        if self.profiler is not None and self.steps % self.profile_every == 0:
+            self.profiler.enable()
+            self._profiling = True
+
+    def end_step(self):
+        """ called at the end of each step """
+        if self._profiling:
+            self.profiler.disable()
+            self._profiling = False
+            self.profiled_steps += 1
+
+    def record_move(self, kind, legal, elapsed_ns):
+        """ count a move of type kind (index into MOVE_TYPES) that took elapsed_ns nanoseconds """
+        if legal:
+            self.legal[kind] += 1
+        else:
+            self.illegal[kind] += 1
+        self.move_ns[kind] += elapsed_ns
+        self.histogram[kind][min(max(elapsed_ns.bit_length(), 1), HISTOGRAM_BUCKETS) - 1] += 1
+
+    def record_episode(self, reward):
+        """ count a finished episode and its final reward """
+        self.episodes += 1
+        self.episode_rewards += reward
+
+    def summary(self):
+        """ dict of everything counted so far, by move type name """
+        moves = {}
+        for kind, name in enumerate(MOVE_TYPES):
+            count = self.legal[kind] + self.illegal[kind]
+            moves[name] = {
+                "legal": self.legal[kind],
+                "illegal": self.illegal[kind],
+                "mean_ns": self.move_ns[kind] / count if count else 0.0,
+                "histogram_ns": {2 ** i: n for i, n in enumerate(self.histogram[kind]) if n},
+            }
+        summary = {
+            "steps": self.steps,
+            "episodes": self.episodes,
+            "mean_episode_reward": self.episode_rewards / self.episodes if self.episodes else 0.0,
+            "legal_moves": sum(self.legal),
+            "illegal_moves": sum(self.illegal),
+            "moves": moves,
+            "profiled_steps": self.profiled_steps,
+        }
+        if self.trace_memory and tracemalloc.is_tracing():
+            summary["memory_current"], summary["memory_peak"] = tracemalloc.get_traced_memory()
+        return summary
+    #end summary
+
+    def profile_stats(self, sort="cumulative", lines=20):
+        """ text of the cProfile stats for the sampled steps, empty if not profiling """
+        if self.profiler is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(lines)
+        return out.getvalue()
+
+    def memory_snapshot(self):
+        """ tracemalloc snapshot of where memory is allocated, None if not tracing """
+        if not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.take_snapshot()
+
+    def stop(self):
+        """ stop tracemalloc if this started it """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        """ the summary as text for printing """
+        summary = self.summary()
+        lines = [f"steps {summary['steps']}, episodes {summary['episodes']}, mean episode reward {summary['mean_episode_reward']:.1f}",
+                 f"legal moves {summary['legal_moves']}, illegal moves {summary['illegal_moves']}"]
+        for name, move in summary["moves"].items():
+            lines.append(f"  {name:22s} legal {move['legal']:9d} illegal {move['illegal']:9d} mean {move['mean_ns'] / 1000:8.2f} us")
+        if "memory_peak" in summary:
+            lines.append(f"memory current {summary['memory_current']} bytes, peak {summary['memory_peak']} bytes")
+        return "\n".join(lines)
+    #end report
+#end MetricsClass
+
+def testMetricsClass():
+    """ play some random steps with metrics on and check the counts add up """
+    from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+    metrics = MetricsClass(profile_every=10)
+    env = OpenAiGymSolitaireClass(metrics=metrics, max_episode_steps=50)
+    env.train(20)
+    summary = metrics.summary()
+    assert summary["legal_moves"] + summary["illegal_moves"] == summary["steps"]
+    assert summary["episodes"] == 20
+    assert summary["profiled_steps"] == summary["steps"] // 10
+    print(metrics.report())
+    print(metrics.profile_stats(lines=10))
+#end testMetricsClass
+
+if __name__ == "__main__":
+    #testMetricsClass()
+    pass
+# End if __name__ == "__main__":
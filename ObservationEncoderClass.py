@@ -0,0 +1,214 @@
+# ObservationEncoderClass.py
+# Laurence Smith
+
+# Turns positions into float32 inputs for a neural network, written straight into an array the caller
+# gives (or one made once with allocate) so nothing new is allocated for each step.
+#   "cards"   (52, 14) one-hot location of each card: piles 0-12 in observation order (0-3 foundations,
+#             4 stock, 5 waste, 6-12 tableau) or 13 for face down. Only what the player can see is used,
+#             a face down card is just face down wherever it is.
+#   "counts"  (20,) cards in each of the 13 piles / 24 then face down cards in each tableau pile / 6
+#   "flat"    (748,) cards flattened followed by counts, for a dense network
+# encode takes a CompactPositionClass, PositionClass, 13x24 observation, a list of any one of those, or a
+# BatchSolitaireEnvClass, and writes (shape) or (N, shape) into out. The work is done with numpy ufuncs
+# writing into scratch arrays kept for each batch size, CompactPositionClass and BatchSolitaireEnvClass
+# arrays are read in place (np.frombuffer on the bytearrays), so a worker can fill the same minibatch
+# tensor over and over without making temporary arrays.
+# OpenAiGymSolitaireClass(encoder=ObservationEncoderClass()) returns these from reset and step instead of
+# the 13x24 observation.
+
+import numpy as np
+
+import PositionClass
+from CompactPositionClass import CompactPositionClass, NUM_ROWS, ROW_LEN, TABLEAU
+from BatchSolitaireEnvClass import BatchSolitaireEnvClass
+
+CARDS = "cards"
+COUNTS = "counts"
+FLAT = "flat"
+
+NUM_CARDS = 52
+LOCATIONS = NUM_ROWS + 1 # the piles then face down
+FACE_DOWN = NUM_ROWS
+CARD_FEATURES = NUM_CARDS * LOCATIONS
+COUNT_FEATURES = NUM_ROWS + 7
+SHAPES = {CARDS: (NUM_CARDS, LOCATIONS), COUNTS: (COUNT_FEATURES,), FLAT: (CARD_FEATURES + COUNT_FEATURES,)}
+
+_COLUMNS = np.arange(ROW_LEN)
+_SLOT_ROW = np.repeat(np.arange(NUM_ROWS), ROW_LEN).reshape(NUM_ROWS, ROW_LEN) # pile of each slot
+
+class _ScratchClass():
+    """ work arrays for encoding n games at once """
+    def __init__(self, n, features) -> None:
+        # CompactPositionClass arrays copied in from a list, with memoryviews to copy the bytearrays into
+        self.cards = np.zeros((n, NUM_ROWS, ROW_LEN), dtype=np.uint8)
+        self.pileLengths = np.zeros((n, NUM_ROWS), dtype=np.uint8)
+        self.pileFaceDown = np.zeros((n, NUM_ROWS), dtype=np.uint8)
+        self.cardsView = memoryview(self.cards).cast("B")
+        self.pileLengthsView = memoryview(self.pileLengths).cast("B")
+        self.pileFaceDownView = memoryview(self.pileFaceDown).cast("B")
+        self.lengths = np.zeros((n, NUM_ROWS), dtype=np.int64) # counted from observations
+        self.faceDown = np.zeros((n, NUM_ROWS), dtype=np.int64)
+        self.observations = np.zeros((n, NUM_ROWS, ROW_LEN), dtype=np.int32)
+        self.hidden = np.zeros((n, NUM_ROWS, ROW_LEN), dtype=bool) # slots that aren't a face up card
+        self.mask = np.zeros((n, NUM_ROWS, ROW_LEN), dtype=bool)
+        self.slot = np.zeros((n, NUM_ROWS, ROW_LEN), dtype=np.int64) # where each slot's card goes in location
+        self.slotRow = np.broadcast_to(_SLOT_ROW, (n, NUM_ROWS, ROW_LEN)).copy() # pile of each slot
+        self.gameOffset = (np.arange(n) * (NUM_CARDS + 1)).reshape(n, 1, 1)
+        self.location = np.zeros((n, NUM_CARDS + 1), dtype=np.int64) # location of each card, the extra one takes empty and face down slots
+        self.cardBase = np.arange(n)[:, None] * features + np.arange(NUM_CARDS) * LOCATIONS # start of each card's one-hot in out
+        self.index = np.zeros((n, NUM_CARDS), dtype=np.int64)
+#end _ScratchClass
+
+class ObservationEncoderClass():
+    """ float32 encodings of positions written into caller's arrays """
+    def __init__(self, kind=FLAT) -> None:
+        if kind not in SHAPES:
+            raise ValueError(f"kind must be one of {list(SHAPES)} not {kind!r}")
+        self.kind = kind
+        self.shape = SHAPES[kind]
+        self.features = int(np.prod(self.shape))
+        self._scratch = {} # batch size -> _ScratchClass
+    #end __init__
+
+    def allocate(self, batch=None):
+        """ an array to encode into, (shape) or (batch, shape) """
+        return np.zeros(self.shape if batch is None else (batch,) + self.shape, dtype=np.float32)
+
+    def _getScratch(self, n):
+        scratch = self._scratch.get(n)
+        if scratch is None:
+            scratch = self._scratch[n] = _ScratchClass(n, self.features)
+        return scratch
+
+    def encode(self, source, out=None):
+        """ encode source into out (made if None) and return out, see the top of the file for what source can be """
+        single = isinstance(source, (CompactPositionClass, PositionClass.PositionClass)) or (isinstance(source, np.ndarray) and source.ndim == 2)
+        if isinstance(source, BatchSolitaireEnvClass):
+            n = source.num_envs
+        else:
+            n = 1 if single else len(source)
+        if out is None:
+            out = self.allocate(None if single else n)
+        if out.dtype != np.float32 or not out.flags.c_contiguous or out.size != n * self.features:
+            raise ValueError(f"out must be a C contiguous float32 array of {n} x {self.shape}")
+        flat = out.reshape(n, self.features)
+        scratch = self._getScratch(n)
+        if single:
+            source = [source]
+
+        if isinstance(source, BatchSolitaireEnvClass):
+            self._fromArrays(scratch, source.cards, source.lengths, source.faceDown, flat)
+        elif isinstance(source[0], CompactPositionClass):
+            if n == 1: # read the bytearrays in place
+                position = source[0]
+                self._fromArrays(scratch, np.frombuffer(position.cards, dtype=np.uint8).reshape(1, NUM_ROWS, ROW_LEN),
+                                 np.frombuffer(position.lengths, dtype=np.uint8)[None], np.frombuffer(position.faceDown, dtype=np.uint8)[None], flat)
+            else:
+                size = NUM_ROWS * ROW_LEN
+                for i, position in enumerate(source): # straight byte copies
+                    scratch.cardsView[i * size:(i + 1) * size] = position.cards
+                    scratch.pileLengthsView[i * NUM_ROWS:(i + 1) * NUM_ROWS] = position.lengths
+                    scratch.pileFaceDownView[i * NUM_ROWS:(i + 1) * NUM_ROWS] = position.faceDown
+                self._fromArrays(scratch, scratch.cards, scratch.pileLengths, scratch.pileFaceDown, flat)
+        else: # PositionClass or observations
+            for i, item in enumerate(source):
+                scratch.observations[i] = item.toObservation() if isinstance(item, PositionClass.PositionClass) else item
+            self._fromObservations(scratch, scratch.observations, flat)
+        return out
+    #end encode
+
+    def _fromArrays(self, scratch, cards, lengths, faceDown, flat):
+        """ CompactPositionClass layout: card ids, pile lengths and face down counts """
+        np.less(_COLUMNS, faceDown[:, :, None], out=scratch.hidden)
+        np.greater_equal(_COLUMNS, lengths[:, :, None], out=scratch.mask)
+        np.logical_or(scratch.hidden, scratch.mask, out=scratch.hidden)
+        self._write(scratch, cards, lengths, faceDown, flat)
+
+    def _fromObservations(self, scratch, observations, flat):
+        """ 13x24 observations, -1 face down and -2 empty """
+        np.less(observations, 0, out=scratch.hidden)
+        np.not_equal(observations, -2, out=scratch.mask)
+        np.sum(scratch.mask, axis=2, out=scratch.lengths)
+        np.equal(observations, -1, out=scratch.mask)
+        np.sum(scratch.mask, axis=2, out=scratch.faceDown)
+        self._write(scratch, observations, scratch.lengths, scratch.faceDown, flat)
+
+    def _write(self, scratch, cards, lengths, faceDown, flat):
+        """ fill flat from the cards in each slot, scratch.hidden is the slots that aren't face up cards """
+        if self.kind != COUNTS:
+            # every card starts face down, then each face up slot puts its pile in its card's location
+            # (hidden slots all write to the spare location at the end of each game's row)
+            scratch.location.fill(FACE_DOWN)
+            np.copyto(scratch.slot, cards, casting="unsafe")
+            np.copyto(scratch.slot, NUM_CARDS, where=scratch.hidden)
+            np.add(scratch.slot, scratch.gameOffset, out=scratch.slot)
+            scratch.location.reshape(-1)[scratch.slot] = scratch.slotRow
+            np.add(scratch.cardBase, scratch.location[:, :NUM_CARDS], out=scratch.index)
+            flat[:, :CARD_FEATURES] = 0
+            flat.reshape(-1)[scratch.index] = 1
+        if self.kind != CARDS:
+            counts = flat[:, self.features - COUNT_FEATURES:]
+            np.multiply(lengths, 1 / ROW_LEN, out=counts[:, :NUM_ROWS], casting="unsafe")
+            np.multiply(faceDown[:, TABLEAU:], 1 / 6, out=counts[:, NUM_ROWS:], casting="unsafe")
+    #end _write
+#end ObservationEncoderClass
+
+def testObservationEncoderClass(numGames=20, movesPerGame=100):
+    """ every way in gives the same encoding, and it matches a plain python encoding of the observation """
+    import random
+    random.seed(0)
+    encoder = ObservationEncoderClass()
+    cardEncoder = ObservationEncoderClass(CARDS)
+    for game in range(numGames):
+        pos = CompactPositionClass()
+        pos.setUp(game)
+        slow = PositionClass.PositionClass()
+        slow.setUp(game)
+        out = encoder.allocate()
+        for step in range(movesPerGame):
+            observation = pos.toObservation(copy=True)
+            expected = np.zeros(SHAPES[FLAT], dtype=np.float32)
+            seen = set()
+            for row in range(NUM_ROWS):
+                for card in observation[row]:
+                    if card >= 0:
+                        expected[card * LOCATIONS + row] = 1
+                        seen.add(int(card))
+                expected[CARD_FEATURES + row] = np.sum(observation[row] != -2) / ROW_LEN
+                if row >= TABLEAU:
+                    expected[CARD_FEATURES + NUM_ROWS + row - TABLEAU] = np.sum(observation[row] == -1) / 6
+            for card in set(range(NUM_CARDS)) - seen:
+                expected[card * LOCATIONS + FACE_DOWN] = 1
+            assert np.allclose(encoder.encode(pos, out), expected)
+            assert np.allclose(encoder.encode(slow), expected)
+            assert np.allclose(encoder.encode(observation), expected)
+            assert np.allclose(cardEncoder.encode(pos), expected[:CARD_FEATURES].reshape(NUM_CARDS, LOCATIONS))
+            moves = pos.legalMoves()
+            if not moves:
+                break
+            move = random.choice(moves)
+            pos.moveByNumber(move)
+            slow.moveByNumber(move)
+
+    positions = []
+    for game in range(8):
+        pos = CompactPositionClass()
+        pos.setUp(100 + game)
+        positions.append(pos)
+    batch = encoder.allocate(8)
+    encoder.encode(positions, batch)
+    for i, pos in enumerate(positions):
+        assert np.array_equal(batch[i], encoder.encode(pos))
+        assert np.array_equal(batch[i], encoder.encode(pos.toObservation()))
+    envs = BatchSolitaireEnvClass(16, seed=0)
+    for step in range(50):
+        envs.step(np.array([np.flatnonzero(mask)[0] for mask in envs.action_masks()]))
+    batch = encoder.encode(envs, encoder.allocate(16))
+    assert np.array_equal(batch, encoder.encode(list(envs.observations())))
+    print("ObservationEncoderClass ok")
+#end testObservationEncoderClass
+
+if __name__ == "__main__":
+    #testObservationEncoderClass()
+    pass
+# End if __name__ == "__main__":
@@ -5,22 +5,43 @@
 # 09/08/2022
 
 import PositionClass
+from CompactPositionClass import CompactPositionClass
+from MetricsClass import move_type
+from QTableFileClass import QTableFileClass
+from SymmetryClass import SymmetryClass
+from CardTables import MOVE_ENUMERATION, MOVE_TO_ACTION
+from ReplayBufferClass import ReplayBufferClass
 
-import gymnasium as gym
 import random
 import numpy as np
-import pandas as pd
-import sys
-import io
+import os
 import pickle
+import shutil
+import multiprocessing
+import warnings
+import time
 
 from gymnasium import Env, spaces
-#import time
+
+# Reward shapes, each takes the running counts the position keeps (face up tableau cards, cards on the
+# foundations and whether the game is won) so working out the reward never has to look at the cards.
+# Pass a different one to OpenAiGymSolitaireClass(reward_shape=...) to try it out.
+def default_reward(visible_tableau_cards, foundation_cards, won):
+    ''' 1 point for each visible card in tableau, 5 points for each card in foundation piles, 1000 points if game won '''
+    if won:
+        return 1000
+    return visible_tableau_cards + foundation_cards * 5
+
+def foundation_reward(visible_tableau_cards, foundation_cards, won):
+    ''' only count cards on the foundations, 10 points each, 1000 points if game won '''
+    if won:
+        return 1000
+    return foundation_cards * 10
 
 class OpenAiGymSolitaireClass(Env):
     metadata = {"render_modes": ["ansi",], "render_fps": 4} #TODO check this is right!
 
-    def __init__(self, render_mode="ansi", verbose=True) -> None:
+    def __init__(self, render_mode="ansi", verbose=False, compact=True, max_episode_steps=1000, debug=False, reward_shape=default_reward, metrics=None, q_table=None, symmetry=False, recorder=None, encoder=None) -> None:
         #print("In __init__")
         super(OpenAiGymSolitaireClass, self).__init__()
 
@@ -44,38 +65,67 @@ class OpenAiGymSolitaireClass(Env):
         # 1st try had too many impossible moves: self.action_space = spaces.Discrete(16613,start=1), as per codes used for moves. 
         # Changed to enumerate all possibilities to remove all the numbers that aren't allowed.
         # import enumeration of moves to reduce number of impossible moves
-        self.move_enumeration = pd.read_csv("move_enumeration.csv") # file containing columns "enumeration" and "move" where all possible solitaire move by numbers are enumerated
-        #print(move_enumeration)
+        self.move_enumeration = MOVE_ENUMERATION # move by number for each action, same as move_enumeration.csv where all possible solitaire move by numbers are enumerated
         self.action_space = spaces.Discrete(548, start=0)
+        # reverse lookup so the legal moves from PositionClass.legalMoves can be turned into actions
+        self.move_to_action = MOVE_TO_ACTION
+        self.action_types = [move_type(int(move)) for move in self.move_enumeration] # index into MetricsClass.MOVE_TYPES for each action
 
         # Add Q-learning components
-        self.q_table = {}
+        self.q_table = {} if q_table is None else q_table # state -> row of values for each action, a dict of np.zeros rows or anything that works like one (SparseQTableClass, QTableFileClass)
         self.learning_rate = 0.1
         self.discount_factor = 0.95
         self.epsilon = 0.1
+        self.reward_shape = reward_shape # function of the position's running counts, see default_reward
+        # symmetry=True makes positions that only differ by swapping the red suits, the black suits or the order of the
+        # tableau piles share a q_table row, the state is the canonical position's key and rows are indexed by canonical actions
+        self.symmetry = SymmetryClass(self.move_enumeration) if symmetry else None
+        self.state_transform = None # how the position of the last get_state maps onto its canonical position
+        self.q_before = None # when a dict, update_q_table saves the row of each state it changes first so train_parallel workers can send back just the changes
 
         #set up the gaame
-        self.pos = PositionClass.PositionClass()
-        self.pos.setUp()
+        # compact=True uses the array backed CompactPositionClass which is much faster, compact=False uses the original PositionClass
+        self.compact = compact
+        self.positionClass = CompactPositionClass if compact else PositionClass.PositionClass
+        self.deal_seed = random.getrandbits(32) # every game is dealt from a seed so it can be dealt again, see reset
+        self.pos = self.positionClass()
+        self.pos.setUp(self.deal_seed)
         self.reward = 0 # to keep the reward/score
         self.done = False # tell it when to stop
+        self.steps = 0 # moves made this episode
+        self.max_episode_steps = max_episode_steps # episode is truncated after this many moves, None for no limit
         #print(self.pos.gameStr())
         #print("Finished __init__")
-        self.verbose = verbose
+        self.verbose = verbose # print each move, the position and the reward
+        self.metrics = metrics # MetricsClass to count and time moves, None to not bother
+        self.recorder = recorder # TrajectoryRecorderClass to save every step to disk, None to not bother
+        # encoder=ObservationEncoderClass() makes reset and step return its float32 encoding of the position instead of the
+        # 13x24 observation, written into the same array every step so copy it if you want to keep it
+        self.encoder = encoder
+        if encoder is not None:
+            self.observation_space = spaces.Box(low=0, high=1, shape=encoder.shape, dtype=np.float32)
+            self.encoded = encoder.allocate()
+        # debug=True checks the zobrist hash used by get_state against the full position and looks for two positions with the same hash
+        self.debug = debug
+        self.state_observations = {} # hash -> observation bytes, only filled in debug mode
+        self.hash_collisions = 0
     #end __init__
 
-    def reset(self):
-        ''' resets the environment (i.e. solitaire game) and returns new initial position'''
-        self.pos = PositionClass.PositionClass()
-        self.pos.setUp()
+    def reset(self, seed=None):
+        ''' resets the environment (i.e. solitaire game) and returns new initial position
+            seed is the deal (any seed from 0 to 2**32 - 1), a new one is picked with random if it isn't given '''
+        self.deal_seed = random.getrandbits(32) if seed is None else seed
+        self.pos = self.positionClass()
+        self.pos.setUp(self.deal_seed)
         self.reward = 0 # to keep the reward/score
         self.done = False # tell it when to stop
+        self.steps = 0
 
         if self.verbose:
             print(self.pos.gameStr())
             print("reward = ", self.calculate_reward())
 
-        return self.positionClass_to_observation()
+        return self.current_observation()
     #end reset
 
     def step(self, action):
@@ -89,156 +139,398 @@ class OpenAiGymSolitaireClass(Env):
         assert self.action_space.contains(action), "Invalid Action"
 
         #convert action from enumeration to move-by-number
-        move = self.move_enumeration["move"][action]
-        print("action: ", action)
-        print("move: ", move)
+        move = int(self.move_enumeration[action])
+
+        metrics = self.metrics
+        if metrics is None:
+            try_action = self.pos.moveByNumber(move)
+        else:
+            metrics.start_step()
+            start = time.perf_counter_ns()
+            try_action = self.pos.moveByNumber(move)
+            metrics.record_move(self.action_types[action], try_action, time.perf_counter_ns() - start)
 
-        try_action = self.pos.moveByNumber(move)
         if try_action == False:
-            print("Move not recognised")
             done = True
             self.reward = -1000
         else:    
-            print(self.pos.gameStr())
             self.reward = self.calculate_reward()
 
-        print(self.reward)
-
-        observation = self.positionClass_to_observation()
+        if self.verbose:
+            print("action: ", action)
+            print("move: ", move)
+            if try_action == False:
+                print("Move not recognised")
+            else:
+                print(self.pos.gameStr())
+            print(self.reward)
+
+        self.steps += 1
+        observation = self.current_observation()
         reward = self.reward  # Change this line
         terminated = done
-        truncated = False
-        info = {} # TODO put things in print statements above into info so can choose whether to do something with them later and don't print every time
+        truncated = self.max_episode_steps is not None and self.steps >= self.max_episode_steps
+        info = {
+            "move": move,
+            "legal": try_action,
+            "visible_tableau_cards": self.pos.countVisibleTableauCards(),
+            "foundation_cards": self.pos.countFoundationCards(),
+            "won": self.pos.isWon(),
+        }
+        if metrics is not None:
+            info["metrics"] = metrics # counts so far, see MetricsClass.summary
+            metrics.end_step()
+        if self.recorder is not None:
+            self.recorder.record(self.deal_seed, action, reward, terminated, truncated, self.steps == 1)
 
         return observation, reward, terminated, truncated, info # step must return these outputs, see https://gymnasium.farama.org/api/env/#gymnasium.Env.step
     #end step
 
-    def positionClass_to_observation(self):
+    def positionClass_to_observation(self, copy=False):
         ''' takes in variable of type positionClass which must have been set up
-            and returns the matrix as per the observation space '''
+            and returns the matrix as per the observation space
+            the position keeps the matrix up to date itself so this is cheap, it is a read only view
+            that changes as moves are made so ask for a copy if you want to keep it '''
 
-        # set up return array
-        ret = np.ones((13, 24), dtype=np.int32)  
-        ret = ret * -2       # to set all to empty
+        return self.pos.toObservation(copy)
+    #end positionClass_to_observation
 
-        # put in foundations
-        for i in range(4):
-            for j in range(len(self.pos.foundationPiles[i].cards)):
-                ret[i,j] = self.pos.foundationPiles[i].cards[j].id
+    def current_observation(self):
+        ''' what reset and step return, the 13x24 observation or its encoding with self.encoder '''
+        if self.encoder is None:
+            return self.positionClass_to_observation()
+        return self.encoder.encode(self.pos, self.encoded)
 
-        # put in stock
-        for j in range(len(self.pos.stock.cards)):
-            ret[4,j] = self.pos.stock.cards[j].id
-
-        # put in waste
-        for j in range(len(self.pos.waste.cards)):
-            ret[5,j] = self.pos.waste.cards[j].id
-        
-        # put in tableau
-        for i in range(7):
-            for j in range(len(self.pos.tableauPiles[i].cards)):
-                card = self.pos.tableauPiles[i].cards[j]
-                if card.visible:
-                    ret[i+6,j] = card.id
-                else:
-                    ret[i+6,j] = -1
-        
-        return ret
-    #end positionClass_to_observation
+    def encode_observation(self, out, encoder=None):
+        ''' the position encoded by encoder (self.encoder if None) into out, e.g. a row of a caller's minibatch array '''
+        return (encoder or self.encoder).encode(self.pos, out)
 
     def calculate_reward(self):
-        ''' takes in self and calculates reward from position
+        ''' takes in self and calculates reward from position using self.reward_shape, by default
             1 point for each visible card in tableau
             5 points for each card in foundation piles
-            1000 points if game won (i.e. all cards in foundation piles'''
+            1000 points if game won (i.e. all cards in foundation piles
+            uses the counts the position keeps as moves are made so doesn't look at any cards '''
         #ToDo do we need to have penalty here if try to do an illegal move?
 
-        score = 0
-
-        # check in tableau
-        for i in range(7):
-            for j in range(len(self.pos.tableauPiles[i].cards)):
-                card = self.pos.tableauPiles[i].cards[j]
-                if card.visible:
-                    score += 1
-        
-        # check in foundation
-        foundation_cards = 0
-        for i in range(4):
-            score += len(self.pos.foundationPiles[i].cards) * 5
-            foundation_cards += len(self.pos.foundationPiles[i].cards)
-
-        # if game won
-        if foundation_cards == 52:
-            score = 1000
-        
-        return score
+        return self.reward_shape(self.pos.countVisibleTableauCards(), self.pos.countFoundationCards(), self.pos.isWon())
     #end calculate_reward
 
     def get_state(self):
-        # Convert the current game state to a hashable representation
-        return tuple(map(tuple, self.positionClass_to_observation()))
-
-    def get_action(self, state):
+        ''' key for the current position in the q_table, the 64 bit zobrist hash the position keeps up to date as moves are made
+            or with symmetry the key of the canonical position '''
+        if self.symmetry is not None:
+            state, self.state_transform = self.symmetry.canonicalise(self.positionClass_to_observation())
+            return state
+        state = self.pos.zobrist
+        if self.debug:
+            observation = self.positionClass_to_observation()
+            assert state == PositionClass.computeZobrist(observation), "zobrist hash out of date"
+            seen = self.state_observations.setdefault(state, observation.tobytes())
+            if seen != observation.tobytes():
+                self.hash_collisions += 1
+                warnings.warn(f"zobrist hash collision for state {state}")
+        return state
+
+    def legal_actions(self):
+        ''' list of the actions that are legal in the current position '''
+        return [self.move_to_action[move] for move in self.pos.legalMoves() if move in self.move_to_action]
+
+    def action_masks(self):
+        ''' boolean array over the action space, True where the action is legal in the current position '''
+        mask = np.zeros(self.action_space.n, dtype=bool)
+        mask[self.legal_actions()] = True
+        return mask
+
+    def get_action(self, state, legal_actions=None):
+        ''' epsilon-greedy action, if a list of legal_actions is given only those are explored or picked by the argmax '''
+        if legal_actions is not None and len(legal_actions) == 0:
+            legal_actions = None # nothing legal so any action will end the game
         if np.random.random() < self.epsilon:
-            return self.action_space.sample()
+            if legal_actions is None:
+                return self.action_space.sample()
+            return legal_actions[np.random.randint(len(legal_actions))]
         else:
-            if state not in self.q_table:
-                self.q_table[state] = np.zeros(self.action_space.n)
-            return np.argmax(self.q_table[state])
+            row = self.q_table.get(state) # states never seen aren't added, all their values are 0 so the first action wins
+            if row is None:
+                return 0 if legal_actions is None else legal_actions[0]
+            if self.symmetry is not None: # row is for the canonical position
+                if legal_actions is None:
+                    return self.symmetry.from_canonical(int(row.argmax()), self.state_transform)
+                return legal_actions[np.argmax(row[self.symmetry.to_canonical(legal_actions, self.state_transform)])]
+            if legal_actions is None:
+                return row.argmax()
+            return legal_actions[np.argmax(row[legal_actions])]
+
+    def q_action(self, action):
+        ''' the q_table column for action in the position of the last get_state, action itself unless using symmetry '''
+        if self.symmetry is None:
+            return action
+        return self.symmetry.to_canonical(action, self.state_transform)
 
     def update_q_table(self, state, action, reward, next_state):
+        capped = getattr(self.q_table, "max_states", None) is not None # a capped table mustn't evict state to make room for next_state
+        if capped:
+            self.q_table.pin((state, next_state))
         if state not in self.q_table:
             self.q_table[state] = np.zeros(self.action_space.n)
         if next_state not in self.q_table:
             self.q_table[next_state] = np.zeros(self.action_space.n)
 
+        if self.q_before is not None and state not in self.q_before:
+            self.q_before[state] = np.array(self.q_table[state], dtype=np.float64)
+
         current_q = self.q_table[state][action]
-        max_next_q = np.max(self.q_table[next_state])
+        max_next_q = self.q_table[next_state].max()
         new_q = current_q + self.learning_rate * (reward + self.discount_factor * max_next_q - current_q)
         self.q_table[state][action] = new_q
+        if capped:
+            self.q_table.unpin()
+
+    def _q_changes(self, current_q, max_next_q, rewards, terminated, weights):
+        ''' TD errors and the changes to make to the q values for a batch '''
+        errors = rewards + self.discount_factor * max_next_q * ~terminated - current_q
+        changes = self.learning_rate * errors
+        if weights is not None:
+            changes *= weights
+        return errors, changes
+
+    def update_q_batch(self, states, actions, rewards, next_states, terminated, weights=None):
+        ''' the Q-learning update for a minibatch of transitions at once (arrays as from ReplayBufferClass.sample),
+            states that have ended don't look at the next state, weights scale each update (prioritized replay)
+            returns the TD errors to use as new priorities
+            a QTableFileClass keeps every row in one matrix so the rows are found, read and updated with numpy for the
+            whole batch, a dict (or SparseQTableClass) has a separate array per state so it still goes row by row and
+            isn't much faster than calling update_q_table for each transition '''
+        q_table = self.q_table
+        if isinstance(q_table, QTableFileClass):
+            rows = q_table.findRows(states, add=True)
+            next_rows = q_table.findRows(next_states, add=True)
+            values = q_table.values # after adding, values.bin may have grown
+            current_q = values[rows, actions].astype(np.float64)
+            max_next_q = values[next_rows].max(axis=1).astype(np.float64)
+            errors, changes = self._q_changes(current_q, max_next_q, rewards, terminated, weights)
+            np.add.at(values, (rows, actions), changes.astype(values.dtype)) # a (state, action) in the batch more than once gets all of its changes
+            return errors
+
+        states = states.tolist() # q_table keys are python ints
+        next_states = next_states.tolist()
+        capped = getattr(q_table, "max_states", None) is not None # a capped table mustn't evict one state of the batch to make room for another
+        if capped:
+            q_table.pin(states + next_states)
+        for state in states + next_states:
+            if state not in q_table:
+                q_table[state] = np.zeros(self.action_space.n)
+        rows = [q_table[state] for state in states]
+        current_q = np.array([row[action] for row, action in zip(rows, actions.tolist())], dtype=np.float64)
+        max_next_q = np.array([q_table[state].max() for state in next_states], dtype=np.float64)
+        errors, changes = self._q_changes(current_q, max_next_q, rewards, terminated, weights)
+        for row, action, change in zip(rows, actions.tolist(), changes.tolist()):
+            row[action] += change
+        if capped:
+            q_table.unpin()
+        return errors
+    #end update_q_batch
+
+    def train(self, num_episodes, legal_only=False):
+        ''' Q-learning for num_episodes games, legal_only=True only explores and picks legal moves '''
+        for episode in range(num_episodes):
+            total_reward = self.play_episode(legal_only)
+
+            if episode % 100 == 0:
+                print(f"Episode {episode}, Total Reward: {total_reward}")
 
-    def train(self, num_episodes):
-        original_stdout = sys.stdout
-        sys.stdout = io.StringIO()  # Redirect stdout to a string buffer
+        print("Training completed.")
+
+    def play_episode(self, legal_only=False):
+        ''' plays one game from the current position updating the q_table as it goes, then resets, returns the final reward '''
+        state = self.get_state()
+        total_reward = 0
+        done = False
 
+        while not done:
+            action = self.get_action(state, self.legal_actions() if legal_only else None)
+            q_action = self.q_action(action) # before the move as the next get_state changes state_transform
+            observation, reward, terminated, truncated, _ = self.step(action)
+            next_state = self.get_state()
+            total_reward = reward
+
+            self.update_q_table(state, q_action, reward, next_state)
+
+            state = next_state
+            done = terminated or truncated
+
+        if self.metrics is not None:
+            self.metrics.record_episode(total_reward)
+        self.reset()
+        return total_reward
+
+    def train_replay(self, num_episodes, buffer=None, batch_size=64, updates_per_step=1, warmup=1000, legal_only=False):
+        ''' Q-learning from a replay buffer, every move played goes into buffer (a uniform ReplayBufferClass if None)
+            and after warmup moves each move does updates_per_step minibatch updates of batch_size transitions '''
+        if buffer is None:
+            buffer = ReplayBufferClass()
+        self.replay_buffer = buffer
         for episode in range(num_episodes):
             state = self.get_state()
             total_reward = 0
             done = False
-
             while not done:
-                action = self.get_action(state)
+                action = self.get_action(state, self.legal_actions() if legal_only else None)
+                q_action = self.q_action(action)
                 observation, reward, terminated, truncated, _ = self.step(action)
                 next_state = self.get_state()
                 total_reward = reward
+                buffer.add(state, q_action, reward, next_state, terminated)
 
-                self.update_q_table(state, action, reward, next_state)
+                if len(buffer) >= warmup:
+                    for update in range(updates_per_step):
+                        indices, states, actions, rewards, next_states, ended, weights = buffer.sample(batch_size)
+                        errors = self.update_q_batch(states, actions, rewards, next_states, ended, weights if buffer.prioritized else None)
+                        buffer.update_priorities(indices, errors)
 
                 state = next_state
                 done = terminated or truncated
 
+            if self.metrics is not None:
+                self.metrics.record_episode(total_reward)
+            self.reset()
             if episode % 100 == 0:
-                sys.stdout = original_stdout  # Temporarily restore stdout
                 print(f"Episode {episode}, Total Reward: {total_reward}")
-                sys.stdout = io.StringIO()  # Redirect stdout back to string buffer
 
-            self.reset()
+        print("Training completed.")
+    #end train_replay
+
+    def train_parallel(self, num_episodes, num_workers=None, seed=0, sync_every=100, legal_only=False):
+        ''' Q-learning spread over num_workers processes
+            each worker plays sync_every episodes with its own random stream from seed, then sends back
+            how much it changed each q value, the changes are added into self.q_table in worker order
+            and the new values sent out to every worker before the next round.
+            The same seed and num_workers always gives the same q_table '''
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        seeds = np.random.SeedSequence(seed).spawn(num_workers)
+        settings = (self.learning_rate, self.discount_factor, self.epsilon, self.max_episode_steps, self.compact, self.symmetry is not None)
+
+        connections = []
+        workers = []
+        for worker_seed in seeds:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_train_worker, args=(child_conn, settings, worker_seed), daemon=True)
+            worker.start()
+            connections.append(parent_conn)
+            workers.append(worker)
+
+        try:
+            merged = list(self.q_table.items()) # every worker starts from the current table
+            episodes_done = 0
+            while episodes_done < num_episodes:
+                round_episodes = min(sync_every * num_workers, num_episodes - episodes_done)
+                for i, conn in enumerate(connections):
+                    share = round_episodes // num_workers + (1 if i < round_episodes % num_workers else 0)
+                    conn.send((share, merged, legal_only))
+
+                rewards = []
+                changed = {}
+                for conn in connections: # always merge in worker order so results are reproducible
+                    worker_rewards, deltas = conn.recv()
+                    rewards.extend(worker_rewards)
+                    for state, actions, delta in deltas:
+                        row = self.q_table.get(state)
+                        if row is None:
+                            self.q_table[state] = np.zeros(self.action_space.n)
+                            row = self.q_table[state]
+                        row[actions] += delta
+                        changed[state] = row # kept here as a capped table may evict it while the rest are merged
+                merged = list(changed.items())
+
+                episodes_done += round_episodes
+                print(f"Episode {episodes_done}, Mean Reward: {np.mean(rewards)}")
+        finally:
+            for conn in connections:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError): # worker already gone, error from recv is the one to see
+                    pass
+            for worker in workers:
+                worker.join()
 
-        sys.stdout = original_stdout  # Restore stdout
         print("Training completed.")
 
+    def close(self):
+        ''' finish writing anything the recorder has buffered '''
+        if self.recorder is not None:
+            self.recorder.flush()
+        super().close()
+
     def save_model(self, filename):
-        with open(filename, 'wb') as f:
-            pickle.dump(self.q_table, f)
+        ''' filename ending .qtable saves as a memory mapped QTableFileClass directory, anything else pickles the q_table dict
+            a table already at filename is replaced, unless it is the one being trained into which just has its new rows flushed '''
+        if filename.endswith(".qtable"):
+            if isinstance(self.q_table, QTableFileClass) and os.path.abspath(self.q_table.path) == os.path.abspath(filename):
+                self.q_table.flush() # already saving straight into it
+            else:
+                # written alongside then swapped in, so an old model's states never end up mixed in with this one's
+                temp = filename + ".tmp"
+                shutil.rmtree(temp, ignore_errors=True)
+                table = QTableFileClass(temp, "w", self.action_space.n)
+                table.update(self.q_table)
+                table.close()
+                if os.path.exists(filename):
+                    old = filename + ".old"
+                    shutil.rmtree(old, ignore_errors=True)
+                    os.replace(filename, old)
+                    os.replace(temp, filename)
+                    shutil.rmtree(old)
+                else:
+                    os.replace(temp, filename)
+        else:
+            with open(filename, 'wb') as f:
+                pickle.dump(self.q_table, f)
         print(f"Model saved to {filename}")
 
-    def load_model(self, filename):
-        with open(filename, 'rb') as f:
-            self.q_table = pickle.load(f)
+    def load_model(self, filename, mode="r"):
+        ''' a .qtable is opened memory mapped so nothing is read until it is used, mode "r+" to keep training it,
+            anything else is unpickled '''
+        if filename.endswith(".qtable"):
+            self.q_table = QTableFileClass(filename, mode)
+        else:
+            with open(filename, 'rb') as f:
+                self.q_table = pickle.load(f)
         print(f"Model loaded from {filename}")
 #end OpenAiGymSolitaireClass
 
+def _train_worker(conn, settings, seed):
+    ''' runs in a train_parallel worker process, plays the episodes it is sent and sends back the q value changes '''
+    random_seed, numpy_seed, action_seed = seed.generate_state(3)
+    random.seed(int(random_seed)) # used to shuffle the deck
+    np.random.seed(int(numpy_seed))
+
+    env = OpenAiGymSolitaireClass(verbose=False, compact=settings[4], max_episode_steps=settings[3], symmetry=settings[5])
+    env.learning_rate, env.discount_factor, env.epsilon = settings[:3]
+    env.action_space.seed(int(action_seed))
+    env.reset()
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        num_episodes, merged, legal_only = message
+        for state, row in merged:
+            env.q_table[state] = row
+
+        env.q_before = {}
+        rewards = [env.play_episode(legal_only) for episode in range(num_episodes)]
+        deltas = []
+        for state, before in env.q_before.items():
+            after = np.asarray(env.q_table[state])
+            actions = np.flatnonzero(after != before)
+            deltas.append((state, actions, after[actions] - before[actions]))
+        env.q_before = None
+        conn.send((rewards, deltas))
+    conn.close()
+#end _train_worker
+
 if __name__ == "__main__":
 
     ############################################################################################
@@ -273,9 +565,10 @@ if __name__ == "__main__":
     # Train the model
     env = OpenAiGymSolitaireClass()
     env.train(num_episodes=100000)
+    #env.train_parallel(num_episodes=100000, seed=0) # same but using every core
 
     # Save the trained model
-    env.save_model("solitaire_model.pkl")
+    env.save_model("solitaire_model.qtable") # memory mapped, a name ending .pkl pickles the dict instead
 
     # Test the trained agent
     state = env.reset()
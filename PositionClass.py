@@ -27,9 +27,11 @@
 import numpy as np
 import random
 from copy import deepcopy
-import pandas as pd
+from collections import namedtuple
 
-deckDetails = pd.read_csv("deckdetails.csv") #dataframe of card details
+from CardTables import DECK_DETAILS, MOVE_DECODE, STOCK_TO_WASTE, WASTE_TO_FOUNDATION, TABLEAU_TO_FOUNDATION, WASTE_TO_TABLEAU, FOUNDATION_TO_TABLEAU, TABLEAU_ROW
+
+deckDetails = DECK_DETAILS # card details, columns as in deckdetails.csv
 
 
 global CLUBS
@@ -45,6 +47,35 @@ RED = "red"
 global BLACK
 BLACK = "black"
 
+# what happened to each move given to applyMoves
+MOVED = "moved"
+ILLEGAL = "illegal"     # a real move but not allowed in the position
+UNKNOWN = "unknown"     # not a moveByNumber code at all
+MoveResult = namedtuple("MoveResult", ["code", "move", "status"]) # move is the CardTables.MoveRecord, None if UNKNOWN
+
+# Zobrist hashing of positions, a random 64 bit key for every (pile, place in pile, what is there) where what is
+# there is a card id 0 to 51 or -1 for face down, piles and places as per toObservation, empty places have no key.
+# The hash of a position is all the keys for what is in it XORed together, so a move only needs to XOR the keys
+# of the cards it moves in and out rather than look at the whole position.
+ZOBRIST_VALUES = 53
+_zobristRandom = random.Random(27092021) # fixed seed so hashes are the same every run and can be saved with a model
+ZOBRIST_KEYS = [_zobristRandom.getrandbits(64) for i in range(13 * 24 * ZOBRIST_VALUES)]
+
+def zobristKey(row, col, value):
+    """ key for value (card id or -1 for face down) being at place col of pile row """
+    return ZOBRIST_KEYS[(row * 24 + col) * ZOBRIST_VALUES + value + 1]
+
+def computeZobrist(observation):
+    """ hash of a whole 13x24 observation from scratch, the move methods keep PositionClass.zobrist equal to this """
+    h = 0
+    for row in range(13):
+        for col in range(24):
+            value = int(observation[row][col])
+            if value != -2:
+                h ^= zobristKey(row, col, value)
+    return h
+#end computeZobrist
+
 class CardClass:
     """ class to hold a single card """
     def __init__(self, idIn, valueTextIn, valueNumIn, suitTextIn, suitUnicodeIn, colourIn):
@@ -260,8 +291,48 @@ class PositionClass():
         for i in np.arange(0,7):
             self.tableauPiles.append(TableauPileClass())
         #end for
+        # all piles in the same order as toObservation
+        self.piles = self.foundationPiles + [self.stock, self.waste] + self.tableauPiles
+        self.zobrist = 0 # hash of the position, kept up to date by the move methods
+        self.pileHashes = [0] * 13 # part of the hash from each pile
+        self.version = 0 # goes up by one every time cards move
+        self.visibleTableauCards = 0 # running counts for the reward, kept up to date by the move methods
+        self.foundationCards = 0
+        self.pileCounts = [0] * 13 # face up cards in each pile
+        self.undoLog = [] # (move, src, dst, n, reverse, turned over) for each move made with push, so pop can take it back
+        self._observation = np.full((13, 24), -2, dtype=np.int32) # toObservation result, only brought up to date when asked for
+        self._observationVersion = 0
+        self._dirtyPiles = set() # piles changed since _observation was last brought up to date
     #end __init__
 
+    def _pilesChanged(self, *rows):
+        """ update zobrist, the counts and the observation after cards have moved in the given piles, only looks at those piles """
+        for row in rows:
+            h = 0
+            count = 0
+            for j, card in enumerate(self.piles[row].cards):
+                if row < 6 or card.visible:
+                    h ^= zobristKey(row, j, card.id)
+                    count += 1
+                else:
+                    h ^= zobristKey(row, j, -1)
+            self.zobrist ^= self.pileHashes[row] ^ h
+            self.pileHashes[row] = h
+            if row < 4:
+                self.foundationCards += count - self.pileCounts[row]
+            elif row >= 6:
+                self.visibleTableauCards += count - self.pileCounts[row]
+            self.pileCounts[row] = count
+        self._dirtyPiles.update(rows)
+        self.version += 1
+    #end _pilesChanged
+
+    def _foundationRow(self, card):
+        """ index of the foundation pile for the suit of card """
+        for i, pile in enumerate(self.foundationPiles):
+            if pile.suit == card.suit:
+                return i
+
     def __str__(self) -> str:
         foundStr0 = "Foundation Clubs: " + str(self.foundationPiles[0])
         foundStr1 = "Foundation Diamonds: " + str(self.foundationPiles[1])
@@ -290,9 +361,11 @@ class PositionClass():
         return "Position:\n" + foundStr0 + "\n" + foundStr1 + "\n" + foundStr2 + "\n" + foundStr3 + "\n" + stockStr + "\n" + wasteStr + "\n" + tableauStr
     #end __str__
 
-    def setUp(self):
-        """put everything into position to start a random game"""
-        deck = DeckClass(deckDetails)
+    def setUp(self, seed=None):
+        """put everything into position to start a random game, seed picks the deal so the same seed always gives the same game"""
+        deck = DeckClass(deckDetails, shuffle=seed is None)
+        if seed is not None:
+            random.Random(seed).shuffle(deck.cards)
         #fill tableau
         for i in np.arange(0,7):
             for j in np.arange(0, i+1):
@@ -308,6 +381,7 @@ class PositionClass():
         #put rest of cards in stock
         for card in deck.cards:
             self.stock.addCard(card)
+        self._pilesChanged(*range(13))
     #end setUp
 
     def moveStockToWaste(self):
@@ -324,6 +398,7 @@ class PositionClass():
                 self.waste.cards = [] #no cards in waste
                 #for card in self.stock.cards:
                 #    card.visible = False
+                self._pilesChanged(4, 5)
                 return True
         else: # cards in stock so move 3 cards from stock to waste (or fewer if fewer available)
             for i in np.arange(0,3):
@@ -331,6 +406,7 @@ class PositionClass():
                     card = self.stock.cards[-1]
                     self.waste.addCard(deepcopy(card))
                     self.stock.cards.remove(card)
+            self._pilesChanged(4, 5)
             return True
     #end moveStockToWaste        
 
@@ -345,13 +421,13 @@ class PositionClass():
                     ret = pile.addCard(card)
                     if ret == True:
                         self.waste.cards.remove(self.waste.cards[-1])
+                        self._pilesChanged(5, self._foundationRow(card))
             return ret
     #end moveWasteToFoundation
 
     def moveTableauToFoundation(self, tableauNum):
         """ moves a card from Tableau to correct Foundation """
         if tableauNum < 0 or tableauNum > 6:
-            print("tableauNum:", tableauNum, " not allowed!")
             return False
         elif len(self.tableauPiles[tableauNum].cards) == 0:
             return False
@@ -364,16 +440,15 @@ class PositionClass():
                         self.tableauPiles[tableauNum].cards.remove(self.tableauPiles[tableauNum].cards[-1]) # remove card from pile
                         if len(self.tableauPiles[tableauNum].cards) > 0: # if any cards left in tableau
                             self.tableauPiles[tableauNum].cards[-1].visible = True # make new top card visible
+                        self._pilesChanged(6 + tableauNum, self._foundationRow(card))
             return ret
     #end moveTableauToFoundation
 
     def moveFoundationToTableau(self, foundationNum, tableauNum):
         """ moves a card from Foundation to stock """
         if tableauNum < 0 or tableauNum > 6:
-            print("tableauNum:", tableauNum, " not allowed!")
             return False
         elif foundationNum < 0 or foundationNum > 3:
-            print("foundationNum:", foundationNum, " not allowed!")
             return False    
         elif len(self.foundationPiles[foundationNum].cards) == 0:  #no cards in foundation pile
             return False
@@ -382,6 +457,7 @@ class PositionClass():
             ret = self.tableauPiles[tableauNum].addCard(card)
             if ret == True: # move was ok
                 self.foundationPiles[foundationNum].cards.pop(-1) #remove card from foundation pile
+                self._pilesChanged(foundationNum, 6 + tableauNum)
             # else: #move not ok return False
             return ret
         #ToDo need to test this function
@@ -390,16 +466,15 @@ class PositionClass():
     def moveWasteToTableau(self, tableauNum):
         """ moves card from Waste to Tableau """
         if tableauNum < 0 or tableauNum > 6:
-            print("tableauNum:", tableauNum, " not allowed!")
             return False
         elif len(self.waste.cards) == 0:
-            print("No cards in waste to move")
             return False
         else:
             card = deepcopy(self.waste.cards[-1])
             ret = self.tableauPiles[tableauNum].addCard(card)
             if ret == True: # move was ok
                 self.waste.cards.pop(-1) #remove card from foundation pile
+                self._pilesChanged(5, 6 + tableauNum)
             # else: #move not ok return False
             return ret
 
@@ -407,10 +482,8 @@ class PositionClass():
         """ moves cards from Tableau to another Tableau """
         ok_to_move = False
         if startTableauNum < 0 or startTableauNum > 6:
-            print("startTableauNum:", startTableauNum, " not allowed!")
             ok_to_move = False
         elif endTableauNum < 0 or endTableauNum > 6:
-            print("endTableauNum:", endTableauNum, " not allowed!")
             ok_to_move = False        
         elif len(self.tableauPiles[startTableauNum].cards) < numCards:  #trying to move more cards than exist
             ok_to_move = False
@@ -445,39 +518,197 @@ class PositionClass():
             # if card left in start pile then make it visible
             if len(self.tableauPiles[startTableauNum].cards) > 0:
                 self.tableauPiles[startTableauNum].cards[-1].visible = True # make new top card visible
+            self._pilesChanged(6 + startTableauNum, 6 + endTableauNum)
             return True
         else:
             return False
     #end moveTableauToTableau
 
     def moveByNumber(self, num):
-        """ takes a number in, which controls what move to do """
-        if num==1:
-            ret=self.moveStockToWaste()
-        elif num==2:
-            ret=self.moveWasteToFoundation()
-        elif num>=10 and num <= 16:  # move tableau to foundation
-            lastDigit = int(str(num)[-1]) # gets final digit
-            ret=self.moveTableauToFoundation(lastDigit)
-        elif num>=20 and num <= 26:  # move waste to tableau pile 0 to 6
-            lastDigit = int(str(num)[-1]) # gets final digit
-            ret=self.moveWasteToTableau(lastDigit) #still need to code!
-        elif num>=100 and num <= 136:  # code - 1ij - move foundation pile i to tableau pile j
-            foundationNum = int(str(num)[-2])
-            tableauNum = int(str(num)[-1])
-            ret=self.moveFoundationToTableau(foundationNum,tableauNum)
-        elif num >= 10000 and num <= 16613:  # code - 1ijkl - move kl cards from tableau pile i to tableau pile j
-            tableauFromNum = int(str(num)[1])
-            print("tableauFromNum = ", tableauFromNum)
-            tableauToNum = int(str(num)[2])
-            print("tableauToNum = ", tableauToNum)
-            cardsToMove = int(str(num)[3] + str(num)[4])
-            print("cardsToMove = ", cardsToMove)
-            ret=self.moveTableauToTableau(tableauFromNum, tableauToNum, cardsToMove)
-        else:
-            ret=False
-        return ret
+        """ takes a number in, which controls what move to do, see CardTables.MOVE_DECODE for the codes """
+        move = MOVE_DECODE.get(num)
+        if move is None: # not a move code
+            return False
+        return self._applyMove(move)
     #end moveByNumber
+
+    def _applyMove(self, move):
+        """ does a CardTables.MoveRecord """
+        kind = move.kind
+        if kind == STOCK_TO_WASTE:
+            return self.moveStockToWaste()
+        elif kind == WASTE_TO_FOUNDATION:
+            return self.moveWasteToFoundation()
+        elif kind == TABLEAU_TO_FOUNDATION:
+            return self.moveTableauToFoundation(move.source - TABLEAU_ROW)
+        elif kind == WASTE_TO_TABLEAU:
+            return self.moveWasteToTableau(move.destination - TABLEAU_ROW)
+        elif kind == FOUNDATION_TO_TABLEAU:
+            return self.moveFoundationToTableau(move.source, move.destination - TABLEAU_ROW)
+        return self.moveTableauToTableau(move.source - TABLEAU_ROW, move.destination - TABLEAU_ROW, move.count)
+    #end _applyMove
+
+    def applyMoves(self, moves, stop=True):
+        """ does each moveByNumber code in moves in turn, returns a MoveResult for each one tried,
+            stop=True stops at the first one that isn't MOVED """
+        results = []
+        for num in moves:
+            move = MOVE_DECODE.get(num)
+            if move is None:
+                results.append(MoveResult(num, None, UNKNOWN))
+            elif self._applyMove(move):
+                results.append(MoveResult(num, move, MOVED))
+                continue
+            else:
+                results.append(MoveResult(num, move, ILLEGAL))
+            if stop:
+                break
+        return results
+    #end applyMoves
+
+    def _canAddToTableau(self, card, tableauNum):
+        """ same check as TableauPileClass.addCard without adding the card """
+        pileCards = self.tableauPiles[tableauNum].cards
+        if len(pileCards) == 0:
+            return card.value == 13
+        return card.colour != pileCards[-1].colour and pileCards[-1].value == card.value + 1
+
+    def _canAddToFoundation(self, card):
+        """ same check as FoundationPileClass.addCard without adding the card, piles are in suit order """
+        for pile in self.foundationPiles:
+            if pile.suit == card.suit:
+                return len(pile.cards) == card.value - 1
+        return False
+
+    def _transferForMove(self, num):
+        """ which piles move num takes cards from and to, how many and whether they are turned over one at a time,
+            as (src, dst, n, reverse) with piles numbered as in toObservation, None if that can't be worked out """
+        move = MOVE_DECODE.get(num)
+        if move is None:
+            return None
+        if move.kind == STOCK_TO_WASTE:
+            if len(self.stock.cards) > 0:
+                return 4, 5, min(3, len(self.stock.cards)), True
+            return 5, 4, len(self.waste.cards), True
+        elif move.destination == -1: # to the foundation for the card's suit
+            srcCards = self.piles[move.source].cards
+            if len(srcCards) == 0:
+                return None
+            return move.source, self._foundationRow(srcCards[-1]), 1, False
+        return move.source, move.destination, move.count, False
+    #end _transferForMove
+
+    def push(self, num):
+        """ make move num (a moveByNumber code) so that it can be taken back with pop, returns False if the move isn't legal """
+        transfer = self._transferForMove(num)
+        if transfer is None:
+            return False
+        src, dst, n, reverse = transfer
+        srcCards = self.piles[src].cards
+        turnedOver = src >= 6 and len(srcCards) > n and not srcCards[-n - 1].visible
+        if not self.moveByNumber(num):
+            return False
+        self.undoLog.append((num, src, dst, n, reverse, turnedOver))
+        return True
+    #end push
+
+    def pop(self):
+        """ take back the last move made with push and return its code, the position is exactly as it was before the move """
+        num, src, dst, n, reverse, turnedOver = self.undoLog.pop()
+        srcCards = self.piles[src].cards
+        dstCards = self.piles[dst].cards
+        if turnedOver:
+            srcCards[-1].visible = False
+        moved = dstCards[len(dstCards) - n:]
+        del dstCards[len(dstCards) - n:]
+        if reverse:
+            moved.reverse()
+        srcCards.extend(moved)
+        self._pilesChanged(src, dst)
+        return num
+    #end pop
+
+    def legalMoves(self):
+        """ list of the moveByNumber codes that are legal in this position, without trying each move """
+        moves = []
+
+        if len(self.stock.cards) > 0 or len(self.waste.cards) > 0:
+            moves.append(1)
+
+        wasteCard = self.waste.cards[-1] if len(self.waste.cards) > 0 else None
+        if wasteCard is not None and self._canAddToFoundation(wasteCard):
+            moves.append(2)
+
+        for t in range(7):
+            pileCards = self.tableauPiles[t].cards
+            if len(pileCards) > 0 and self._canAddToFoundation(pileCards[-1]):
+                moves.append(10 + t)
+
+        if wasteCard is not None:
+            for t in range(7):
+                if self._canAddToTableau(wasteCard, t):
+                    moves.append(20 + t)
+
+        for f in range(4):
+            if len(self.foundationPiles[f].cards) > 0:
+                card = self.foundationPiles[f].cards[-1]
+                for t in range(7):
+                    if self._canAddToTableau(card, t):
+                        moves.append(100 + 10*f + t)
+
+        # tableau to tableau, the face up part of a pile always runs down in value so only one
+        # number of cards from pile i can fit on pile j: enough to reach one below its top card (or a king if empty)
+        for i in range(7):
+            pileCards = self.tableauPiles[i].cards
+            visible = 0
+            while visible < len(pileCards) and pileCards[-1 - visible].visible:
+                visible += 1
+            if visible == 0:
+                continue
+            topValue = pileCards[-1].value
+            for j in range(7):
+                if j == i:
+                    continue
+                endCards = self.tableauPiles[j].cards
+                if len(endCards) == 0:
+                    numCards = 14 - topValue
+                else:
+                    numCards = endCards[-1].value - topValue
+                if numCards >= 1 and numCards <= visible and self._canAddToTableau(pileCards[-numCards], j):
+                    moves.append(10000 + 1000*i + 100*j + numCards)
+        return moves
+    #end legalMoves
+
+    def toObservation(self, copy=False):
+        """ returns the position as a 13x24 matrix, rows are foundations 0-3, stock, waste, tableau 0-6
+            each card is its id 0 to 51, -1 for a face down card and -2 for an empty space
+            the matrix is kept between calls and only piles that have changed since the last call are written again,
+            returns a read only view of it that will change as moves are made unless copy=True """
+        if self._observationVersion != self.version:
+            for row in self._dirtyPiles:
+                values = [card.id if (row < 6 or card.visible) else -1 for card in self.piles[row].cards]
+                self._observation[row, :len(values)] = values
+                self._observation[row, len(values):] = -2
+            self._dirtyPiles.clear()
+            self._observationVersion = self.version
+
+        if copy:
+            return self._observation.copy()
+        view = self._observation.view()
+        view.flags.writeable = False
+        return view
+    #end toObservation
+
+    def countVisibleTableauCards(self):
+        """ number of face up cards in the tableau """
+        return self.visibleTableauCards
+
+    def countFoundationCards(self):
+        """ number of cards on the foundation piles, 52 means the game is won """
+        return self.foundationCards
+
+    def isWon(self):
+        return self.foundationCards == 52
 #end PositionClass
 
 def testPositionClass():
@@ -0,0 +1,259 @@
+# QTableFileClass.py
+# Laurence Smith
+
+# Q-table kept on disk so it doesn't all have to be read in (or even fit in memory) before it can be used.
+# A table is a directory holding
+#   header.json   number of actions, value dtype, index capacity, rows used
+#   index.bin     open addressing hash table of (state, row + 1), row 0 means an empty slot, states are the
+#                 64 bit zobrist hashes from get_state so the low bits of the state are used as the slot
+#   values.bin    the Q values, one row of actions per state in the order states were added
+# Both files are memory mapped so only the rows actually looked at are read from disk, and processes that
+# open the same table read only share the one copy in the page cache.
+# New states are appended to values.bin, which grows by doubling without rewriting what is there already.
+# Only the index is rebuilt when it gets half full.
+# Works like the q_table dict in OpenAiGymSolitaireClass: `state in table`, `table[state]` (a row that can be
+# changed in place unless opened read only), `table[state] = row`, len, keys and items.
+
+import json
+import os
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([("state", "<u8"), ("row", "<i8")])
+
+class QTableFileClass():
+    """ Q-table in a memory mapped directory, mode "r" read only, "r+" read and write, "w" new empty table """
+    def __init__(self, path, mode="r", actions=548, dtype=np.float32) -> None:
+        self.path = path
+        self.mode = mode
+        if mode == "w":
+            os.makedirs(path, exist_ok=True)
+            self.actions = int(actions)
+            self.dtype = np.dtype(dtype)
+            self.capacity = 1024 # index slots, always a power of 2
+            self.rows = 0
+            self.row_capacity = 0 # rows values.bin has room for
+            open(self._file("index.bin"), "wb").close()
+            open(self._file("values.bin"), "wb").close()
+            self._resizeIndex(self.capacity)
+            self._writeHeader()
+        elif mode in ("r", "r+"):
+            with open(self._file("header.json")) as f:
+                header = json.load(f)
+            self.actions = header["actions"]
+            self.dtype = np.dtype(header["dtype"])
+            self.capacity = header["capacity"]
+            self.rows = header["rows"]
+            self.row_capacity = os.path.getsize(self._file("values.bin")) // (self.actions * self.dtype.itemsize)
+        else:
+            raise ValueError(f"mode must be 'r', 'r+' or 'w' not {mode!r}")
+        self._index = None # memory maps are made when first needed
+        self._values = None
+    #end __init__
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _writeHeader(self):
+        header = {"actions": self.actions, "dtype": self.dtype.str, "capacity": self.capacity, "rows": self.rows}
+        with open(self._file("header.json"), "w") as f:
+            json.dump(header, f)
+
+    def _mapIndex(self):
+        if self._index is None:
+            self._index = np.memmap(self._file("index.bin"), dtype=INDEX_DTYPE, mode="r" if self.mode == "r" else "r+", shape=(self.capacity,))
+        return self._index
+
+    def _mapValues(self):
+        if self._values is None and self.row_capacity > 0:
+            self._values = np.memmap(self._file("values.bin"), dtype=self.dtype, mode="r" if self.mode == "r" else "r+", shape=(self.row_capacity, self.actions))
+        return self._values
+
+    def _find(self, state):
+        """ slot in the index for state and the row + 1 stored there, 0 if state isn't in the table """
+        index = self._mapIndex()
+        states = index["state"]
+        rows = index["row"]
+        mask = self.capacity - 1
+        slot = state & mask
+        while True:
+            row = int(rows[slot])
+            if row == 0 or int(states[slot]) == state:
+                return slot, row
+            slot = (slot + 1) & mask
+    #end _find
+
+    def _resizeIndex(self, capacity):
+        """ rebuild the index with capacity slots, the values aren't touched """
+        if self.rows:
+            index = self._mapIndex()
+            old = index[index["row"] > 0].copy()
+        else:
+            old = np.zeros(0, dtype=INDEX_DTYPE)
+        self._index = None
+        index = np.zeros(capacity, dtype=INDEX_DTYPE)
+        mask = capacity - 1
+        for state, row in old:
+            slot = int(state) & mask
+            while index["row"][slot] != 0:
+                slot = (slot + 1) & mask
+            index[slot] = (state, row)
+        temp = self._file("index.bin.tmp")
+        index.tofile(temp)
+        os.replace(temp, self._file("index.bin"))
+        self.capacity = capacity
+    #end _resizeIndex
+
+    def _growValues(self, rows):
+        """ make values.bin big enough for rows rows, new space reads as zeros """
+        if rows <= self.row_capacity:
+            return
+        capacity = max(1024, self.row_capacity)
+        while capacity < rows:
+            capacity *= 2
+        if self._values is not None:
+            self._values.flush()
+            self._values = None
+        with open(self._file("values.bin"), "r+b") as f:
+            f.truncate(capacity * self.actions * self.dtype.itemsize)
+        self.row_capacity = capacity
+    #end _growValues
+
+    def findRows(self, states, add=False):
+        """ rows of values (0 based) for an array of states, -1 for states not in the table, add=True adds those first
+            the probing is done for the whole array at once with numpy """
+        states = np.asarray(states, dtype=np.uint64)
+        if add:
+            missing = states[self.findRows(states) < 0]
+            for state in dict.fromkeys(missing.tolist()): # in the order they come, without repeats
+                self[state] = 0
+        index = self._mapIndex()
+        mask = self.capacity - 1
+        slots = (states & np.uint64(mask)).astype(np.int64)
+        rows = np.full(len(states), -1, dtype=np.int64)
+        todo = np.arange(len(states))
+        while len(todo):
+            slotRows = index["row"][slots[todo]]
+            found = (slotRows != 0) & (index["state"][slots[todo]] == states[todo])
+            rows[todo[found]] = slotRows[found] - 1
+            todo = todo[(slotRows != 0) & ~found] # slot taken by another state, look in the next one
+            slots[todo] = (slots[todo] + 1) & mask
+        return rows
+    #end findRows
+
+    @property
+    def values(self):
+        """ the (rows, actions) matrix of every row, rows past len aren't used yet """
+        return self._mapValues()
+
+    def __contains__(self, state):
+        return self._find(state)[1] != 0
+
+    def __getitem__(self, state):
+        row = self._find(state)[1]
+        if row == 0:
+            raise KeyError(state)
+        return self._mapValues()[row - 1]
+
+    def get(self, state, default=None):
+        row = self._find(state)[1]
+        if row == 0:
+            return default
+        return self._mapValues()[row - 1]
+
+    def __setitem__(self, state, values):
+        if self.mode == "r":
+            raise ValueError("Q-table opened read only")
+        slot, row = self._find(state)
+        if row == 0: # new state, append a row
+            if (self.rows + 1) * 2 > self.capacity:
+                self._resizeIndex(self.capacity * 2)
+                slot, row = self._find(state)
+            self._growValues(self.rows + 1)
+            self.rows += 1
+            row = self.rows
+            index = self._mapIndex()
+            index[slot] = (state, row)
+        self._mapValues()[row - 1] = values
+    #end __setitem__
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        """ states in the order they were added """
+        index = self._mapIndex()
+        used = index[index["row"] > 0]
+        for state in used["state"][np.argsort(used["row"])]:
+            yield int(state)
+
+    def items(self):
+        for state in self.keys():
+            yield state, self[state]
+
+    def update(self, q_table):
+        """ write every row of a dict (or another table) in, overwriting states already here and appending new ones """
+        for state, values in q_table.items():
+            self[state] = values
+
+    def flush(self):
+        """ make sure everything is on disk """
+        if self.mode == "r":
+            return
+        if self._index is not None:
+            self._index.flush()
+        if self._values is not None:
+            self._values.flush()
+        self._writeHeader()
+
+    def close(self):
+        self.flush()
+        self._index = None
+        self._values = None
+
+    def __getstate__(self):
+        """ memory maps aren't pickled, each process maps the files itself when it first needs them """
+        state = self.__dict__.copy()
+        state["_index"] = None
+        state["_values"] = None
+        return state
+#end QTableFileClass
+
+def testQTableFileClass():
+    """ write a table, add to it, and read it back read only """
+    import tempfile
+    rng = np.random.default_rng(0)
+    q_table = {int(s): rng.random(548) for s in rng.integers(0, 2**63, 3000, dtype=np.uint64)}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "test.qtable")
+        table = QTableFileClass(path, "w")
+        table.update(q_table)
+        table.close()
+
+        table = QTableFileClass(path, "r+")
+        extra = {int(s): rng.random(548) for s in rng.integers(0, 2**63, 2000, dtype=np.uint64)}
+        table.update(extra)
+        first = next(iter(q_table))
+        table[first][5] = 42.0 # changes in place
+        q_table[first][5] = 42.0
+        table.close()
+
+        q_table.update(extra)
+        table = QTableFileClass(path)
+        assert len(table) == len(q_table)
+        for state, values in q_table.items():
+            assert np.allclose(table[state], values.astype(np.float32))
+        assert 12345 not in table
+        states = np.array(list(q_table)[:500] + [12345], dtype=np.uint64)
+        rows = table.findRows(states)
+        assert rows[-1] == -1 and all(np.array_equal(table.values[row], table[int(state)]) for state, row in zip(states[:-1], rows[:-1]))
+        print("QTableFileClass ok,", len(table), "states")
+#end testQTableFileClass
+
+if __name__ == "__main__":
+    #testQTableFileClass()
+    pass
+# End if __name__ == "__main__":
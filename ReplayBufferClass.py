@@ -0,0 +1,148 @@
+# ReplayBufferClass.py
+# Laurence Smith
+
+# Fixed size experience replay for Q-learning, so each move played can be learnt from more than once.
+# Transitions (state key, action, reward, next state key, terminated) go into numpy arrays used as a ring,
+# the oldest is overwritten once it is full.
+# prioritized=True samples transitions in proportion to priority ** alpha, where the priority is how wrong
+# the Q value was last time (the TD error), and gives importance weights (size * P) ** -beta to correct for
+# it. The priorities are kept in a sum tree so sampling and updating a batch is a few numpy operations on
+# each level of the tree rather than a loop over the transitions.
+# OpenAiGymSolitaireClass.train_replay fills one of these and learns from it with update_q_batch.
+
+import numpy as np
+
+class ReplayBufferClass():
+    """ ring buffer of transitions with uniform or prioritized sampling """
+    def __init__(self, capacity=100000, prioritized=False, alpha=0.6, beta=0.4, epsilon=1e-3, seed=None) -> None:
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha # how much priorities count, 0 is uniform
+        self.beta = beta # how much the importance weights correct for the priorities, 1 is fully
+        self.epsilon = epsilon # added to every priority so nothing is never sampled
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros(capacity, dtype=np.uint64)
+        self.actions = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros(capacity, dtype=np.uint64)
+        self.terminated = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.next = 0 # where the next transition goes
+
+        if prioritized:
+            self.leaves = 1 # sum tree, node i has children 2i and 2i+1, leaves start at self.leaves
+            while self.leaves < capacity:
+                self.leaves *= 2
+            self.tree = np.zeros(2 * self.leaves)
+            self.max_priority = 1.0
+    #end __init__
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, terminated):
+        """ store one transition, new ones get the biggest priority so far so they are sampled at least once """
+        i = self.next
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.terminated[i] = terminated
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        if self.prioritized: # one leaf, quicker to walk up the tree than use _setPriorities
+            node = i + self.leaves
+            change = self.max_priority ** self.alpha - self.tree[node]
+            while node >= 1:
+                self.tree[node] += change
+                node //= 2
+    #end add
+
+    def _setPriorities(self, indices, values):
+        """ put values in the leaves for indices and add up the tree again above them """
+        nodes = indices + self.leaves
+        self.tree[nodes] = values
+        while nodes[0] > 1: # all the nodes are on the same level so the smallest says when the root is reached
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+    #end _setPriorities
+
+    def sample(self, batch_size):
+        """ (indices, states, actions, rewards, next_states, terminated, weights) for batch_size transitions,
+            weights are all 1 unless prioritized """
+        if self.size == 0:
+            raise ValueError("can't sample from an empty replay buffer")
+        if self.prioritized:
+            total = self.tree[1]
+            # one from each of batch_size equal slices of the total so the batch is spread out
+            u = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+            nodes = np.ones(batch_size, dtype=np.int64)
+            while nodes[0] < self.leaves:
+                left = self.tree[2 * nodes]
+                right = u >= left
+                u = np.where(right, u - left, u)
+                nodes = 2 * nodes + right
+            indices = np.minimum(nodes - self.leaves, self.size - 1) # rounding can step just past the end
+            probabilities = self.tree[indices + self.leaves] / total
+            weights = (self.size * probabilities) ** -self.beta
+            weights /= weights.max()
+        else:
+            indices = self.rng.integers(0, self.size, batch_size)
+            weights = np.ones(batch_size)
+        return (indices, self.states[indices], self.actions[indices], self.rewards[indices],
+                self.next_states[indices], self.terminated[indices], weights)
+    #end sample
+
+    def update_priorities(self, indices, errors):
+        """ new priorities from the TD errors of a sampled batch, does nothing unless prioritized """
+        if not self.prioritized:
+            return
+        priorities = np.abs(errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self._setPriorities(np.asarray(indices), priorities ** self.alpha)
+    #end update_priorities
+#end ReplayBufferClass
+
+def testReplayBufferClass():
+    """ prioritized sampling follows the priorities and the tree adds up """
+    buffer = ReplayBufferClass(capacity=1000, prioritized=True, alpha=1.0, epsilon=0.0, seed=0)
+    for i in range(1500): # goes round the ring
+        buffer.add(i, i % 548, 1.0, i + 1, False)
+    assert len(buffer) == 1000 and buffer.states[0] == 1000
+    errors = np.zeros(1000)
+    errors[7] = 10.0
+    errors[500] = 30.0
+    buffer.update_priorities(np.arange(1000), errors)
+    assert np.isclose(buffer.tree[1], 40.0)
+    indices = buffer.sample(4000)[0]
+    share = np.mean(indices == 500)
+    assert set(np.unique(indices)) == {7, 500} and 0.7 < share < 0.8, share
+
+    uniform = ReplayBufferClass(capacity=100, seed=0)
+    for i in range(50):
+        uniform.add(i, 0, 0.0, i, True)
+    assert uniform.sample(200)[0].max() < 50
+
+    # batched updates into a QTableFileClass (numpy) give the same values as into a dict (row by row)
+    import os
+    import tempfile
+    from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+    from QTableFileClass import QTableFileClass
+    rng = np.random.default_rng(0)
+    dense = OpenAiGymSolitaireClass()
+    mapped = OpenAiGymSolitaireClass()
+    with tempfile.TemporaryDirectory() as folder:
+        mapped.q_table = QTableFileClass(os.path.join(folder, "test.qtable"), "w")
+        states = rng.integers(0, 2**63, 50, dtype=np.uint64)
+        for update in range(200): # few states so batches repeat (state, action) pairs
+            batch = (states[rng.integers(0, 50, 64)], rng.integers(0, 548, 64), rng.random(64), states[rng.integers(0, 50, 64)], rng.random(64) < 0.2, rng.random(64))
+            assert np.allclose(dense.update_q_batch(*batch), mapped.update_q_batch(*batch), atol=1e-3)
+        assert all(np.allclose(dense.q_table[state], mapped.q_table[state], atol=1e-3) for state in dense.q_table)
+    print("ReplayBufferClass ok")
+#end testReplayBufferClass
+
+if __name__ == "__main__":
+    #testReplayBufferClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,236 @@
+# SolverClass.py
+# Laurence Smith
+
+# Works out whether a deal can be won, and if so how, by searching every line of play.
+# First a quick search that leaves out moves that are hardly ever needed (foundation to tableau, and moving
+# part of a run unless it lets the card underneath go to the foundation), which finds most wins fast. If
+# that runs out of moves without a win the full search is done with what is left of the budgets.
+# Both are depth first search on a CompactPositionClass using push/pop so no positions are copied, with
+#   - a transposition table of zobrist hashes so no position is searched twice
+#   - the stock is never searched a turn at a time, each card the waste can show in a pass through the stock
+#     is tried as a line of stock turns followed by playing it, so a whole pass is one node and going round and
+#     round the stock can't happen (nothing else changes while the stock turns, so no win is lost)
+#   - safe moves played straight away without trying anything else, a card going to the foundation when
+#     nothing of the other colour could still need to go on it
+#   - foundation moves tried first, then moves that turn over or empty a tableau pile
+#   - node and time budgets, if either runs out the answer is UNKNOWN
+# UNSOLVABLE is only given when every position has been searched, none of the pruning above ever
+# cuts off a win.
+
+import time
+from collections import namedtuple
+
+from CompactPositionClass import CompactPositionClass, ROW_LEN, STOCK, WASTE, TABLEAU, CARD_VALUE, CARD_RED
+
+SOLVABLE = "solvable"
+UNSOLVABLE = "unsolvable"
+UNKNOWN = "unknown"
+
+# status is one of the above, moves is the list of moveByNumber codes that wins (empty unless SOLVABLE)
+SolveResult = namedtuple("SolveResult", ["status", "moves", "nodes", "seconds"])
+
+class SolverClass():
+    """ searches for a winning line of play from a position """
+    def __init__(self, max_nodes=200000, max_seconds=None) -> None:
+        self.max_nodes = max_nodes # positions to look at before giving up, None for no limit
+        self.max_seconds = max_seconds # time to spend before giving up, None for no limit
+    #end __init__
+
+    def _isSafe(self, pos, card):
+        """ a card can go to the foundation with no chance of being wanted back on the tableau if it's an A or 2
+            or both foundations of the other colour have reached one below it """
+        value = CARD_VALUE[card]
+        if value <= 2:
+            return True
+        lengths = pos.lengths
+        if CARD_RED[card]:
+            return lengths[0] >= value - 1 and lengths[3] >= value - 1
+        return lengths[1] >= value - 1 and lengths[2] >= value - 1
+    #end _isSafe
+
+    def _orderedMoves(self, pos, quick):
+        """ lines of play to try from pos, tuples of moveByNumber codes most promising first, or just a safe move if there is one
+            turning the stock is never a line on its own, the waste card after each number of turns up to a whole pass is
+            tried with the turns in front of it, so a pass through the stock is one node and not one for every turn
+            the moves are worked out here rather than with legalMoves, every card that could go on a tableau pile is
+            found with one lookup of its value and colour
+            quick=True leaves out the moves the quick search doesn't try """
+        cards = pos.cards
+        lengths = pos.lengths
+        faceDown = pos.faceDown
+        scored = []
+        wanted = {} # (value, red) of a card that can go on a tableau pile -> the piles
+        empty = []
+        for t in range(7):
+            length = lengths[TABLEAU + t]
+            if length:
+                top = cards[(TABLEAU + t) * ROW_LEN + length - 1]
+                if pos._canAddToFoundation(top):
+                    if self._isSafe(pos, top):
+                        return [(10 + t,)]
+                    scored.append((0, 0, (10 + t,)))
+                wanted.setdefault((CARD_VALUE[top] - 1, not CARD_RED[top]), []).append(t)
+            else:
+                empty.append(t)
+
+        for i in range(7):
+            src = TABLEAU + i
+            length = lengths[src]
+            down = faceDown[src]
+            for k in range(down, length): # every face up card with what is on top of it
+                card = cards[src * ROW_LEN + k]
+                targets = empty if CARD_VALUE[card] == 13 else wanted.get((CARD_VALUE[card], CARD_RED[card]))
+                if not targets:
+                    continue
+                if k == 0 and targets is empty:
+                    continue # moving a whole pile to an empty pile changes nothing
+                if k > 0 and k == down:
+                    score = 2 # turns a card over
+                elif k == 0:
+                    score = 3 # empties a pile
+                elif quick and not pos._canAddToFoundation(cards[src * ROW_LEN + k - 1]):
+                    self._leftOut = True
+                    continue
+                else:
+                    score = 6
+                for j in targets:
+                    scored.append((score, 0, (10000 + 1000 * i + 100 * j + length - k,)))
+
+        for f in range(4): # foundation to tableau
+            if lengths[f]:
+                card = cards[f * ROW_LEN + lengths[f] - 1]
+                targets = empty if CARD_VALUE[card] == 13 else wanted.get((CARD_VALUE[card], CARD_RED[card]), ())
+                if targets and quick:
+                    self._leftOut = True
+                    continue
+                for t in targets:
+                    scored.append((7, 0, (100 + 10 * f + t,)))
+
+        # the waste card after 0, 1, 2, ... turns of the stock until it comes back round, nothing else changes while
+        # the stock is turned so any winning line can have its turns moved to just before the waste card is played
+        for turns, card in self._wasteCards(pos):
+            if pos._canAddToFoundation(card):
+                if not turns and self._isSafe(pos, card):
+                    return [(2,)]
+                scored.append((1, turns, (1,) * turns + (2,)))
+            for t in (empty if CARD_VALUE[card] == 13 else wanted.get((CARD_VALUE[card], CARD_RED[card]), ())):
+                scored.append((4, turns, (1,) * turns + (20 + t,)))
+        scored.sort()
+        return [line for score, turns, line in scored]
+    #end _orderedMoves
+
+    def _wasteCards(self, pos):
+        """ (turns of the stock, waste card it shows) for each turn in one pass round the stock, kept for each stock and waste
+            as it only changes when a waste card is played """
+        stockStart = STOCK * ROW_LEN
+        wasteStart = WASTE * ROW_LEN
+        key = (bytes(pos.cards[stockStart:stockStart + pos.lengths[STOCK]]), bytes(pos.cards[wasteStart:wasteStart + pos.lengths[WASTE]]))
+        shown = self._wasteCache.get(key)
+        if shown is None:
+            stock = list(key[0]) # top card last, same as the position
+            waste = list(key[1])
+            shown = []
+            seen = set()
+            turns = 0
+            while len(waste) not in seen and (stock or waste): # the stock comes back round to the same split
+                seen.add(len(waste))
+                if waste:
+                    shown.append((turns, waste[-1]))
+                if stock: # turn up to 3 over one at a time
+                    for i in range(min(3, len(stock))):
+                        waste.append(stock.pop())
+                else: # turn the waste back over
+                    stock = waste[::-1]
+                    waste = []
+                turns += 1
+            self._wasteCache[key] = shown
+        return shown
+    #end _wasteCards
+
+    def solve(self, position):
+        """ returns a SolveResult for position, which can be a PositionClass or CompactPositionClass and is left unchanged """
+        if isinstance(position, CompactPositionClass):
+            pos = position.copy()
+        else:
+            pos = CompactPositionClass.fromPosition(position)
+        start = time.perf_counter()
+
+        if pos.isWon():
+            return SolveResult(SOLVABLE, [], 0, time.perf_counter() - start)
+
+        self._leftOut = False
+        self._wasteCache = {}
+        status, moves, nodes = self._search(pos, start, 0, quick=True)
+        if status == UNSOLVABLE and self._leftOut: # quick search didn't look at everything
+            status, moves, nodes = self._search(pos, start, nodes, quick=False)
+        return SolveResult(status, moves, nodes, time.perf_counter() - start)
+    #end solve
+
+    def _search(self, pos, start, nodes, quick):
+        """ depth first search from pos, returns status, winning moves and nodes used so far """
+        visited = {pos.zobrist}
+        path = [] # the line of play that got to each position on the stack
+        stack = [iter(self._orderedMoves(pos, quick))]
+        while stack:
+            line = next(stack[-1], None)
+            if line is None: # tried everything from here
+                stack.pop()
+                if path:
+                    for move in path.pop():
+                        pos.pop()
+                continue
+
+            for move in line:
+                pos.push(move)
+            if pos.zobrist in visited:
+                for move in line:
+                    pos.pop()
+                continue
+            visited.add(pos.zobrist)
+            path.append(line)
+            nodes += 1
+
+            if pos.isWon():
+                return SOLVABLE, [move for line in path for move in line], nodes
+            if self.max_nodes is not None and nodes >= self.max_nodes:
+                break
+            if self.max_seconds is not None and nodes % 1024 == 0 and time.perf_counter() - start > self.max_seconds:
+                break
+            stack.append(iter(self._orderedMoves(pos, quick)))
+        else:
+            return UNSOLVABLE, [], nodes
+        # out of budget, take back the moves so pos is where it started
+        while path:
+            for move in path.pop():
+                pos.pop()
+        return UNKNOWN, [], nodes
+    #end _search
+#end SolverClass
+
+def solve(position, max_nodes=200000, max_seconds=None):
+    """ shortcut for SolverClass(max_nodes, max_seconds).solve(position) """
+    return SolverClass(max_nodes, max_seconds).solve(position)
+
+def testSolverClass(numDeals=20):
+    """ solve some random deals and check every winning line really does win when replayed on a PositionClass """
+    import random
+    import PositionClass
+    counts = {SOLVABLE: 0, UNSOLVABLE: 0, UNKNOWN: 0}
+    for deal in range(numDeals):
+        random.seed(deal)
+        position = PositionClass.PositionClass()
+        position.setUp()
+        result = solve(position, max_nodes=100000)
+        counts[result.status] += 1
+        if result.status == SOLVABLE:
+            for move in result.moves:
+                assert position.moveByNumber(move), "solver move not legal"
+            assert position.isWon(), "solver line doesn't win"
+        print("deal", deal, result.status, len(result.moves), "moves", result.nodes, "nodes", round(result.seconds, 3), "s")
+    print(counts)
+#end testSolverClass
+
+if __name__ == "__main__":
+    #testSolverClass()
+    pass
+# End if __name__ == "__main__":
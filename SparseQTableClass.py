@@ -0,0 +1,269 @@
+# SparseQTableClass.py
+# Laurence Smith
+
+# Q-table that only keeps the values of actions that have actually been set, instead of a 548 wide float64
+# row (4.4KB) for every state. Only a handful of moves are legal in any position so most rows end up with
+# a few entries.
+#   - every other action reads as default (0 like the dict's np.zeros rows unless told otherwise)
+#   - values can be kept as float32 or float16 to save more
+#   - max_states caps how many states are kept, when full the least recently used state ("lru") or the
+#     least visited of a few picked at random ("visits") is thrown away, never one of the states in pinned
+#     (OpenAiGymSolitaireClass pins the states an update is using so they can't go while it is using them)
+# Use it in place of the dict, env.q_table = SparseQTableClass(), rows support what OpenAiGymSolitaireClass
+# does with them: row[action], row[list of actions], setting them, row.max(), row.argmax() and np.asarray(row).
+
+import random
+from collections import OrderedDict
+
+import numpy as np
+
+EVICTION_SAMPLE = 8 # states looked at to find the least visited one to throw away
+
+class SparseQRowClass():
+    """ Q values for one state, sorted actions that have been set and their values, everything else is default """
+    __slots__ = ("actions", "values", "default", "size")
+
+    def __init__(self, size, default=0.0, dtype=np.float32) -> None:
+        self.actions = np.zeros(0, dtype=np.int16)
+        self.values = np.zeros(0, dtype=dtype)
+        self.default = default
+        self.size = size # number of actions there are, like len of a dense row
+    #end __init__
+
+    @classmethod
+    def fromDense(cls, dense, default=0.0, dtype=np.float32):
+        """ row holding the entries of dense that aren't default """
+        row = cls(len(dense), default, dtype)
+        dense = np.asarray(dense)
+        row.actions = np.flatnonzero(dense != default).astype(np.int16)
+        row.values = dense[row.actions].astype(dtype)
+        return row
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, action):
+        if np.ndim(action) == 0:
+            i = np.searchsorted(self.actions, action)
+            if i < len(self.actions) and self.actions[i] == action:
+                return self.values[i]
+            return self.default
+        action = np.asarray(action)
+        result = np.full(action.shape, self.default, dtype=self.values.dtype)
+        if len(self.actions):
+            i = np.minimum(np.searchsorted(self.actions, action), len(self.actions) - 1)
+            found = self.actions[i] == action
+            result[found] = self.values[i[found]]
+        return result
+    #end __getitem__
+
+    def __setitem__(self, action, value):
+        if np.ndim(action) != 0:
+            for a, v in zip(np.asarray(action), np.broadcast_to(value, np.shape(action))):
+                self[a] = v
+            return
+        i = np.searchsorted(self.actions, action)
+        if i < len(self.actions) and self.actions[i] == action:
+            self.values[i] = value
+        else:
+            self.actions = np.insert(self.actions, i, action)
+            self.values = np.insert(self.values, i, value)
+    #end __setitem__
+
+    def max(self):
+        """ same as np.max of the dense row """
+        if len(self.actions) == 0:
+            return self.default
+        best = self.values.max()
+        if len(self.actions) < self.size and self.default > best:
+            return self.default
+        return best
+
+    def argmax(self):
+        """ same as np.argmax of the dense row, the lowest action with the biggest value """
+        if len(self.actions) == 0:
+            return 0
+        best = self.values.max()
+        stored = int(self.actions[np.argmax(self.values)])
+        if len(self.actions) == self.size or best > self.default:
+            return stored
+        # lowest action that isn't stored has the default value
+        missing = np.flatnonzero(self.actions != np.arange(len(self.actions)))
+        unset = int(missing[0]) if len(missing) else len(self.actions)
+        if self.default > best:
+            return unset
+        return min(stored, unset)
+    #end argmax
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.full(self.size, self.default, dtype=dtype or np.float64)
+        dense[self.actions] = self.values
+        return dense
+
+    def nbytes(self):
+        return self.actions.nbytes + self.values.nbytes
+#end SparseQRowClass
+
+class SparseQTableClass():
+    """ dict like Q-table of SparseQRowClass rows with an optional cap on the number of states """
+    def __init__(self, actions=548, dtype=np.float32, default=0.0, max_states=None, eviction="lru") -> None:
+        if eviction not in ("lru", "visits"):
+            raise ValueError(f"eviction must be 'lru' or 'visits' not {eviction!r}")
+        self.actions = actions
+        self.dtype = np.dtype(dtype)
+        self.default = default
+        self.max_states = max_states # None for no limit
+        self.eviction = eviction
+        self.rows = OrderedDict() if eviction == "lru" else {}
+        self.visits = {} # state -> times looked up, only for eviction="visits"
+        self._states = [] # the states in a list so one can be picked at random, with where each is, only for eviction="visits"
+        self._position = {}
+        self._random = random.Random(0) # own random numbers so the deals aren't changed
+        self.pinned = set() # states that mustn't be evicted right now
+        self.evicted = 0
+    #end __init__
+
+    def _touch(self, state):
+        if self.max_states is None:
+            return
+        if self.eviction == "lru":
+            self.rows.move_to_end(state)
+        else:
+            self.visits[state] += 1
+
+    def _evict(self):
+        """ throw away one state that isn't pinned to make room, returns False if they are all pinned """
+        pinned = self.pinned
+        if self.eviction == "lru":
+            state = next((state for state in self.rows if state not in pinned), None) # oldest first
+        else:
+            sample = [self._states[self._random.randrange(len(self._states))] for i in range(EVICTION_SAMPLE)]
+            sample = [state for state in sample if state not in pinned]
+            if sample:
+                state = min(sample, key=self.visits.__getitem__)
+            else:
+                state = next((state for state in self._states if state not in pinned), None)
+        if state is None:
+            return False
+        self._forget(state)
+        self.evicted += 1
+        return True
+    #end _evict
+
+    def pin(self, states):
+        """ keep states from being evicted until unpin """
+        self.pinned.update(states)
+
+    def unpin(self):
+        """ let the pinned states go again, evicting any that took the table over max_states """
+        self.pinned.clear()
+        if self.max_states is not None:
+            while len(self.rows) > self.max_states and self._evict():
+                pass
+
+    def _forget(self, state):
+        del self.rows[state]
+        if self.eviction == "visits":
+            del self.visits[state]
+            i = self._position.pop(state)
+            last = self._states.pop()
+            if last != state: # move the last state into the gap
+                self._states[i] = last
+                self._position[last] = i
+    #end _forget
+
+    def __contains__(self, state):
+        return state in self.rows
+
+    def __getitem__(self, state):
+        row = self.rows[state]
+        self._touch(state)
+        return row
+
+    def get(self, state, default=None):
+        row = self.rows.get(state)
+        if row is None:
+            return default
+        self._touch(state)
+        return row
+
+    def __setitem__(self, state, values):
+        if isinstance(values, SparseQRowClass):
+            row = values
+        else:
+            row = SparseQRowClass.fromDense(values, self.default, self.dtype)
+        if state in self.rows:
+            self.rows[state] = row
+            self._touch(state)
+            return
+        if self.max_states is not None:
+            # more than one can go if pinned states took it over the cap
+            while len(self.rows) >= self.max_states and self._evict():
+                pass
+        self.rows[state] = row
+        if self.eviction == "visits":
+            self.visits[state] = 0
+            self._position[state] = len(self._states)
+            self._states.append(state)
+    #end __setitem__
+
+    def __delitem__(self, state):
+        self._forget(state)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def keys(self):
+        return self.rows.keys()
+
+    def items(self):
+        return self.rows.items()
+
+    def nbytes(self):
+        """ bytes used by the values and actions of every row (not the python objects around them) """
+        return sum(row.nbytes() for row in self.rows.values())
+#end SparseQTableClass
+
+def testSparseQTableClass():
+    """ sparse rows give the same answers as dense ones, and the cap holds """
+    rng = np.random.default_rng(0)
+    for trial in range(2000):
+        dense = np.zeros(548)
+        actions = rng.integers(0, 548, rng.integers(0, 6))
+        dense[actions] = rng.choice([-1.0, 0.0, 0.5, 2.0], len(actions))
+        row = SparseQRowClass.fromDense(dense, dtype=np.float64)
+        assert row.max() == dense.max() and row.argmax() == dense.argmax(), (dense[actions], actions)
+        legal = rng.integers(0, 548, 5)
+        assert np.array_equal(row[legal], dense[legal])
+        assert np.array_equal(np.asarray(row), dense)
+        row[legal] = row[legal] + 1.0
+        dense[legal] = dense[legal] + 1.0
+        assert np.array_equal(np.asarray(row), dense)
+
+    for eviction in ("lru", "visits"):
+        table = SparseQTableClass(max_states=100, eviction=eviction)
+        for state in range(1000):
+            table[state] = np.zeros(548)
+            table[state][state % 548] = 1.0
+        assert len(table) == 100 and table.evicted == 900
+
+    # training with a cap smaller than a minibatch, the states being updated must stay put
+    from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+    from ReplayBufferClass import ReplayBufferClass
+    for eviction in ("lru", "visits"):
+        env = OpenAiGymSolitaireClass(q_table=SparseQTableClass(548, max_states=50, eviction=eviction), max_episode_steps=100)
+        env.train(50, legal_only=True)
+        env.train_replay(5, ReplayBufferClass(1000), batch_size=64, warmup=100, legal_only=True)
+        assert len(env.q_table) == 50 and not env.q_table.pinned
+        env.train_parallel(40, num_workers=2, sync_every=10, legal_only=True)
+        assert len(env.q_table) == 50
+    print("SparseQTableClass ok")
+#end testSparseQTableClass
+
+if __name__ == "__main__":
+    #testSparseQTableClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,142 @@
+# SymmetryClass.py
+# Laurence Smith
+
+# Positions that only differ by swapping the two red suits, swapping the two black suits or putting the
+# tableau piles in a different order play exactly the same, so they can share one entry in the Q-table.
+# canonicalise picks one of them to stand for them all:
+#   - try each of the 4 suit swaps (none, red, black, both), a swap changes the cards and which
+#     foundation pile is which
+#   - sort the 7 tableau piles into order by their cards
+#   - keep the one with the smallest bytes
+# and returns a 64 bit key for it, the same for every position that plays the same, along with the
+# transform (suit swap and where each tableau pile went) so actions can be turned into the matching
+# action in the canonical position and back.
+# OpenAiGymSolitaireClass(symmetry=True) uses this for get_state, with the Q-table rows indexed by
+# canonical actions.
+
+import hashlib
+
+import numpy as np
+
+from CardTables import MOVE_ENUMERATION
+
+NUM_TABLEAU = 7
+# suit swaps, SUIT_MAPS[k][suit] is the suit it becomes, each is its own inverse
+SUIT_MAPS = np.array([[0, 1, 2, 3], [0, 2, 1, 3], [3, 1, 2, 0], [3, 2, 1, 0]])
+SUIT_MAPS_LIST = SUIT_MAPS.tolist()
+
+# CARD_MAPS[k][value + 2] is what an observation value (-2 empty, -1 face down, 0-51 card) becomes under suit swap k
+CARD_MAPS = np.array([[-2, -1] + [int(m[card // 13]) * 13 + card % 13 for card in range(52)] for m in SUIT_MAPS], dtype=np.int8)
+
+class SymmetryClass():
+    """ maps observations to a canonical key and actions to and from the canonical position """
+    def __init__(self, move_enumeration=MOVE_ENUMERATION) -> None:
+        self.moves = [int(move) for move in move_enumeration] # move code for each action
+        self.code_to_action = {move: action for action, move in enumerate(self.moves)}
+    #end __init__
+
+    def canonicalise(self, observation):
+        """ (key, transform) for a 13x24 observation, transform is (suit swap, tableau pile map) where
+            tableau pile t of the observation is pile tableau_map[t] of the canonical position """
+        maps = CARD_MAPS[:, np.asarray(observation) + 2] # every suit swap at once
+        best = None
+        for k in range(4):
+            mapped = maps[k]
+            piles = [mapped[row].tobytes() for row in range(6, 13)]
+            order = sorted(range(NUM_TABLEAU), key=piles.__getitem__) # canonical pile c is pile order[c]
+            candidate = mapped[SUIT_MAPS[k]].tobytes() + mapped[4:6].tobytes() + b"".join([piles[t] for t in order])
+            if best is None or candidate < best:
+                best = candidate
+                transform = (k, order)
+        k, order = transform
+        tableau_map = [0] * NUM_TABLEAU
+        for c, t in enumerate(order):
+            tableau_map[t] = c
+        key = int.from_bytes(hashlib.blake2b(best, digest_size=8).digest(), "little")
+        return key, (k, tableau_map)
+    #end canonicalise
+
+    def _mapAction(self, action, suit_map, tableau_map):
+        """ action with foundations renamed by suit_map and tableau piles by tableau_map """
+        code = self.moves[action]
+        if code <= 2:
+            return action
+        elif code < 100: # 1t tableau to foundation or 2t waste to tableau
+            code = code - code % 10 + tableau_map[code % 10]
+        elif code < 10000: # 1ft foundation to tableau
+            code = 100 + 10 * suit_map[(code // 10) % 10] + tableau_map[code % 10]
+        else: # 1ijkk tableau to tableau
+            code = 10000 + 1000 * tableau_map[(code // 1000) % 10] + 100 * tableau_map[(code // 100) % 10] + code % 100
+        return self.code_to_action[code]
+    #end _mapAction
+
+    def to_canonical(self, actions, transform):
+        """ actions in the observed position -> the same actions in the canonical position, an int or a list """
+        k, tableau_map = transform
+        suit_map = SUIT_MAPS_LIST[k]
+        if np.ndim(actions) == 0:
+            return self._mapAction(int(actions), suit_map, tableau_map)
+        return [self._mapAction(int(action), suit_map, tableau_map) for action in actions]
+
+    def from_canonical(self, actions, transform):
+        """ actions in the canonical position -> the same actions in the observed position, an int or a list """
+        k, tableau_map = transform
+        suit_map = SUIT_MAPS_LIST[k] # suit swaps are their own inverse
+        inverse = [0] * NUM_TABLEAU
+        for t, c in enumerate(tableau_map):
+            inverse[c] = t
+        if np.ndim(actions) == 0:
+            return self._mapAction(int(actions), suit_map, inverse)
+        return [self._mapAction(int(action), suit_map, inverse) for action in actions]
+#end SymmetryClass
+
+def _transformed(position, k, tableau_order):
+    """ copy of a CompactPositionClass with suit swap k and tableau pile c being pile tableau_order[c] of position """
+    from CompactPositionClass import CompactPositionClass, ROW_LEN, TABLEAU
+    other = CompactPositionClass()
+    for row in range(13):
+        if row < 4:
+            src = SUIT_MAPS[k][row]
+        elif row < TABLEAU:
+            src = row
+        else:
+            src = TABLEAU + tableau_order[row - TABLEAU]
+        cards = [int(CARD_MAPS[k][card + 2]) for card in position.pileCards(src)]
+        other.cards[row * ROW_LEN:row * ROW_LEN + len(cards)] = bytes(cards)
+        other.lengths[row] = len(cards)
+        other.faceDown[row] = position.faceDown[src]
+    return other
+
+def testSymmetryClass(numGames=50, movesPerGame=100):
+    """ every symmetric copy of a position gets the same key, and the legal moves map onto each other """
+    import random
+    from CompactPositionClass import CompactPositionClass
+    symmetry = SymmetryClass()
+    move_to_action = {int(m): a for a, m in enumerate(symmetry.moves)}
+    random.seed(0)
+    for game in range(numGames):
+        pos = CompactPositionClass()
+        pos.setUp()
+        for step in range(movesPerGame):
+            key, transform = symmetry.canonicalise(pos.toObservation())
+            legal = np.array(sorted(move_to_action[m] for m in pos.legalMoves()), dtype=np.int64)
+            canonical = symmetry.to_canonical(legal, transform)
+            assert symmetry.from_canonical(canonical, transform) == list(legal)
+
+            other = _transformed(pos, random.randrange(4), random.sample(range(7), 7))
+            otherKey, otherTransform = symmetry.canonicalise(other.toObservation())
+            assert otherKey == key
+            otherLegal = np.array([move_to_action[m] for m in other.legalMoves()], dtype=np.int64)
+            assert sorted(symmetry.to_canonical(otherLegal, otherTransform)) == sorted(canonical)
+
+            moves = pos.legalMoves()
+            if not moves:
+                break
+            pos.moveByNumber(random.choice(moves))
+    print("SymmetryClass ok")
+#end testSymmetryClass
+
+if __name__ == "__main__":
+    #testSymmetryClass()
+    pass
+# End if __name__ == "__main__":
@@ -1,22 +1,41 @@
-from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass, default_reward
+from QTableFileClass import QTableFileClass
+from TournamentClass import meanInterval
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+def play_game(env, seed=None, legal_only=False):
+    ''' plays one game with the greedy actions from env's q_table (or epsilon-greedy if env.epsilon isn't 0), returns the final reward
+        seed is the deal, legal_only=True only picks legal moves, otherwise the game ends at the first illegal move like in training
+        returns the final reward and whether the game was won (the env's won flag was set at some step) '''
+    env.reset(seed)
+    state = env.get_state()
+    game_reward = 0
+    won = False
+    done = False
+
+    while not done:
+        action = env.get_action(state, env.legal_actions() if legal_only else None)
+        observation, reward, terminated, truncated, info = env.step(action)
+        next_state = env.get_state()
+        game_reward = reward
+        won = won or info["won"]
+
+        state = next_state
+        done = terminated or truncated
+    return game_reward, won
+#end play_game
 
 def test_model(env, num_games=100):
     total_rewards = 0
     max_reward = -1000
     for game in range(num_games):
-        state = env.reset()
-        state = env.get_state()
-        game_reward = 0
-        done = False
-
-        while not done:
-            action = env.get_action(state)
-            observation, reward, terminated, truncated, _ = env.step(action)
-            next_state = env.get_state()
-            game_reward = reward
-
-            state = next_state
-            done = terminated or truncated
+        game_reward, won = play_game(env)
 
         total_rewards += game_reward
         max_reward = max(max_reward, game_reward)
@@ -27,12 +46,151 @@ def test_model(env, num_games=100):
     print(f"Average Reward: {average_reward}")
     print(f"Max Reward: {max_reward}")
 
-if __name__ == "__main__":
-    # Create environment and load the trained model
-    env = OpenAiGymSolitaireClass(verbose=True)
-    env.load_model("solitaire_model.pkl")
+_evalEnv = None # the environment in an evaluate_model worker
+
+def _evalStart(filename, settings):
+    ''' opens the model in a worker, a .qtable is memory mapped read only so all the workers share the one copy in the page cache '''
+    global _evalEnv
+    max_episode_steps, symmetry, epsilon, reward_shape, compact = settings
+    _evalEnv = OpenAiGymSolitaireClass(verbose=False, max_episode_steps=max_episode_steps, symmetry=symmetry, reward_shape=reward_shape, compact=compact)
+    if filename.endswith(".qtable"):
+        _evalEnv.q_table = QTableFileClass(filename, "r")
+    else:
+        _evalEnv.load_model(filename)
+    _evalEnv.epsilon = epsilon
 
-    # Test the loaded model
-    test_model(env)
+def _evalChunk(args):
+    seeds, legal_only = args
+    results = []
+    for seed in seeds:
+        if _evalEnv.epsilon > 0:
+            np.random.seed(seed) # same exploring moves every run however the games are split up
+            _evalEnv.action_space.seed(seed)
+        results.append(play_game(_evalEnv, seed, legal_only))
+    return results
+
+def evaluate_model(model, max_games=10000, first_seed=0, workers=None, chunk_size=50, tolerance=10.0, min_games=500,
+                   legal_only=False, max_episode_steps=1000, symmetry=False, epsilon=0.0, reward_shape=default_reward, compact=True, verbose=True):
+    ''' mean reward of a model over the deals first_seed, first_seed + 1, ... played in worker processes
+        model is a saved model filename or an OpenAiGymSolitaireClass (its q_table is saved to a temporary .qtable to share,
+        and its max_episode_steps, symmetry, reward_shape and compact are used instead of the arguments so it is scored the way it was trained)
+        stops early once at least min_games are played and the 95% confidence interval on the mean is within +-tolerance
+        games are always the first n seeds so two models evaluated from the same first_seed can be compared game for game
+        returns a dict with the mean, its interval, the rewards in seed order and whether it stopped early '''
+    start = time.perf_counter()
+    temporary = None
+    if isinstance(model, OpenAiGymSolitaireClass):
+        if isinstance(model.q_table, QTableFileClass):
+            model.q_table.flush()
+            filename = model.q_table.path
+        else:
+            temporary = tempfile.TemporaryDirectory()
+            filename = os.path.join(temporary.name, "model.qtable")
+            table = QTableFileClass(filename, "w", model.action_space.n)
+            table.update(model.q_table)
+            table.close()
+        max_episode_steps = model.max_episode_steps
+        symmetry = model.symmetry is not None
+        reward_shape = model.reward_shape
+        compact = model.compact
+    else:
+        filename = model
+    settings = (max_episode_steps, symmetry, epsilon, reward_shape, compact)
+    workers = workers or os.cpu_count()
+    tasks = [(list(range(seed, min(seed + chunk_size, first_seed + max_games))), legal_only)
+             for seed in range(first_seed, first_seed + max_games, chunk_size)]
+
+    rewards = []
+    wins = 0
+    total = 0.0
+    squares = 0.0
+    stopped_early = False
+    pool = None
+    try:
+        if workers == 1:
+            _evalStart(filename, settings)
+            chunks = map(_evalChunk, tasks)
+        else:
+            pool = multiprocessing.Pool(workers, _evalStart, (filename, settings))
+            chunks = pool.imap(_evalChunk, tasks) # in seed order, workers run ahead on the chunks after
+        for chunk in chunks:
+            chunk_rewards = [reward for reward, won in chunk]
+            rewards.extend(chunk_rewards)
+            wins += sum(won for reward, won in chunk)
+            total += sum(chunk_rewards)
+            squares += sum(reward * reward for reward in chunk_rewards)
+            mean, low, high = meanInterval(len(rewards), total, squares)
+            if len(rewards) >= min_games and (high - low) / 2 <= tolerance:
+                stopped_early = len(rewards) < max_games
+                break
+    finally:
+        if pool is not None:
+            pool.terminate() # throws away chunks still being played after an early stop
+            pool.join()
+        if temporary is not None:
+            temporary.cleanup()
+
+    mean, low, high = meanInterval(len(rewards), total, squares)
+    result = {
+        "games": len(rewards),
+        "mean_reward": mean,
+        "mean_reward_ci": (low, high),
+        "max_reward": max(rewards),
+        "wins": wins,
+        "rewards": np.array(rewards),
+        "first_seed": first_seed,
+        "stopped_early": stopped_early,
+        "seconds": time.perf_counter() - start,
+    }
+    if verbose:
+        print(f"Tested {result['games']} games in {result['seconds']:.1f}s{' (stopped early)' if stopped_early else ''}.")
+        print(f"Average Reward: {mean:.2f} (95% CI {low:.2f} to {high:.2f})")
+        print(f"Max Reward: {result['max_reward']}")
+    return result
+#end evaluate_model
+
+def compare_models(result_a, result_b):
+    ''' (mean, low, high) of the reward difference a - b over the games both evaluate_model results played, paired game by game '''
+    if result_a["first_seed"] != result_b["first_seed"]:
+        raise ValueError("models were evaluated on different deals")
+    n = min(result_a["games"], result_b["games"])
+    differences = result_a["rewards"][:n] - result_b["rewards"][:n]
+    return meanInterval(n, float(differences.sum()), float((differences * differences).sum()))
+#end compare_models
+
+def testEvaluateModel():
+    ''' the same answer from one worker or several, and stopping early '''
+    import random
+    random.seed(0)
+    np.random.seed(0)
+    env = OpenAiGymSolitaireClass(max_episode_steps=100)
+    env.train(num_episodes=200, legal_only=True)
+    single = evaluate_model(env, max_games=200, workers=1, tolerance=0, legal_only=True, max_episode_steps=100, epsilon=0.2)
+    pooled = evaluate_model(env, max_games=200, workers=2, chunk_size=20, tolerance=0, legal_only=True, max_episode_steps=100, epsilon=0.2)
+    assert np.array_equal(single["rewards"], pooled["rewards"]) and not pooled["stopped_early"]
+    early = evaluate_model(env, max_games=200, workers=2, chunk_size=20, tolerance=1000, min_games=40, legal_only=True, max_episode_steps=100, epsilon=0.2)
+    assert early["stopped_early"] and early["games"] == 40
+    assert compare_models(single, early) == (0, 0, 0)
+    # the model's own max_episode_steps, not the default of the argument
+    own = evaluate_model(env, max_games=40, workers=1, tolerance=0, legal_only=True, epsilon=0.2, verbose=False)
+    assert np.array_equal(own["rewards"], single["rewards"][:40])
+
+    # scored with the model's own reward shape, not default_reward
+    from OpenAiGymSolitaireClass import foundation_reward
+    shaped = OpenAiGymSolitaireClass(max_episode_steps=100, reward_shape=foundation_reward, compact=False)
+    shaped.q_table = env.q_table
+    result = evaluate_model(shaped, max_games=40, workers=2, chunk_size=20, tolerance=0, legal_only=True, max_episode_steps=100, verbose=False)
+    assert all(reward % 10 == 0 for reward in result["rewards"]) and result["wins"] <= 40
+    print("evaluate_model ok")
+#end testEvaluateModel
+
+if __name__ == "__main__":
+    #testEvaluateModel()
+    # Test the trained model, the workers share the memory mapped table read only and stop once the mean is known well enough
+    evaluate_model("solitaire_model.qtable")
 
-    env.close()
\ No newline at end of file
+    # or one game at a time in this process
+    # env = OpenAiGymSolitaireClass()
+    # env.load_model("solitaire_model.qtable") # only the rows used are read from disk
+    # test_model(env)
+    # env.close()
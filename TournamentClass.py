@@ -0,0 +1,349 @@
+# TournamentClass.py
+# Laurence Smith
+
+# Plays strategies against each other on the same deals to see which is best.
+# A strategy is anything with chooseMove(position) giving a moveByNumber code (or None to give up), see
+# StrategyClass. Every strategy plays deals first_seed, first_seed + 1, ... dealt with setUp(seed), so they
+# all get exactly the same games. A game ends when it is won, the strategy gives up, it has had max_moves
+# moves or the reward hasn't gone up for stall_moves moves (going round the stock for ever).
+# Deals are split into chunks that are played in a pool of worker processes, each result is written to
+# results_path (csv, one line per game) as soon as its chunk comes back, and the win rate and mean reward
+# (with 95% confidence intervals) are kept up to date for each strategy.
+# Games are played on CompactPositionClass by default, it deals the same cards for a seed as PositionClass
+# and is much faster, compact=False uses PositionClass.
+
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+import PositionClass
+from CompactPositionClass import CompactPositionClass, STOCK, WASTE, TABLEAU
+from CardTables import MOVE_TO_ACTION
+from OpenAiGymSolitaireClass import default_reward
+
+def wilsonInterval(successes, n, z=1.96):
+    """ (low, high) confidence interval for a proportion, Wilson score interval """
+    if n == 0:
+        return (0.0, 1.0)
+    p = successes / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return (centre - half, centre + half)
+
+def meanInterval(n, total, totalSquares, z=1.96):
+    """ (mean, low, high) for a mean from the count, sum and sum of squares, normal approximation """
+    if n == 0:
+        return (0.0, 0.0, 0.0)
+    mean = total / n
+    if n == 1:
+        return (mean, mean, mean)
+    variance = max(totalSquares - n * mean * mean, 0.0) / (n - 1)
+    half = z * math.sqrt(variance / n)
+    return (mean, mean - half, mean + half)
+
+def _pileCounts(position, row):
+    """ (cards, face down cards) in pile row of a CompactPositionClass or PositionClass """
+    if isinstance(position, CompactPositionClass):
+        return position.lengths[row], position.faceDown[row]
+    cards = position.piles[row].cards
+    return len(cards), sum(1 for card in cards if not card.visible)
+
+class StrategyClass():
+    """ base class for strategies, chooseMove gets the position (CompactPositionClass or PositionClass) and gives a
+        legal moveByNumber code, or None to stop playing """
+    name = "strategy"
+
+    def startGame(self, position, seed):
+        """ called before each game, seed is the deal's seed so any random choices are the same every run """
+        self.random = random.Random(seed)
+
+    def chooseMove(self, position):
+        raise NotImplementedError
+#end StrategyClass
+
+class RandomStrategyClass(StrategyClass):
+    """ any legal move """
+    name = "random"
+
+    def chooseMove(self, position):
+        moves = position.legalMoves()
+        return self.random.choice(moves) if moves else None
+#end RandomStrategyClass
+
+class GreedyStrategyClass(StrategyClass):
+    """ the first legal move in order of how good that kind of move usually is: to the foundation, turning over a
+        tableau card, the waste to the tableau, the stock, then any other tableau move. Never takes a card back off
+        the foundation, gives up after a whole pass through the stock with nothing else to do """
+    name = "greedy"
+
+    def startGame(self, position, seed):
+        StrategyClass.startGame(self, position, seed)
+        self.stockMoves = 0 # stock moves in a row
+
+    def _rank(self, position, move):
+        if move == 2 or move >= 10 and move <= 16:
+            return 0
+        if move >= 10000:
+            length, faceDown = _pileCounts(position, TABLEAU + (move // 1000) % 10)
+            if faceDown and length - faceDown == move % 100:
+                return 1
+            return 4
+        if move >= 20 and move <= 26:
+            return 2
+        if move == 1:
+            return 3
+        return 5 # foundation to tableau
+
+    def chooseMove(self, position):
+        moves = [move for move in position.legalMoves() if move < 100 or move >= 10000]
+        if not moves:
+            return None
+        move = min(moves, key=lambda move: self._rank(position, move))
+        self.stockMoves = self.stockMoves + 1 if move == 1 else 0
+        if self.stockMoves > (_pileCounts(position, STOCK)[0] + _pileCounts(position, WASTE)[0]) // 3 + 1:
+            return None
+        return move
+#end GreedyStrategyClass
+
+class QTableStrategyClass(StrategyClass):
+    """ the legal move with the biggest Q value in a Q-table trained by OpenAiGymSolitaireClass, a random legal move in
+        positions the table hasn't seen. q_table is the table or a .qtable path (opened read only in each process) """
+    name = "qtable"
+
+    def __init__(self, q_table, symmetry=False, name="qtable") -> None:
+        if isinstance(q_table, str):
+            from QTableFileClass import QTableFileClass
+            q_table = QTableFileClass(q_table, "r")
+        self.q_table = q_table
+        self.symmetry = None
+        if symmetry: # table made with OpenAiGymSolitaireClass(symmetry=True)
+            from SymmetryClass import SymmetryClass
+            self.symmetry = SymmetryClass()
+        self.name = name
+    #end __init__
+
+    def chooseMove(self, position):
+        moves = [move for move in position.legalMoves() if move in MOVE_TO_ACTION]
+        if not moves:
+            return None
+        if self.symmetry is not None:
+            state, transform = self.symmetry.canonicalise(position.toObservation())
+        else:
+            state = position.zobrist
+        row = self.q_table.get(state)
+        if row is None:
+            return self.random.choice(moves)
+        actions = [MOVE_TO_ACTION[move] for move in moves]
+        if self.symmetry is not None:
+            actions = self.symmetry.to_canonical(actions, transform)
+        return moves[int(np.argmax(row[actions]))]
+    #end chooseMove
+#end QTableStrategyClass
+
+class MCTSStrategyClass(StrategyClass):
+    """ MCTSClass as a strategy, slow, so only for small tournaments """
+    name = "mcts"
+
+    def __init__(self, name="mcts", **settings) -> None:
+        self.settings = settings # passed to MCTSClass
+        self.name = name
+
+    def startGame(self, position, seed):
+        from MCTSClass import MCTSClass
+        self.agent = MCTSClass(seed=seed, **self.settings) # new tree each game
+        self.history = {position.zobrist}
+        self.passed = {position.zobrist} # same as MCTSClass.play, stops it going round and round the stock
+        self.stock = True
+
+    def chooseMove(self, position):
+        move = self.agent.chooseMove(position, self.history, self.stock)
+        if move is not None:
+            position.push(move) # zobrist after the move, the tournament makes the move itself
+            self.history.add(position.zobrist)
+            if move != 1:
+                self.passed = set()
+                self.stock = True
+            elif position.zobrist in self.passed:
+                self.stock = False
+            self.passed.add(position.zobrist)
+            position.pop()
+        return move
+#end MCTSStrategyClass
+
+def playDeal(strategy, seed, compact=True, max_moves=1000, stall_moves=200, reward_shape=default_reward):
+    """ (won, reward, moves) for strategy playing the deal setUp(seed) """
+    position = CompactPositionClass() if compact else PositionClass.PositionClass()
+    position.setUp(seed)
+    strategy.startGame(position, seed)
+    reward = best = reward_shape(position.countVisibleTableauCards(), position.countFoundationCards(), False)
+    lastBest = 0
+    moves = 0
+    while moves < max_moves and moves - lastBest < stall_moves:
+        move = strategy.chooseMove(position)
+        if move is None or not position.moveByNumber(move):
+            break
+        moves += 1
+        won = position.isWon()
+        reward = reward_shape(position.countVisibleTableauCards(), position.countFoundationCards(), won)
+        if won:
+            break
+        if reward > best:
+            best = reward
+            lastBest = moves
+    return position.isWon(), reward, moves
+#end playDeal
+
+_workerStrategies = None # the strategies in a worker process
+
+def _workerStart(strategies):
+    global _workerStrategies
+    _workerStrategies = strategies
+
+def _playChunk(args):
+    """ plays one chunk of deals for one strategy in a worker """
+    strategyIndex, firstSeed, count, settings = args
+    strategy = _workerStrategies[strategyIndex]
+    results = [playDeal(strategy, seed, *settings) for seed in range(firstSeed, firstSeed + count)]
+    return strategyIndex, firstSeed, results
+
+class TournamentClass():
+    """ every strategy plays the same num_deals deals, results streamed to results_path """
+    def __init__(self, strategies, num_deals=1000, first_seed=0, workers=None, chunk_size=250, max_moves=1000, stall_moves=200,
+                 compact=True, reward_shape=default_reward, results_path="tournament_results.csv") -> None:
+        names = [strategy.name for strategy in strategies]
+        if len(set(names)) != len(names):
+            raise ValueError(f"strategy names must be different, got {names}")
+        self.strategies = strategies
+        self.num_deals = num_deals
+        self.first_seed = first_seed
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.settings = (compact, max_moves, stall_moves, reward_shape)
+        self.results_path = results_path # None to not write the games out
+        # running totals for each strategy
+        self.games = [0] * len(strategies)
+        self.wins = [0] * len(strategies)
+        self.rewardTotal = [0.0] * len(strategies)
+        self.rewardSquares = [0.0] * len(strategies)
+        self.moveTotal = [0] * len(strategies)
+        self.seconds = 0.0
+    #end __init__
+
+    def _chunks(self):
+        """ (strategy, first seed, count) tasks, each block of deals for every strategy before the next block
+            so the strategies finish at about the same time """
+        tasks = []
+        for start in range(0, self.num_deals, self.chunk_size):
+            count = min(self.chunk_size, self.num_deals - start)
+            for i in range(len(self.strategies)):
+                tasks.append((i, self.first_seed + start, count, self.settings))
+        return tasks
+
+    def _add(self, strategyIndex, firstSeed, results, out):
+        name = self.strategies[strategyIndex].name
+        lines = []
+        for offset, (won, reward, moves) in enumerate(results):
+            self.games[strategyIndex] += 1
+            self.wins[strategyIndex] += won
+            self.rewardTotal[strategyIndex] += reward
+            self.rewardSquares[strategyIndex] += reward * reward
+            self.moveTotal[strategyIndex] += moves
+            lines.append(f"{name},{firstSeed + offset},{int(won)},{reward},{moves}\n")
+        if out is not None:
+            out.write("".join(lines))
+            out.flush()
+    #end _add
+
+    def run(self, progress=True):
+        """ plays every game, returns summary() """
+        start = time.perf_counter()
+        out = None
+        if self.results_path is not None:
+            out = open(self.results_path, "w")
+            out.write("strategy,seed,won,reward,moves\n")
+        try:
+            tasks = self._chunks()
+            if self.workers == 1:
+                _workerStart(self.strategies)
+                chunks = map(_playChunk, tasks)
+                pool = None
+            else:
+                pool = multiprocessing.Pool(self.workers, _workerStart, (self.strategies,))
+                chunks = pool.imap_unordered(_playChunk, tasks)
+            for done, (strategyIndex, firstSeed, results) in enumerate(chunks):
+                self._add(strategyIndex, firstSeed, results, out)
+                if progress and (done + 1) % max(1, len(tasks) // 10) == 0:
+                    print(f"{sum(self.games)} of {self.num_deals * len(self.strategies)} games, {time.perf_counter() - start:.1f}s")
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            if out is not None:
+                out.close()
+        self.seconds = time.perf_counter() - start
+        return self.summary()
+    #end run
+
+    def summary(self):
+        """ {name: {games, wins, win_rate, win_rate_ci, mean_reward, mean_reward_ci, mean_moves}} from the games so far """
+        summary = {}
+        for i, strategy in enumerate(self.strategies):
+            n = self.games[i]
+            mean, low, high = meanInterval(n, self.rewardTotal[i], self.rewardSquares[i])
+            summary[strategy.name] = {
+                "games": n,
+                "wins": self.wins[i],
+                "win_rate": self.wins[i] / n if n else 0.0,
+                "win_rate_ci": wilsonInterval(self.wins[i], n),
+                "mean_reward": mean,
+                "mean_reward_ci": (low, high),
+                "mean_moves": self.moveTotal[i] / n if n else 0.0,
+            }
+        return summary
+    #end summary
+
+    def report(self):
+        """ table of the summary, best mean reward first """
+        summary = self.summary()
+        lines = [f"{'strategy':<12}{'games':>8}{'win rate':>10}{'95% CI':>18}{'mean reward':>13}{'95% CI':>20}{'moves':>8}"]
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]["mean_reward"]):
+            lines.append(f"{name:<12}{s['games']:>8}{s['win_rate']:>10.4f}   ({s['win_rate_ci'][0]:.4f}, {s['win_rate_ci'][1]:.4f})"
+                         f"{s['mean_reward']:>13.2f}   ({s['mean_reward_ci'][0]:.2f}, {s['mean_reward_ci'][1]:.2f}){s['mean_moves']:>8.1f}")
+        lines.append(f"{sum(self.games)} games in {self.seconds:.1f}s with {self.workers} workers")
+        return "\n".join(lines)
+    #end report
+#end TournamentClass
+
+def testTournamentClass(numDeals=200):
+    """ the same results with one worker or several, and each strategy plays the deals it says it did """
+    import tempfile
+    strategies = [RandomStrategyClass(), GreedyStrategyClass()]
+    with tempfile.TemporaryDirectory() as path:
+        single = TournamentClass(strategies, numDeals, workers=1, chunk_size=30, results_path=os.path.join(path, "one.csv"))
+        single.run(progress=False)
+        pooled = TournamentClass(strategies, numDeals, workers=2, chunk_size=30, results_path=os.path.join(path, "two.csv"))
+        pooled.run(progress=False)
+        assert single.summary() == pooled.summary()
+        with open(os.path.join(path, "two.csv")) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 1 + 2 * numDeals
+        assert sorted(int(line.split(",")[1]) for line in lines[1:] if line.startswith("greedy")) == list(range(numDeals))
+
+    # PositionClass deals and plays the same games
+    for strategy in strategies:
+        for seed in range(5):
+            assert playDeal(strategy, seed) == playDeal(strategy, seed, compact=False)
+    print(pooled.report())
+    print("TournamentClass ok")
+#end testTournamentClass
+
+if __name__ == "__main__":
+    #testTournamentClass()
+    tournament = TournamentClass([RandomStrategyClass(), GreedyStrategyClass()], num_deals=100000)
+    tournament.run()
+    print(tournament.report())
+# End if __name__ == "__main__":
@@ -0,0 +1,177 @@
+# TrajectoryRecorderClass.py
+# Laurence Smith
+
+# Records every step the environment takes to disk for training on later, in 11 bytes a step instead of a
+# 13x24 int32 observation (1248 bytes). Each step is
+#   seed    - uint32 seed of the deal, PositionClass.setUp(seed) deals the same game again
+#   action  - uint16 action index (into CardTables.MOVE_ENUMERATION)
+#   reward  - float32 reward after the step
+#   flags   - uint8 TERMINATED, TRUNCATED and FIRST_STEP (first step of a game) bits
+# so the whole game can be got back by dealing the seed and making the moves again.
+# Steps go into chunk_000000.bin, chunk_000001.bin, ... in a directory, each chunk holding up to chunk_steps
+# steps. Files are only ever appended to so a recording can be read while it is still being written, and
+# recording into the same directory again carries on where it left off.
+# Use with OpenAiGymSolitaireClass(recorder=TrajectoryRecorderClass("games")), and read back with
+# TrajectoryReaderClass("games").
+
+import glob
+import os
+import random
+from collections import namedtuple
+
+import numpy as np
+
+from CardTables import MOVE_ENUMERATION
+
+STEP_DTYPE = np.dtype([("seed", "<u4"), ("action", "<u2"), ("reward", "<f4"), ("flags", "u1")]) # packed, 11 bytes
+TERMINATED = 1
+TRUNCATED = 2
+FIRST_STEP = 4
+
+Transition = namedtuple("Transition", ["seed", "action", "reward", "terminated", "truncated", "first"])
+
+def _chunkName(path, number):
+    return os.path.join(path, f"chunk_{number:06d}.bin")
+
+def _chunks(path):
+    """ chunk files in a recording in order """
+    return sorted(glob.glob(os.path.join(path, "chunk_*.bin")))
+
+class TrajectoryRecorderClass():
+    """ appends steps to chunked binary files, buffering buffer_steps of them in memory between writes """
+    def __init__(self, path, chunk_steps=1 << 20, buffer_steps=4096) -> None:
+        self.path = path
+        self.chunk_steps = chunk_steps
+        os.makedirs(path, exist_ok=True)
+        chunks = _chunks(path)
+        self.chunk = len(chunks) - 1 if chunks else 0 # carry on in the last chunk if there's room
+        self.chunk_used = os.path.getsize(chunks[-1]) // STEP_DTYPE.itemsize if chunks else 0
+        self.buffer = np.zeros(buffer_steps, dtype=STEP_DTYPE)
+        self.buffered = 0
+        self.steps = 0 # recorded by this recorder
+    #end __init__
+
+    def record(self, seed, action, reward, terminated, truncated, first):
+        """ add one step, only written to disk when the buffer is full or on flush """
+        flags = (TERMINATED if terminated else 0) | (TRUNCATED if truncated else 0) | (FIRST_STEP if first else 0)
+        self.buffer[self.buffered] = (seed, action, reward, flags)
+        self.buffered += 1
+        self.steps += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+    #end record
+
+    def flush(self):
+        """ write the buffered steps to the end of the chunk files """
+        done = 0
+        while done < self.buffered:
+            if self.chunk_used >= self.chunk_steps: # the last chunk can be bigger if it was recorded with a bigger chunk_steps
+                self.chunk += 1
+                self.chunk_used = 0
+            n = min(self.buffered - done, self.chunk_steps - self.chunk_used)
+            with open(_chunkName(self.path, self.chunk), "ab") as f:
+                f.write(self.buffer[done:done + n].tobytes())
+            self.chunk_used += n
+            done += n
+        self.buffered = 0
+    #end flush
+
+    def close(self):
+        self.flush()
+#end TrajectoryRecorderClass
+
+class TrajectoryReaderClass():
+    """ reads a recording back a chunk at a time """
+    def __init__(self, path) -> None:
+        self.path = path
+    #end __init__
+
+    def steps(self):
+        """ the raw steps as STEP_DTYPE arrays, one per chunk, memory mapped so nothing is read until used """
+        for name in _chunks(self.path):
+            count = os.path.getsize(name) // STEP_DTYPE.itemsize
+            if count:
+                yield np.memmap(name, dtype=STEP_DTYPE, mode="r", shape=(count,))
+
+    def transitions(self):
+        """ every step as a Transition """
+        for chunk in self.steps():
+            for seed, action, reward, flags in chunk.tolist():
+                yield Transition(seed, action, reward, bool(flags & TERMINATED), bool(flags & TRUNCATED), bool(flags & FIRST_STEP))
+    #end transitions
+
+    def episodes(self):
+        """ (seed, list of Transitions) for each game, a game still being recorded comes out as far as it has got """
+        seed = None
+        episode = []
+        for transition in self.transitions():
+            if transition.first and episode:
+                yield seed, episode
+                episode = []
+            seed = transition.seed
+            episode.append(transition)
+        if episode:
+            yield seed, episode
+    #end episodes
+
+    def replay(self, compact=False):
+        """ (transition, observation after the step) for every step, rebuilding the positions by dealing each seed
+            and making the moves again, compact=True uses CompactPositionClass which is much faster """
+        if compact:
+            from CompactPositionClass import CompactPositionClass as positionClass
+        else:
+            from PositionClass import PositionClass as positionClass
+        for seed, episode in self.episodes():
+            pos = positionClass()
+            pos.setUp(seed)
+            for transition in episode:
+                pos.moveByNumber(int(MOVE_ENUMERATION[transition.action]))
+                yield transition, pos.toObservation(copy=True)
+    #end replay
+#end TrajectoryReaderClass
+
+def testTrajectoryRecorderClass(numEpisodes=20):
+    """ record some random play, check the replayed observations match the ones the environment gave """
+    import tempfile
+    from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+    random.seed(0)
+    np.random.seed(0)
+    with tempfile.TemporaryDirectory() as path:
+        recorder = TrajectoryRecorderClass(path, chunk_steps=500, buffer_steps=64)
+        env = OpenAiGymSolitaireClass(recorder=recorder, max_episode_steps=100)
+        env.action_space.seed(0)
+        observations = []
+        for episode in range(numEpisodes):
+            env.reset()
+            done = False
+            while not done:
+                legal = env.legal_actions()
+                action = random.choice(legal) if legal and random.random() < 0.99 else env.action_space.sample()
+                observation, reward, terminated, truncated, info = env.step(action)
+                observations.append(observation.copy())
+                done = terminated or truncated
+        env.close()
+
+        reader = TrajectoryReaderClass(path)
+        assert len(list(reader.episodes())) == numEpisodes
+        for compact in (False, True):
+            replayed = list(reader.replay(compact))
+            assert len(replayed) == len(observations)
+            for (transition, observation), expected in zip(replayed, observations):
+                assert np.array_equal(observation, expected)
+
+        # carry on the recording with smaller chunks than the last one already has
+        recorder = TrajectoryRecorderClass(path, chunk_steps=100, buffer_steps=64)
+        for step in range(250):
+            recorder.record(step, 0, 0.0, False, False, step == 0)
+        recorder.close()
+        chunkSteps = [os.path.getsize(name) // STEP_DTYPE.itemsize for name in _chunks(path)]
+        assert sum(chunkSteps) == len(observations) + 250 and chunkSteps[-3:] == [100, 100, 50]
+        size = sum(os.path.getsize(name) for name in _chunks(path))
+        print("TrajectoryRecorderClass ok,", sum(chunkSteps), "steps in", size, "bytes over", len(_chunks(path)), "chunks")
+#end testTrajectoryRecorderClass
+
+if __name__ == "__main__":
+    #testTrajectoryRecorderClass()
+    pass
+# End if __name__ == "__main__":
@@ -0,0 +1,226 @@
+# benchmark.py
+# times the hot parts of the game engine and the gym environment so slow downs get noticed
+#
+# python benchmark.py                                  run everything and print the results
+# python benchmark.py --output bench.json              also write them as json
+# python benchmark.py --save-baseline                  write them to the baseline file
+# python benchmark.py --baseline benchmark_baseline.json   compare against a baseline, exit code 1 if anything got slower
+#
+# each result is {"value": ..., "unit": ..., "higher_is_better": ...}, timings are the best of a few repeats
+# higher_is_better None is only reported, never compared against the baseline
+# the baseline only means anything on the machine it was made on so make it there
+
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import PositionClass
+from CompactPositionClass import CompactPositionClass
+from OpenAiGymSolitaireClass import OpenAiGymSolitaireClass
+from CardTables import MOVE_KINDS, MOVE_DECODE
+
+def _best(func, repeats):
+    """ best time of repeats calls to func """
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+@contextlib.contextmanager
+def _quiet():
+    """ keep the progress printed by train out of the timings """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _collectMoves(perType, seed):
+    """ positions (as both PositionClass and CompactPositionClass) with a legal move of each type, from random games """
+    random.seed(seed)
+    found = {t: [] for t in MOVE_KINDS}
+    while any(len(found[t]) < perType for t in MOVE_KINDS):
+        state = random.getstate()
+        pos = PositionClass.PositionClass()
+        pos.setUp()
+        random.setstate(state)
+        compact = CompactPositionClass()
+        compact.setUp()
+        for step in range(300):
+            moves = compact.legalMoves()
+            if not moves:
+                break
+            for move in moves:
+                t = MOVE_KINDS[MOVE_DECODE[move].kind]
+                if len(found[t]) < perType:
+                    found[t].append((copy.deepcopy(pos), compact.copy(), move))
+            move = random.choice(moves)
+            pos.moveByNumber(move)
+            compact.moveByNumber(move)
+    return found
+
+def benchMoves(results, perType, repeats):
+    """ moveByNumber moves/sec for each type of move on both engines """
+    with _quiet():
+        found = _collectMoves(perType, seed=1)
+        for t in MOVE_KINDS:
+            for engine in ("compact", "position"):
+                best = None
+                for i in range(repeats): # moves change the positions so each repeat needs fresh copies
+                    if engine == "compact":
+                        batch = [(c.copy(), m) for p, c, m in found[t]]
+                    else:
+                        batch = [(copy.deepcopy(p), m) for p, c, m in found[t]]
+                    start = time.perf_counter()
+                    for pos, move in batch:
+                        pos.moveByNumber(move)
+                    elapsed = time.perf_counter() - start
+                    if best is None or elapsed < best:
+                        best = elapsed
+                results[f"move_{t}_{engine}_per_sec"] = _result(len(batch) / best, "moves/s", True)
+
+def benchSetUp(results, deals, repeats):
+    """ deals/sec for setUp on both engines """
+    for engine, cls in (("compact", CompactPositionClass), ("position", PositionClass.PositionClass)):
+        n = deals if cls is CompactPositionClass else max(1, deals // 10)
+        def run():
+            for i in range(n):
+                cls().setUp()
+        results[f"setup_{engine}_per_sec"] = _result(n / _best(run, repeats), "deals/s", True)
+
+def benchEnvCalls(results, calls, repeats):
+    """ latency of the calls made every step: observation (cached and after a move), reward, legal actions """
+    random.seed(2)
+    env = OpenAiGymSolitaireClass(verbose=False)
+    env.reset()
+    results["observation_cached_us"] = _result(_best(lambda: [env.positionClass_to_observation() for i in range(calls)], repeats) / calls * 1e6, "us", False)
+    def afterMove():
+        for i in range(calls):
+            env.pos.moveByNumber(1)
+            env.positionClass_to_observation()
+    moveOnly = _best(lambda: [env.pos.moveByNumber(1) for i in range(calls)], repeats)
+    results["observation_after_move_us"] = _result(max(_best(afterMove, repeats) - moveOnly, 0) / calls * 1e6, "us", False)
+    results["calculate_reward_us"] = _result(_best(lambda: [env.calculate_reward() for i in range(calls)], repeats) / calls * 1e6, "us", False)
+    results["action_masks_us"] = _result(_best(lambda: [env.action_masks() for i in range(calls)], repeats) / calls * 1e6, "us", False)
+
+def benchEnvStep(results, steps, repeats):
+    """ steps/sec and resets/sec of the environment playing random legal moves """
+    random.seed(3)
+    np.random.seed(3)
+    env = OpenAiGymSolitaireClass(verbose=False, max_episode_steps=None)
+    def run():
+        env.reset()
+        total = 0.0
+        for i in range(steps):
+            legal = env.legal_actions()
+            action = legal[np.random.randint(len(legal))] if legal else 0
+            start = time.perf_counter()
+            observation, reward, terminated, truncated, info = env.step(action)
+            total += time.perf_counter() - start
+            if terminated or truncated:
+                env.reset()
+        return total
+    with _quiet():
+        best = min(run() for i in range(repeats))
+        resets = max(1, steps // 10)
+        resetTime = _best(lambda: [env.reset() for i in range(resets)], repeats)
+    results["env_step_per_sec"] = _result(steps / best, "steps/s", True)
+    results["env_reset_per_sec"] = _result(resets / resetTime, "resets/s", True)
+
+def benchTrain(results, episodes, repeats):
+    """ episodes/sec of train, plain and legal moves only, and memory per state in the q_table """
+    for name, legal_only, max_steps in (("train", False, 1000), ("train_legal_only", True, 100)):
+        random.seed(4)
+        np.random.seed(4)
+        env = OpenAiGymSolitaireClass(verbose=False, max_episode_steps=max_steps)
+        env.action_space.seed(4)
+        with _quiet():
+            best = _best(lambda: env.train(episodes, legal_only=legal_only), repeats)
+        results[f"{name}_episodes_per_sec"] = _result(episodes / best, "episodes/s", True)
+
+    q_table = env.q_table
+    size = sys.getsizeof(q_table) + sum(sys.getsizeof(state) + sys.getsizeof(row) for state, row in q_table.items())
+    results["qtable_bytes_per_state"] = _result(size / max(1, len(q_table)), "bytes", False)
+    results["qtable_states"] = _result(len(q_table), "states", None) # not a speed, just reported
+
+def runAll(quick=False):
+    """ run every benchmark and return the results dict """
+    scale = 0.2 if quick else 1.0
+    repeats = 2 if quick else 3
+    results = {}
+    benchMoves(results, perType=max(20, int(200 * scale)), repeats=repeats)
+    benchSetUp(results, deals=max(50, int(2000 * scale)), repeats=repeats)
+    benchEnvCalls(results, calls=max(200, int(5000 * scale)), repeats=repeats)
+    benchEnvStep(results, steps=max(200, int(5000 * scale)), repeats=repeats)
+    benchTrain(results, episodes=max(20, int(200 * scale)), repeats=repeats)
+    return results
+
+def compare(results, baseline, tolerance):
+    """ names of results more than tolerance (fraction) worse than the baseline """
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        if name not in results or base["value"] == 0 or results[name]["higher_is_better"] is None:
+            continue
+        value = results[name]["value"]
+        change = (value - base["value"]) / base["value"]
+        if not base["higher_is_better"]:
+            change = -change
+        if change < -tolerance:
+            regressions.append((name, base["value"], value, change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the solitaire engine and environment")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="baseline json file to compare against or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction worse than the baseline that counts as a regression")
+    parser.add_argument("--quick", action="store_true", help="smaller runs, noisier numbers")
+    args = parser.parse_args(argv)
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "results": runAll(args.quick),
+    }
+    for name, result in report["results"].items():
+        print(f"{name:45s} {result['value']:14.2f} {result['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before:.2f} -> {after:.2f} ({change:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+# End if __name__ == "__main__":
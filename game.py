@@ -1,8 +1,25 @@
 # game.py
 # allows you to play the solitaire game
+#
+# python game.py                          play a game here
+# python game.py --serve --port 8765      serve games to lots of players at once over TCP (or --unix PATH), see GameServerClass.py
+# python game.py --load-test --port 8765  play lots of random games against a server to see how it copes
+
+import argparse
 
 import PositionClass
 
+HELP_TEXT = """keys:
+            q = quit
+            h = help
+            1 = move stock to waste (and back)
+            2 = move waste to foundation
+            10-16 = move tableau piles 0 to 6 to foundation
+            20-26 = move waste to tableau pile 0 to 6
+            100 - 136 = code - 1ij - move foundation pile i to tableau pile j
+            10000 - 16613 = code - 1ijkl - move kl cards from tableau pile i to tableau pile j
+            """
+
 def interactivePlay():
     """ Allows you to play an interactive game of solitaire """
     stop = False
@@ -16,17 +33,7 @@ def interactivePlay():
             stop = True
             print("Thank you for playing")
         elif k=="h":
-            s = """keys:
-            q = quit
-            h = help
-            1 = move stock to waste (and back)
-            2 = move waste to foundation
-            10-16 = move tableau piles 0 to 6 to foundation
-            20-26 = move waste to tableau pile 0 to 6
-            100 - 136 = code - 1ij - move foundation pile i to tableau pile j
-            10000 - 16613 = code - 1ijkl - move kl cards from tableau pile i to tableau pile j
-            """
-            print(s)
+            print(HELP_TEXT)
         elif k.isdigit():
             ret = pos.moveByNumber(int(k))
             if ret == False:
@@ -40,6 +47,34 @@ def interactivePlay():
     
 #end interactivePlay
 
+def main():
+    parser = argparse.ArgumentParser(description="play solitaire, or serve games over a socket")
+    parser.add_argument("--serve", action="store_true", help="run the game server")
+    parser.add_argument("--load-test", action="store_true", help="play random games against a running server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="unix socket path to use instead of TCP")
+    parser.add_argument("--idle-timeout", type=float, default=300.0, help="seconds a session can do nothing before it is closed")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=1000, help="load test clients")
+    parser.add_argument("--moves", type=int, default=100, help="moves each load test client makes")
+    args = parser.parse_args()
+
+    if args.serve or args.load_test:
+        import asyncio
+        import GameServerClass
+        if args.serve:
+            server = GameServerClass.GameServerClass(idle_timeout=args.idle_timeout, max_sessions=args.max_sessions)
+            try:
+                asyncio.run(server.serveForever(args.host, args.port, args.unix))
+            except KeyboardInterrupt:
+                pass
+        else:
+            print(asyncio.run(GameServerClass.loadTest(args.host, args.port, args.unix, args.clients, args.moves)))
+    else:
+        interactivePlay()
+#end main
+
 if __name__ == "__main__":
-    interactivePlay()
-# End if __name__ == "__main__":
\ No newline at end of file
+    main()
+# End if __name__ == "__main__":